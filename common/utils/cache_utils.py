@@ -13,6 +13,11 @@ class RedisCache:
     Redis缓存工具类，提供便捷的缓存操作方法
     """
 
+    # 命名空间版本号的缓存键，命名空间下的缓存键都包含当前版本号
+    NAMESPACE_VERSION_KEY = "cache_namespace:{}"
+    # SCAN每次迭代返回的键数量参考值，以及批量删除的键数量
+    SCAN_BATCH_SIZE = 1000
+
     @staticmethod
     def get_cache_key(prefix: str, *args, **kwargs) -> str:
         """
@@ -141,25 +146,72 @@ class RedisCache:
             logger.warning(f"递减缓存失败 - 键:{key}, 错误:{str(e)}")
             return 0
 
+    @staticmethod
+    def get_namespace_version(namespace: str) -> int:
+        """
+        获取命名空间的当前版本号
+
+        Args:
+            namespace: 命名空间
+
+        Returns:
+            int: 版本号，从未失效过的命名空间为0
+        """
+        version = RedisCache.get(RedisCache.NAMESPACE_VERSION_KEY.format(namespace))
+        return int(version) if version is not None else 0
+
+    @staticmethod
+    def invalidate_namespace(namespace: str) -> int:
+        """
+        使命名空间下的全部缓存失效
+
+        只递增命名空间的版本号，之后生成的缓存键使用新版本号，旧版本的键不再被读取，
+        由过期时间自然淘汰。耗时与Redis中的键数量无关
+
+        Args:
+            namespace: 命名空间
+
+        Returns:
+            int: 新的版本号，失败时返回0
+        """
+        key = RedisCache.NAMESPACE_VERSION_KEY.format(namespace)
+        try:
+            # 版本号不过期，不存在时先创建再递增
+            cache.add(key, 0, timeout=None)
+            return cache.incr(key)
+        except Exception as e:
+            logger.warning(f"递增缓存命名空间版本失败 - 命名空间:{namespace}, 错误:{str(e)}")
+            return 0
+
     @staticmethod
     def clear_pattern(pattern: str) -> int:
         """
         清除匹配模式的所有缓存
 
+        使用SCAN分批遍历并删除，不会像KEYS一样长时间阻塞Redis；仍需遍历整个键空间，
+        只用于确实需要删除键的批量清理，日常的缓存失效使用invalidate_namespace
+
         Args:
-            pattern: 键模式，例如"user:*"
+            pattern: 键模式（与set时使用的键相同），例如"user:*"
 
         Returns:
             int: 清除的缓存数量
         """
         try:
-            # 获取Redis连接
+            # 获取Redis连接，模式加上缓存配置的键前缀和版本
             client = cache.client.get_client()
-            keys = client.keys(f"*{cache.key_prefix}:{pattern}*")
-            if keys:
-                client.delete(*keys)
-                return len(keys)
-            return 0
+            match = cache.make_key(pattern)
+
+            deleted = 0
+            batch = []
+            for key in client.scan_iter(match=match, count=RedisCache.SCAN_BATCH_SIZE):
+                batch.append(key)
+                if len(batch) >= RedisCache.SCAN_BATCH_SIZE:
+                    deleted += client.delete(*batch)
+                    batch = []
+            if batch:
+                deleted += client.delete(*batch)
+            return deleted
         except Exception as e:
             logger.warning(f"清除缓存模式失败 - 模式:{pattern}, 错误:{str(e)}")
             return 0
@@ -213,7 +265,13 @@ class RedisCache:
             raise
 
 
-def cached(prefix: str, timeout: Optional[int] = None, key_func: Optional[Callable] = None):
+def cached(
+    prefix: str,
+    timeout: Optional[int] = None,
+    key_func: Optional[Callable] = None,
+    validator: Optional[Callable] = None,
+    namespace: Optional[str] = None,
+):
     """
     函数结果缓存装饰器
 
@@ -221,6 +279,8 @@ def cached(prefix: str, timeout: Optional[int] = None, key_func: Optional[Callab
         prefix: 缓存键前缀
         timeout: 过期时间(秒)
         key_func: 自定义键生成函数
+        validator: 校验缓存结果是否仍然有效的函数，参数为(缓存结果, *args, **kwargs)，返回False时视为未命中
+        namespace: 缓存所属的命名空间，缓存键包含命名空间的版本号，RedisCache.invalidate_namespace后全部失效
 
     Returns:
         装饰器函数
@@ -229,15 +289,20 @@ def cached(prefix: str, timeout: Optional[int] = None, key_func: Optional[Callab
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            # 生成缓存键
+            # 生成缓存键，命名空间版本号作为前缀的一部分
+            key_prefix = f"{prefix}:v{RedisCache.get_namespace_version(namespace)}" if namespace else prefix
             if key_func:
-                cache_key = key_func(prefix, *args, **kwargs)
+                cache_key = key_func(key_prefix, *args, **kwargs)
             else:
-                cache_key = RedisCache.get_cache_key(prefix, *args, **kwargs)
+                cache_key = RedisCache.get_cache_key(key_prefix, *args, **kwargs)
 
             # 尝试从缓存获取
             result = RedisCache.get(cache_key)
 
+            if result is not None and validator and not validator(result, *args, **kwargs):
+                logger.debug(f"缓存结果已失效 - 键:{cache_key}")
+                result = None
+
             if result is None:
                 # 缓存未命中，执行函数
                 start_time = time.time()
@@ -0,0 +1,287 @@
+"""
+限流工具，提供进程内的令牌桶和并发请求数限制，以及保存在Redis中、所有进程共用的全局令牌桶
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from loguru import logger
+
+
+class TokenBucket:
+    """
+    令牌桶，按每分钟的速率补充令牌
+
+    采用预约方式：取令牌时立即扣除，余额不足时余额变为负数，调用方等待到余额补足的时刻再继续，
+    并发的调用方因此按取令牌的先后顺序排队，不会互相饿死
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        初始化令牌桶
+
+        Args:
+            rate_per_minute: 每分钟补充的令牌数，0表示不限制
+            capacity: 桶容量，即允许的突发量，默认为1秒的补充量（至少为1）
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(self.rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        预约令牌
+
+        Args:
+            amount: 需要的令牌数，超过桶容量时按桶容量计算，否则永远无法满足
+
+        Returns:
+            float: 需要等待的秒数，0表示可以立即继续
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self, amount: float = 1) -> float:
+        """
+        取令牌，余额不足时阻塞等待
+
+        Args:
+            amount: 需要的令牌数
+
+        Returns:
+            float: 实际等待的秒数
+        """
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class GlobalTokenBucket:
+    """
+    保存在Redis中的全局令牌桶，所有进程（Web进程和各Celery worker）共用同一份请求数和token数配额
+
+    取令牌由一个Lua脚本原子完成（以Redis服务器时间补充令牌，两个桶都足够时才同时扣除）。
+    配额分为两个优先级：批量任务（文档索引、模型迁移）只能使用桶容量中保留部分以外的令牌，
+    交互请求（检索时的查询向量化）可以使用全部令牌，批量任务用满配额时交互请求仍然有余量
+    """
+
+    PRIORITY_INTERACTIVE = "interactive"
+    PRIORITY_BULK = "bulk"
+
+    # KEYS: 请求数桶, token数桶；ARGV: 每个桶的(每秒补充量, 容量, 需要的数量)，以及保留给交互请求的容量比例
+    # 返回需要等待的秒数（字符串，Redis会把Lua数字截断为整数），"0"表示已扣除
+    SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local reserve_ratio = tonumber(ARGV[7])
+local wait = 0
+local states = {}
+for i = 1, 2 do
+    local rate = tonumber(ARGV[i * 3 - 2])
+    local capacity = tonumber(ARGV[i * 3 - 1])
+    local amount = tonumber(ARGV[i * 3])
+    if rate > 0 and amount > 0 then
+        local data = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+        local tokens = tonumber(data[1]) or capacity
+        local ts = tonumber(data[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+        local floor = capacity * reserve_ratio
+        amount = math.min(amount, capacity - floor)
+        local missing = amount + floor - tokens
+        if missing > 0 then
+            wait = math.max(wait, missing / rate)
+        end
+        states[#states + 1] = {KEYS[i], tokens - amount, math.ceil(capacity / rate) + 60}
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for _, state in ipairs(states) do
+    redis.call('HSET', state[1], 'tokens', tostring(state[2]), 'ts', tostring(now))
+    redis.call('EXPIRE', state[1], state[3])
+end
+return '0'
+"""
+
+    # Redis不可用时放行请求（只受进程内限流器限制），之后每隔该秒数再尝试一次
+    RETRY_REDIS_SECONDS = 30
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        bulk_reserve_ratio: float = 0.2,
+        burst_seconds: float = 1.0,
+    ):
+        """
+        初始化全局令牌桶
+
+        Args:
+            name: 配额名称，同名的令牌桶共用配额
+            requests_per_minute: 全局每分钟请求数上限，0表示不限制
+            tokens_per_minute: 全局每分钟token数上限，0表示不限制
+            bulk_reserve_ratio: 桶容量中只能由交互请求使用的比例
+            burst_seconds: 桶容量为多少秒的补充量，即允许的突发量
+        """
+        self.name = name
+        self.request_rate = requests_per_minute / 60.0
+        self.token_rate = tokens_per_minute / 60.0
+        self.request_capacity = max(self.request_rate * burst_seconds, 1.0)
+        self.token_capacity = max(self.token_rate * burst_seconds, 1.0)
+        self.bulk_reserve_ratio = min(max(bulk_reserve_ratio, 0.0), 0.9)
+        self.keys = [f"smartdocs:rate_limit:{name}:requests", f"smartdocs:rate_limit:{name}:tokens"]
+
+        self._script = None
+        self._redis_retry_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.request_rate > 0 or self.token_rate > 0
+
+    def _get_script(self):
+        """注册Lua脚本，之后以EVALSHA执行"""
+        if self._script is None:
+            from common.utils.cache_utils import RedisCache
+
+            self._script = RedisCache.get_redis_client().register_script(self.SCRIPT)
+        return self._script
+
+    def try_acquire(self, tokens: int = 0, priority: str = PRIORITY_BULK) -> float:
+        """
+        尝试取一次请求和tokens个token
+
+        Args:
+            tokens: 本次请求的token数
+            priority: 优先级，PRIORITY_INTERACTIVE或PRIORITY_BULK
+
+        Returns:
+            float: 0表示已取得，否则为余额补足前预计需要等待的秒数
+        """
+        reserve_ratio = 0.0 if priority == self.PRIORITY_INTERACTIVE else self.bulk_reserve_ratio
+        wait = self._get_script()(
+            keys=self.keys,
+            args=[
+                self.request_rate,
+                self.request_capacity,
+                1,
+                self.token_rate,
+                self.token_capacity,
+                tokens,
+                reserve_ratio,
+            ],
+        )
+        return float(wait)
+
+    def acquire(self, tokens: int = 0, priority: str = PRIORITY_BULK, timeout: Optional[float] = None) -> bool:
+        """
+        取得全局配额，余额不足时等待
+
+        Args:
+            tokens: 本次请求的token数
+            priority: 优先级，交互请求可以使用保留的余量，并且更频繁地重试
+            timeout: 最长等待秒数，None表示一直等待
+
+        Returns:
+            bool: 是否取得配额；Redis不可用时直接返回True
+        """
+        if not self.enabled or time.monotonic() < self._redis_retry_at:
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # 交互请求按预计时间重试，批量请求至少间隔50ms，减少对Redis的轮询
+        min_sleep = 0.005 if priority == self.PRIORITY_INTERACTIVE else 0.05
+        while True:
+            try:
+                wait = self.try_acquire(tokens, priority)
+            except Exception as e:
+                self._script = None
+                self._redis_retry_at = time.monotonic() + self.RETRY_REDIS_SECONDS
+                logger.warning(f"全局限流不可用，{self.RETRY_REDIS_SECONDS}秒内只使用进程内限流: {str(e)}")
+                return True
+
+            if wait <= 0:
+                return True
+            sleep = max(wait, min_sleep)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                sleep = min(sleep, remaining)
+            time.sleep(sleep)
+
+
+class RateLimiter:
+    """同时限制进行中的请求数、每分钟请求数和每分钟token数，可以再叠加所有进程共用的全局配额"""
+
+    def __init__(
+        self,
+        max_in_flight: int = 0,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        global_bucket: Optional[GlobalTokenBucket] = None,
+        interactive_max_wait: Optional[float] = None,
+    ):
+        """
+        初始化限流器
+
+        Args:
+            max_in_flight: 同时进行中的请求数上限，0表示不限制
+            requests_per_minute: 每分钟请求数上限，0表示不限制
+            tokens_per_minute: 每分钟token数上限，0表示不限制
+            global_bucket: 所有进程共用的全局令牌桶
+            interactive_max_wait: 交互请求等待全局配额的最长秒数，超时后仍然发送请求，None表示一直等待
+        """
+        self.max_in_flight = max_in_flight
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.global_bucket = global_bucket
+        self.interactive_max_wait = interactive_max_wait
+
+    @contextmanager
+    def limit(self, tokens: int = 0, priority: str = GlobalTokenBucket.PRIORITY_BULK):
+        """
+        在限流内执行一次请求，每次尝试（包括重试）都需要进入一次
+
+        Args:
+            tokens: 本次请求的token数
+            priority: 全局配额的优先级，GlobalTokenBucket.PRIORITY_INTERACTIVE或PRIORITY_BULK
+
+        Yields:
+            float: 因速率限制等待的秒数
+        """
+        started = time.monotonic()
+        if self.global_bucket is not None:
+            # 先取全局配额再占用进程内的并发名额，等待全局配额的批量请求不会挡住同一进程的交互请求
+            interactive = priority == GlobalTokenBucket.PRIORITY_INTERACTIVE
+            timeout = self.interactive_max_wait if interactive else None
+            if not self.global_bucket.acquire(tokens, priority, timeout=timeout):
+                logger.warning(f"交互请求等待全局配额超过{timeout}秒，直接发送请求")
+
+        if self._in_flight is not None:
+            self._in_flight.acquire()
+        try:
+            # 两个桶同时预约，只等待较长的一个
+            wait = max(self.request_bucket.reserve(1), self.token_bucket.reserve(tokens) if tokens else 0.0)
+            if wait > 0:
+                logger.debug(f"达到速率限制，等待{wait:.2f}秒后发送请求")
+                time.sleep(wait)
+            yield time.monotonic() - started
+        finally:
+            if self._in_flight is not None:
+                self._in_flight.release()
@@ -14,11 +14,11 @@ class DocumentsConfig(AppConfig):
         我们已在VectorDBService中实现了防止重复加载的机制
         """
         # 导入这里以避免循环导入问题
+        from .services.model_storage import get_active_model_version
         from .services.vector_db_service import VectorDBService
-        from django.conf import settings
 
-        # 获取默认的嵌入模型版本
-        default_embedding_model = settings.EMBEDDING_MODEL_VERSION
+        # 获取当前提供检索的嵌入模型版本（未迁移过时为settings中的默认版本）
+        default_embedding_model = get_active_model_version()
 
         # 异步预加载默认模型的向量索引
         logger.info(f"Django应用启动，开始预加载FAISS索引(默认模型版本: {default_embedding_model})...")
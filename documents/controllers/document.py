@@ -60,11 +60,11 @@ def delete_document(request, document_id: int):
     """软删除文档"""
     document = get_object_or_404(Document, id=document_id, owner_id=request.auth.id)
 
-    # 使用软删除，不需要删除chunks和向量
+    # 使用软删除，保留chunks
     document.soft_delete()
 
-    # 清除所有向量搜索缓存，因为删除文档会影响搜索结果
-    VectorDBService.clear_search_cache()
+    # 向量标记为已删除，搜索时直接在FAISS中过滤；缓存中包含该文档的结果会在命中时重新搜索，无需清空全部缓存
+    VectorDBService.delete_document_vectors(document.id)
 
     return {"success": True, "message": "文档已删除"}
 
@@ -88,7 +88,10 @@ def reindex_document(request, document_id: int, reindex_data: ReindexDocumentIn
         if getattr(settings, "EMBEDDING_SERVICE_TYPE", "api") == "local":
             embedding_model_version = settings.LOCAL_EMBEDDING_MODEL
         else:
-            embedding_model_version = settings.EMBEDDING_MODEL_VERSION
+            # 迁移切换后使用当前提供检索的模型版本
+            from documents.services.model_storage import get_active_model_version
+
+            embedding_model_version = get_active_model_version()
 
     # 在后台线程重新处理文档
     # 更新文档状态
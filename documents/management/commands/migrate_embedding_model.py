@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.services.model_migration import EmbeddingModelMigration
+from documents.services.model_storage import get_active_model, model_storage_path
+
+
+class Command(BaseCommand):
+    help = "在后台为新的嵌入模型构建索引，旧模型继续提供检索，追上后切换检索模型（不需要rebuild_index --clear停机重建）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", type=str, help="迁移到的嵌入模型版本，例如 BAAI/bge-small-zh-v1.5")
+        parser.add_argument("--batch-size", type=int, default=256, help="每批向量化并提交的文档块数量")
+        parser.add_argument(
+            "--no-switch", action="store_true", help="只构建新模型的索引，不切换检索模型（之后再次执行即可切换）"
+        )
+        parser.add_argument(
+            "--catch-up-threshold", type=int, default=0, help="一轮补齐的文档块不超过该数量时视为已追上并切换"
+        )
+        parser.add_argument("--max-passes", type=int, default=10, help="切换前最多补齐的轮数")
+        parser.add_argument(
+            "--grace-seconds", type=float, default=5.0, help="切换后等待各进程读取新检索模型的时间，之后再补齐一轮"
+        )
+
+    def handle(self, *args, **options):
+        target_version = options["model"]
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size必须大于0")
+
+        active = get_active_model()
+        self.stdout.write(self.style.WARNING("=== 开始迁移嵌入模型 ==="))
+        self.stdout.write(f"当前检索模型: {active['embedding_model_version']}")
+        self.stdout.write(f"目标模型: {target_version}，索引目录: {model_storage_path(target_version)}")
+
+        migration = EmbeddingModelMigration(
+            target_version, batch_size=options["batch_size"], progress_callback=self._report_progress
+        )
+        result = migration.run(
+            switch=not options["no_switch"],
+            catch_up_threshold=options["catch_up_threshold"],
+            max_passes=options["max_passes"],
+            grace_seconds=options["grace_seconds"],
+        )
+
+        self.stdout.write("=" * 50)
+        self.stdout.write(
+            f"共{result['pass']}轮补齐，索引{result['indexed']}个文档块，删除{result['removed']}个过期向量，"
+            f"耗时{result['elapsed']:.1f}秒，平均{result['rate']:.1f}个文档块/秒"
+        )
+        if result["switched"]:
+            self.stdout.write(self.style.SUCCESS(f"检索模型已切换为: {target_version}"))
+        elif get_active_model()["embedding_model_version"] == target_version:
+            self.stdout.write(self.style.SUCCESS(f"检索模型已是: {target_version}"))
+        else:
+            self.stdout.write(self.style.WARNING("未切换检索模型"))
+        self.stdout.write(f"更新了{result['documents_updated']}个文档的模型版本")
+
+    def _report_progress(self, progress):
+        """每提交一批后输出进度"""
+        eta = f"，预计剩余{progress['eta']:.0f}秒" if progress["eta"] is not None else ""
+        self.stdout.write(
+            f"  第{progress['pass']}轮 [{progress['pass_indexed']}/{progress['pass_total']}] "
+            f"累计{progress['indexed']}个文档块，{progress['rate']:.1f}个/秒{eta}"
+        )
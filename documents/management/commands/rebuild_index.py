@@ -3,11 +3,14 @@ import time
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from loguru import logger
-import redis
 
+from common.utils.cache_utils import RedisCache
 from documents.models import Document
 from documents.services.vector_db_service import VectorDBService
 from documents.services.document_processor import DocumentProcessor
+from documents.services.model_storage import adopt_root_storage, get_active_model_version, model_storage_path
+from documents.services.raw_vector_store import RawVectorStore
+from documents.services.vector_segment_store import VectorSegmentStore
 
 
 class Command(BaseCommand):
@@ -29,13 +32,25 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.WARNING("=== 开始重建向量索引 ==="))
 
-        # 获取向量索引文件路径
-        vector_store_path = settings.VECTOR_STORE_PATH
+        # 获取向量索引文件路径，每个模型版本的索引保存在各自的目录下
+        index_version = model_version or get_active_model_version()
+        if index_version == settings.EMBEDDING_MODEL_VERSION:
+            adopt_root_storage(index_version)
+        vector_store_path = model_storage_path(index_version)
+        self.stdout.write(f"模型版本: {index_version}，索引目录: {vector_store_path}")
+        segment_store = VectorSegmentStore(vector_store_path)
+        # 旧版本的单文件索引
         index_file = os.path.join(vector_store_path, "faiss_index.bin")
+        # 旧版本单独保存的向量位置映射文件，新版本索引直接以文档块ID作为向量ID
         mapping_file = os.path.join(vector_store_path, "chunk_mapping.pkl")
 
+        raw_vector_files = [
+            os.path.join(vector_store_path, RawVectorStore.VECTORS_FILE),
+            os.path.join(vector_store_path, RawVectorStore.IDS_FILE),
+        ]
+
         # 步骤1: 删除索引文件
-        self._delete_index_files(index_file, mapping_file)
+        self._delete_index_files(segment_store, index_file, mapping_file, raw_vector_files)
 
         # 步骤2: 清除Redis缓存
         self._clear_redis_cache()
@@ -50,24 +65,34 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.SUCCESS("=== 向量索引重建操作完成 ==="))
 
-    def _delete_index_files(self, index_file, mapping_file):
+    def _delete_index_files(self, segment_store, index_file, mapping_file, raw_vector_files):
         """删除索引文件"""
         self.stdout.write("正在删除索引文件...")
 
         files_deleted = 0
+        if segment_store.exists():
+            segment_count = len(VectorSegmentStore.segment_names(segment_store.read_manifest()))
+            segment_store.clear()
+            self.stdout.write(f"  ✓ 已删除manifest和{segment_count}个索引段文件: {segment_store.manifest_file}")
+            files_deleted += segment_count + 1
+        else:
+            self.stdout.write(f"  - 索引manifest不存在: {segment_store.manifest_file}")
+
         if os.path.exists(index_file):
             os.remove(index_file)
-            self.stdout.write(f"  ✓ 已删除索引文件: {index_file}")
+            self.stdout.write(f"  ✓ 已删除旧版索引文件: {index_file}")
             files_deleted += 1
-        else:
-            self.stdout.write(f"  - 索引文件不存在: {index_file}")
 
         if os.path.exists(mapping_file):
             os.remove(mapping_file)
-            self.stdout.write(f"  ✓ 已删除映射文件: {mapping_file}")
+            self.stdout.write(f"  ✓ 已删除旧版映射文件: {mapping_file}")
             files_deleted += 1
-        else:
-            self.stdout.write(f"  - 映射文件不存在: {mapping_file}")
+
+        for raw_file in raw_vector_files:
+            if os.path.exists(raw_file):
+                os.remove(raw_file)
+                self.stdout.write(f"  ✓ 已删除原始向量文件: {raw_file}")
+                files_deleted += 1
 
         if files_deleted > 0:
             self.stdout.write(self.style.SUCCESS(f"成功删除了 {files_deleted} 个索引相关文件"))
@@ -79,41 +104,24 @@ class Command(BaseCommand):
         self.stdout.write("正在清除Redis缓存...")
 
         try:
-            r = redis.Redis(
-                host=settings.REDIS_HOST,
-                port=settings.REDIS_PORT,
-                db=settings.REDIS_DB,
-                password=settings.REDIS_PASSWORD if hasattr(settings, "REDIS_PASSWORD") else None,
-            )
+            # 按模式分批SCAN删除，不使用会阻塞Redis的KEYS
+            patterns = [
+                ("smartdocs:faiss:updated:*", "索引更新标记"),
+                ("smartdocs:faiss:meta:*", "索引元数据"),
+                (f"{VectorDBService.SEARCH_CACHE_NAMESPACE}:*", "向量搜索缓存"),
+            ]
+            total_keys = 0
+            for pattern, description in patterns:
+                count = RedisCache.clear_pattern(pattern)
+                total_keys += count
+                if count:
+                    self.stdout.write(f"  ✓ 已删除 {count} 个{description}")
+                else:
+                    self.stdout.write(f"  - 未找到{description}")
+
+            # 递增命名空间版本，删除期间写入的搜索缓存和QA检索缓存同样失效
+            VectorDBService.clear_search_cache()
 
-            # 清除索引更新标记
-            pattern_update = "smartdocs:faiss:updated:*"
-            keys_update = r.keys(pattern_update)
-            if keys_update:
-                r.delete(*keys_update)
-                self.stdout.write(f"  ✓ 已删除 {len(keys_update)} 个索引更新标记")
-            else:
-                self.stdout.write("  - 未找到索引更新标记")
-
-            # 清除索引元数据
-            pattern_meta = "smartdocs:faiss:meta:*"
-            keys_meta = r.keys(pattern_meta)
-            if keys_meta:
-                r.delete(*keys_meta)
-                self.stdout.write(f"  ✓ 已删除 {len(keys_meta)} 个索引元数据")
-            else:
-                self.stdout.write("  - 未找到索引元数据")
-
-            # 清除向量搜索缓存
-            pattern_search = "smartdocs:cache:vector_search:*"
-            keys_search = r.keys(pattern_search)
-            if keys_search:
-                r.delete(*keys_search)
-                self.stdout.write(f"  ✓ 已删除 {len(keys_search)} 个向量搜索缓存")
-            else:
-                self.stdout.write("  - 未找到向量搜索缓存")
-
-            total_keys = len(keys_update) + len(keys_meta) + len(keys_search)
             self.stdout.write(self.style.SUCCESS(f"成功清除了 {total_keys} 个Redis缓存键"))
 
         except Exception as e:
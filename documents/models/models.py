@@ -84,7 +84,7 @@ class Document(models.Model):
         self.save(update_fields=["is_deleted", "deleted_at"])
 
     def restore(self):
-        """恢复已删除的文档"""
+        """恢复已删除的文档（删除时向量已被标记删除，恢复后需要重新索引才能被检索到）"""
         self.is_deleted = False
         self.deleted_at = None
         self.save(update_fields=["is_deleted", "deleted_at"])
@@ -5,8 +5,8 @@ import docx
 from typing import List, Generator
 from loguru import logger
 
-from django.conf import settings
 from ..models import Document, DocumentChunk
+from .model_storage import get_active_model_version
 from .vector_db_service import VectorDBService
 
 # loguru不需要getLogger
@@ -20,10 +20,10 @@ class DocumentProcessor:
         初始化文档处理器
 
         Args:
-            embedding_model_version: 嵌入模型版本，如果未指定则使用settings中的配置
+            embedding_model_version: 嵌入模型版本，如果未指定则使用当前提供检索的模型版本
         """
         # 记录使用的嵌入模型版本
-        self.embedding_model_version = embedding_model_version or settings.EMBEDDING_MODEL_VERSION
+        self.embedding_model_version = embedding_model_version or get_active_model_version()
         logger.info(f"初始化DocumentProcessor，使用嵌入模型: {self.embedding_model_version}")
 
         # 初始化向量数据库服务，传递模型版本
@@ -184,7 +184,8 @@ class DocumentProcessor:
 
     def _process_chunks(self, document: Document, content: str):
         """分批处理文本分块和保存"""
-        # 1. 先删除现有分块
+        # 1. 先删除现有分块及其向量
+        VectorDBService.delete_document_vectors(document.id)
         DocumentChunk.objects.filter(document_id=document.id).delete()
 
         # 2. 根据文档类型和内容选择合适的分块策略和大小
@@ -2,10 +2,16 @@ import numpy as np
 from loguru import logger
 import os
 import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 from django.conf import settings
 from django.core.cache import cache
+import openai
 from openai import OpenAI
 import requests.exceptions
+from common.utils.rate_limiter import GlobalTokenBucket, RateLimiter
 from common.utils.retry_utils import retry, log_retry, RetryableError
 
 
@@ -16,12 +22,39 @@ class EmbeddingAPIError(RetryableError):
     pass
 
 
+class EmbeddingError(Exception):
+    """嵌入API调用错误，不可重试的错误（如参数错误、鉴权失败），由调用方处理"""
+
+    pass
+
+
 # loguru不需要getLogger
 
+# 中日韩字符按每个字符一个token估算，其他字符按每3个字符一个token估算（英文实际约4个字符一个token，估算偏保守）
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数量，用于按API的单次请求token上限分批，不需要加载分词器
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        int: 估算的token数量，至少为1
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return max(1, cjk + -(-(len(text) - cjk) // 3))
+
 
 class EmbeddingService:
     """向量嵌入服务，负责文本向量化"""
 
+    # 同一进程内的全部实例共用限流器和请求线程池（服务商按账户限流），按配置区分
+    _request_pools: Dict[Tuple, Tuple[RateLimiter, ThreadPoolExecutor]] = {}
+    _request_pools_lock = threading.Lock()
+
     def __init__(self, embedding_model_version=None):
         """
         初始化向量嵌入服务
@@ -45,12 +78,62 @@ class EmbeddingService:
         self.cache_timeout = getattr(settings, "EMBEDDING_CACHE_TIMEOUT", 86400)  # 24小时
         self.enable_cache = getattr(settings, "EMBEDDING_CACHE_ENABLED", True)
 
+        # 单次API请求最多包含的文本数量（DashScope text-embedding-v4每次最多10条）
+        self.api_batch_size = getattr(settings, "EMBEDDING_API_BATCH_SIZE", 10)
+        # 单次API请求中全部文本合计的token上限（估算值）
+        self.api_batch_max_tokens = getattr(settings, "EMBEDDING_API_BATCH_MAX_TOKENS", 32000)
+
         logger.info(
-            f"初始化EmbeddingService，使用模型: {self.embedding_model_version}, 缓存: {'启用' if self.enable_cache else '禁用'}"
+            f"初始化EmbeddingService，使用模型: {self.embedding_model_version}, "
+            f"缓存: {'启用' if self.enable_cache else '禁用'}"
         )
 
-        # 创建OpenAI客户端（使用DashScope兼容模式）
-        self.client = OpenAI(api_key=self.api_key, base_url="https://dashscope.aliyuncs.com/compatible-mode/v1")
+        # 并发请求数、每分钟请求数/token数上限和所有进程共用的全局配额，重试的每次尝试同样经过限流器
+        self.api_concurrency = max(getattr(settings, "EMBEDDING_API_CONCURRENCY", 4), 1)
+        self.rate_limiter, self.request_executor = self._get_request_pool(self.api_concurrency)
+
+        # 创建OpenAI客户端（使用DashScope兼容模式），关闭客户端自带的重试，由retry装饰器在限流器内重试
+        self.client = OpenAI(
+            api_key=self.api_key,
+            base_url=getattr(settings, "EMBEDDING_API_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
+            max_retries=0,
+        )
+
+    @classmethod
+    def _get_request_pool(cls, concurrency: int) -> Tuple[RateLimiter, ThreadPoolExecutor]:
+        """获取进程内共用的限流器和请求线程池"""
+        requests_per_minute = getattr(settings, "EMBEDDING_API_REQUESTS_PER_MINUTE", 0)
+        tokens_per_minute = getattr(settings, "EMBEDDING_API_TOKENS_PER_MINUTE", 0)
+        global_config = (
+            getattr(settings, "EMBEDDING_GLOBAL_RATE_LIMIT_ENABLED", False),
+            getattr(settings, "EMBEDDING_GLOBAL_REQUESTS_PER_MINUTE", 0),
+            getattr(settings, "EMBEDDING_GLOBAL_TOKENS_PER_MINUTE", 0),
+            getattr(settings, "EMBEDDING_BULK_RESERVE_RATIO", 0.2),
+        )
+        interactive_max_wait = getattr(settings, "EMBEDDING_INTERACTIVE_MAX_WAIT", 2.0)
+
+        key = (concurrency, requests_per_minute, tokens_per_minute, global_config, interactive_max_wait)
+        with cls._request_pools_lock:
+            if key not in cls._request_pools:
+                enabled, global_rpm, global_tpm, bulk_reserve_ratio = global_config
+                global_bucket = (
+                    GlobalTokenBucket("embedding", global_rpm, global_tpm, bulk_reserve_ratio) if enabled else None
+                )
+                cls._request_pools[key] = (
+                    RateLimiter(
+                        concurrency, requests_per_minute, tokens_per_minute, global_bucket, interactive_max_wait
+                    ),
+                    ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embedding-request"),
+                )
+            return cls._request_pools[key]
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """速率限制、超时和连接错误可以重试"""
+        if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        message = str(error).lower()
+        return "rate limit" in message or "timeout" in message
 
     def _get_cache_key(self, text: str) -> str:
         """生成缓存键"""
@@ -94,7 +177,7 @@ class EmbeddingService:
         on_retry=log_retry,
     )
     def _get_embedding_from_api(self, text: str) -> np.ndarray:
-        """从API获取嵌入向量（内部方法）"""
+        """从API获取嵌入向量（内部方法），单个文本通常是查询，按交互请求的优先级取全局配额"""
         if not self.api_key:
             # 如果API密钥未设置，返回随机向量（仅用于测试）
             logger.warning("使用随机向量替代真实嵌入（仅用于测试）")
@@ -103,12 +186,13 @@ class EmbeddingService:
         try:
             # 使用OpenAI兼容模式调用DashScope API获取嵌入向量
             logger.info(f"使用模型 {self.embedding_model_version} 获取嵌入向量，API密钥: {self.api_key[:5]}***")
-            response = self.client.embeddings.create(
-                model=self.embedding_model_version,
-                input=text,
-                dimensions=self.vector_dim,
-                encoding_format="float",
-            )
+            with self.rate_limiter.limit(estimate_tokens(text), GlobalTokenBucket.PRIORITY_INTERACTIVE):
+                response = self.client.embeddings.create(
+                    model=self.embedding_model_version,
+                    input=text,
+                    dimensions=self.vector_dim,
+                    encoding_format="float",
+                )
 
             # 获取嵌入向量
             embedding = np.array(response.data[0].embedding).astype("float32")
@@ -121,14 +205,153 @@ class EmbeddingService:
             raise  # 让装饰器捕获并重试
 
         except Exception as e:
-            if "rate limit" in str(e).lower() or "timeout" in str(e).lower():
-                # 速率限制或超时错误，可以重试
+            if self._is_retryable(e):
+                # 速率限制、超时或连接错误，可以重试
                 logger.error(f"API限制错误: {str(e)}")
                 raise EmbeddingAPIError(f"API调用失败: {str(e)}")
 
+            # 其他错误不重试，也不返回替代向量，避免无意义的向量被缓存和写入索引
             logger.exception(f"获取嵌入时发生异常: {str(e)}")
-            # 其他错误，返回随机向量（应急措施）
-            return np.random.rand(self.vector_dim).astype("float32")
+            raise EmbeddingError(f"获取嵌入失败: {str(e)}") from e
+
+    @retry(
+        max_tries=3,
+        delay=1.5,
+        backoff_factor=2.0,
+        exceptions=[EmbeddingAPIError, requests.exceptions.RequestException],
+        on_retry=log_retry,
+    )
+    def _get_embeddings_from_api(
+        self, texts: List[str], priority: str = GlobalTokenBucket.PRIORITY_BULK
+    ) -> np.ndarray:
+        """在一次API请求中获取多个文本的嵌入向量（内部方法），priority为取全局配额的优先级"""
+        if not self.api_key:
+            # 如果API密钥未设置，返回随机向量（仅用于测试）
+            logger.warning("使用随机向量替代真实嵌入（仅用于测试）")
+            return np.random.rand(len(texts), self.vector_dim).astype("float32")
+
+        try:
+            with self.rate_limiter.limit(sum(estimate_tokens(text) for text in texts), priority):
+                response = self.client.embeddings.create(
+                    model=self.embedding_model_version,
+                    input=texts,
+                    dimensions=self.vector_dim,
+                    encoding_format="float",
+                )
+
+            # 按输入顺序排列返回的向量
+            data = sorted(response.data, key=lambda item: item.index)
+            embeddings = np.array([item.embedding for item in data]).astype("float32")
+            logger.info(f"成功批量获取{len(texts)}个嵌入向量，维度: {embeddings.shape[1]}")
+            return embeddings
+
+        except requests.exceptions.RequestException as e:
+            # 网络错误，可以重试
+            logger.error(f"网络请求错误: {str(e)}")
+            raise  # 让装饰器捕获并重试
+
+        except Exception as e:
+            if self._is_retryable(e):
+                # 速率限制、超时或连接错误，可以重试
+                logger.error(f"API限制错误: {str(e)}")
+                raise EmbeddingAPIError(f"API调用失败: {str(e)}")
+
+            # 其他错误不重试，也不返回替代向量，避免无意义的向量被缓存和写入索引
+            logger.exception(f"批量获取嵌入时发生异常: {str(e)}")
+            raise EmbeddingError(f"批量获取嵌入失败: {str(e)}") from e
+
+    def _get_cached_embeddings(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        """一次批量读取多个文本的缓存向量，返回命中的文本到向量的映射"""
+        if not self.enable_cache or not texts:
+            return {}
+
+        keys = {self._get_cache_key(text): text for text in texts}
+        try:
+            cached = cache.get_many(list(keys))
+        except Exception as e:
+            logger.warning(f"批量读取缓存失败: {e}")
+            return {}
+        return {keys[key]: np.array(value, dtype=np.float32) for key, value in cached.items() if value}
+
+    def _set_cached_embeddings(self, texts: List[str], embeddings: np.ndarray):
+        """一次批量写入多个文本的向量缓存"""
+        if not self.enable_cache or not texts:
+            return
+
+        try:
+            cache.set_many(
+                {self._get_cache_key(text): embedding.tolist() for text, embedding in zip(texts, embeddings)},
+                timeout=self.cache_timeout,
+            )
+        except Exception as e:
+            logger.warning(f"批量设置缓存失败: {e}")
+
+    def _plan_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        按单次请求的文本数量上限和token上限把文本分成多个请求
+
+        按顺序贪心装入，单个文本超过token上限时单独作为一个请求（由API截断或报错）
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            每个请求包含的文本下标
+        """
+        batches = []
+        batch, batch_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = estimate_tokens(text)
+            if batch and (len(batch) >= self.api_batch_size or batch_tokens + tokens > self.api_batch_max_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def get_embeddings(self, texts: List[str], priority: str = GlobalTokenBucket.PRIORITY_BULK) -> np.ndarray:
+        """
+        批量获取文本的向量表示（带缓存优化）
+
+        一次批量读取缓存，相同的文本只请求一次，缓存未命中的文本按单次请求的文本数量和token上限分批，
+        各批在请求线程池中并发请求API（受限流器限制），每批结果一次批量写入缓存
+
+        Args:
+            texts: 文本列表
+            priority: 取全局配额的优先级，检索时的查询使用GlobalTokenBucket.PRIORITY_INTERACTIVE，
+                文档索引等批量任务使用默认的PRIORITY_BULK
+
+        Returns:
+            形状为(len(texts), vector_dim)的float32矩阵，顺序与texts一致
+        """
+        if not texts:
+            return np.empty((0, self.vector_dim), dtype=np.float32)
+
+        unique_texts = list(dict.fromkeys(texts))
+        embeddings = self._get_cached_embeddings(unique_texts)
+        missing = [text for text in unique_texts if text not in embeddings]
+
+        if missing:
+            batches = self._plan_batches(missing)
+            logger.info(
+                f"批量获取{len(texts)}个文本的嵌入: 缓存命中{len(unique_texts) - len(missing)}个，"
+                f"其余{len(missing)}个分{len(batches)}次请求API"
+            )
+            batch_texts = [[missing[i] for i in batch] for batch in batches]
+            if len(batch_texts) == 1:
+                results = [self._get_embeddings_from_api(batch_texts[0], priority)]
+            else:
+                # 多个请求并发发送，map按提交顺序返回结果
+                results = self.request_executor.map(
+                    lambda batch: self._get_embeddings_from_api(batch, priority), batch_texts
+                )
+            for texts_in_batch, batch_embeddings in zip(batch_texts, results):
+                embeddings.update(zip(texts_in_batch, batch_embeddings))
+                self._set_cached_embeddings(texts_in_batch, batch_embeddings)
+
+        return np.stack([embeddings[text] for text in texts]).astype(np.float32)
 
     def get_embedding(self, text: str) -> np.ndarray:
         """
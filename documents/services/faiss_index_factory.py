@@ -0,0 +1,386 @@
+"""
+FAISS索引工厂模块
+根据配置创建不同类型的向量索引，并负责把精确索引提升为近似索引
+
+服务使用的索引外层包装IndexIDMap，以DocumentChunk.id作为FAISS向量ID，
+类型判断和搜索参数针对内层索引
+"""
+
+import math
+import time
+from typing import Any, Dict, Optional
+
+import faiss
+import numpy as np
+from loguru import logger
+
+
+class FaissIndexFactory:
+    """FAISS索引工厂，统一管理索引类型、训练、提升策略和搜索参数"""
+
+    # 支持的索引类型
+    FLAT = "flat"  # 精确检索，IndexFlatIP
+    HNSW = "hnsw"  # 图索引，IndexHNSWFlat，无需训练
+    IVF = "ivf"  # 倒排索引，IndexIVFFlat，需要训练
+    SQ8 = "sq8"  # 8bit标量量化，IndexScalarQuantizer，每维1字节
+    PQ = "pq"  # 乘积量化，IndexPQ，每个向量pq_m字节
+    IVFPQ = "ivfpq"  # 倒排 + 乘积量化，IndexIVFPQ
+    SUPPORTED_TYPES = (FLAT, HNSW, IVF, SQ8, PQ, IVFPQ)
+    # 有损压缩的索引类型，搜索结果可以用原始向量做精确重排
+    COMPRESSED_TYPES = (SQ8, PQ, IVFPQ)
+
+    # 乘积量化每个子空间的编码位数（256个中心）
+    PQ_NBITS = 8
+
+    # IVF每个聚类中心建议的最少训练样本数（FAISS在低于该值时会给出警告）
+    MIN_POINTS_PER_CENTROID = 39
+    # 训练时最多使用的样本数 = nlist * 该值，避免在大规模数据上训练过慢
+    MAX_POINTS_PER_CENTROID = 256
+    # 提升索引时每批添加的向量数，控制峰值内存
+    ADD_BATCH_SIZE = 65536
+
+    @staticmethod
+    def unwrap(index: faiss.Index) -> faiss.Index:
+        """获取IndexIDMap包装的内层索引，未包装时返回索引本身"""
+        if isinstance(index, faiss.IndexIDMap):
+            return faiss.downcast_index(index.index)
+        return index
+
+    @staticmethod
+    def with_ids(index: faiss.Index) -> faiss.IndexIDMap:
+        """
+        用IndexIDMap包装空索引，使其可以通过add_with_ids使用自定义向量ID
+
+        IndexIDMap只保存一个int64的ID数组，不像IndexIDMap2那样额外维护反向哈希表，
+        服务不需要按ID重建向量（原始向量保存在RawVectorStore中），因此使用内存更小的IndexIDMap
+
+        Args:
+            index: 空的FAISS索引
+
+        Returns:
+            包装后的索引
+        """
+        return faiss.IndexIDMap(index)
+
+    @staticmethod
+    def get_ids(index: faiss.Index) -> np.ndarray:
+        """
+        获取索引中按位置排列的向量ID
+
+        Args:
+            index: FAISS索引
+
+        Returns:
+            int64数组，未包装IndexIDMap的索引返回位置序号
+        """
+        if isinstance(index, faiss.IndexIDMap):
+            return faiss.vector_to_array(index.id_map).astype(np.int64, copy=False)
+        return np.arange(index.ntotal, dtype=np.int64)
+
+    @classmethod
+    def get_index_type(cls, index: faiss.Index) -> str:
+        """
+        获取索引实例对应的索引类型
+
+        Args:
+            index: FAISS索引实例
+
+        Returns:
+            索引类型名称
+        """
+        index = cls.unwrap(index)
+        if isinstance(index, faiss.IndexHNSW):
+            return cls.HNSW
+        if isinstance(index, faiss.IndexIVFPQ):
+            return cls.IVFPQ
+        if isinstance(index, faiss.IndexIVF):
+            return cls.IVF
+        if isinstance(index, faiss.IndexScalarQuantizer):
+            return cls.SQ8
+        if isinstance(index, faiss.IndexPQ):
+            return cls.PQ
+        return cls.FLAT
+
+    @classmethod
+    def is_compressed(cls, index: faiss.Index) -> bool:
+        """索引是否使用有损压缩存储向量"""
+        return cls.get_index_type(index) in cls.COMPRESSED_TYPES
+
+    @classmethod
+    def get_ivf_nlist(cls, ntotal: int, nlist: int = 0) -> int:
+        """
+        计算IVF索引的聚类中心数量
+
+        Args:
+            ntotal: 用于训练的向量数量
+            nlist: 配置的聚类中心数量，0表示按4*sqrt(N)自动计算
+
+        Returns:
+            不超过训练样本所能支撑的聚类中心数量
+        """
+        if nlist <= 0:
+            nlist = int(4 * math.sqrt(max(ntotal, 1)))
+        max_nlist = max(1, ntotal // cls.MIN_POINTS_PER_CENTROID)
+        return max(1, min(nlist, max_nlist))
+
+    @staticmethod
+    def get_pq_m(dim: int, pq_m: int = 64) -> int:
+        """
+        计算乘积量化的子空间数量，子空间数量必须能整除向量维度
+
+        Args:
+            dim: 向量维度
+            pq_m: 配置的子空间数量
+
+        Returns:
+            不超过配置值且能整除维度的最大子空间数量
+        """
+        pq_m = max(1, min(pq_m, dim))
+        while dim % pq_m:
+            pq_m -= 1
+        return pq_m
+
+    @classmethod
+    def create_index(
+        cls, index_type: str, dim: int, training_vectors: Optional[np.ndarray] = None, **options
+    ) -> faiss.Index:
+        """
+        创建指定类型的空索引，需要训练的索引会使用training_vectors完成训练
+
+        Args:
+            index_type: 索引类型，见SUPPORTED_TYPES
+            dim: 向量维度
+            training_vectors: 训练样本（IVF、SQ8、PQ类索引必需）
+            **options: hnsw_m, hnsw_ef_construction, hnsw_ef_search, ivf_nlist, ivf_nprobe, pq_m
+
+        Returns:
+            可直接添加向量的FAISS索引
+
+        Raises:
+            ValueError: 索引类型无效或缺少训练样本时抛出
+        """
+        index_type = (index_type or cls.FLAT).lower()
+
+        if index_type == cls.FLAT:
+            return faiss.IndexFlatIP(dim)
+
+        if index_type == cls.HNSW:
+            hnsw_m = options.get("hnsw_m", 32)
+            index = faiss.index_factory(dim, f"HNSW{hnsw_m}", faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = options.get("hnsw_ef_construction", 200)
+            index.hnsw.efSearch = options.get("hnsw_ef_search", 64)
+            return index
+
+        if index_type not in cls.SUPPORTED_TYPES:
+            raise ValueError(f"无效的向量索引类型: {index_type}，支持的类型为: {', '.join(cls.SUPPORTED_TYPES)}")
+
+        # 以下索引类型都需要训练
+        if training_vectors is None or len(training_vectors) == 0:
+            raise ValueError(f"{index_type}索引需要训练样本")
+        ntrain = len(training_vectors)
+
+        if index_type == cls.SQ8:
+            index = faiss.index_factory(dim, "SQ8", faiss.METRIC_INNER_PRODUCT)
+            cls._train(index, training_vectors, max_samples=cls.ADD_BATCH_SIZE)
+            return index
+
+        pq_m = cls.get_pq_m(dim, options.get("pq_m", 64))
+        if index_type in (cls.PQ, cls.IVFPQ) and ntrain < 2**cls.PQ_NBITS:
+            raise ValueError(f"{index_type}索引至少需要{2**cls.PQ_NBITS}个训练样本，当前只有{ntrain}个")
+
+        if index_type == cls.PQ:
+            index = faiss.index_factory(dim, f"PQ{pq_m}x{cls.PQ_NBITS}", faiss.METRIC_INNER_PRODUCT)
+            cls._train(index, training_vectors, max_samples=2**cls.PQ_NBITS * cls.MAX_POINTS_PER_CENTROID)
+            return index
+
+        nlist = cls.get_ivf_nlist(ntrain, options.get("ivf_nlist", 0))
+        if index_type == cls.IVF:
+            index = faiss.index_factory(dim, f"IVF{nlist},Flat", faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.index_factory(dim, f"IVF{nlist},PQ{pq_m}x{cls.PQ_NBITS}", faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = min(options.get("ivf_nprobe", 16), nlist)
+
+        max_samples = nlist * cls.MAX_POINTS_PER_CENTROID
+        if index_type == cls.IVFPQ:
+            max_samples = max(max_samples, 2**cls.PQ_NBITS * cls.MAX_POINTS_PER_CENTROID)
+        cls._train(index, training_vectors, max_samples=max_samples)
+        return index
+
+    @classmethod
+    def _train(cls, index: faiss.Index, vectors: np.ndarray, max_samples: int) -> None:
+        """使用随机抽样的向量训练索引"""
+        if len(vectors) > max_samples:
+            sample_ids = np.random.default_rng(1234).choice(len(vectors), max_samples, replace=False)
+            vectors = vectors[np.sort(sample_ids)]
+
+        logger.info(f"开始训练FAISS索引({type(index).__name__})，训练样本: {len(vectors)}")
+        index.train(np.ascontiguousarray(vectors, dtype="float32"))
+
+    @classmethod
+    def should_promote(cls, index: faiss.Index, target_type: str, threshold: int) -> bool:
+        """
+        判断当前索引是否需要提升为近似索引
+
+        Args:
+            index: 当前索引
+            target_type: 配置的目标索引类型
+            threshold: 触发提升的向量数量阈值
+
+        Returns:
+            bool: 是否需要提升
+        """
+        target_type = (target_type or cls.FLAT).lower()
+        if target_type == cls.FLAT or cls.get_index_type(index) != cls.FLAT:
+            return False
+        return index.ntotal >= threshold
+
+    @classmethod
+    def promote(cls, index: faiss.Index, target_type: str, **options) -> faiss.Index:
+        """
+        将精确索引中的全部向量重新训练并写入近似索引
+
+        向量按原有顺序写入，IndexIDMap包装的索引提升后仍使用原来的向量ID
+
+        Args:
+            index: 当前的精确索引
+            target_type: 目标索引类型
+            **options: 透传给create_index的参数
+
+        Returns:
+            新的近似索引
+        """
+        start_time = time.time()
+        inner = cls.unwrap(index)
+        vectors = inner.reconstruct_n(0, inner.ntotal)
+
+        if inner is index:
+            new_index = cls.build(target_type, vectors, **options)
+        else:
+            new_index = cls.build(target_type, vectors, ids=cls.get_ids(index), **options)
+
+        logger.info(
+            f"FAISS索引已从{cls.get_index_type(index)}提升为{target_type}，"
+            f"包含{new_index.ntotal}个向量，耗时: {time.time() - start_time:.2f}秒"
+        )
+        return new_index
+
+    @classmethod
+    def build(cls, index_type: str, vectors: np.ndarray, ids: Optional[np.ndarray] = None, **options) -> faiss.Index:
+        """
+        使用给定向量训练并构建索引
+
+        Args:
+            index_type: 索引类型
+            vectors: 归一化后的向量，同时作为训练样本
+            ids: 向量ID，指定时返回IndexIDMap包装的索引
+            **options: 透传给create_index的参数
+
+        Returns:
+            包含全部向量的索引
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        inner = cls.create_index(index_type, vectors.shape[1], training_vectors=vectors, **options)
+
+        if ids is None:
+            for start in range(0, len(vectors), cls.ADD_BATCH_SIZE):
+                inner.add(vectors[start : start + cls.ADD_BATCH_SIZE])
+            return inner
+
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        new_index = cls.with_ids(inner)
+        for start in range(0, len(vectors), cls.ADD_BATCH_SIZE):
+            end = start + cls.ADD_BATCH_SIZE
+            new_index.add_with_ids(vectors[start:end], ids[start:end])
+        return new_index
+
+    @classmethod
+    def remove_ids(cls, index: faiss.Index, ids: np.ndarray, **options) -> faiss.Index:
+        """
+        物理删除指定向量ID的向量
+
+        HNSW不支持删除，重建一个不包含这些向量的索引
+
+        Args:
+            index: IndexIDMap包装的索引，会被原地修改
+            ids: 要删除的向量ID
+            **options: 重建HNSW索引时透传给create_index的参数
+
+        Returns:
+            删除后的索引，可能是新的索引对象
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0 or index.ntotal == 0:
+            return index
+
+        if cls.get_index_type(index) != cls.HNSW:
+            removed = index.remove_ids(faiss.IDSelectorBatch(ids))
+            logger.info(f"已从{cls.get_index_type(index)}索引中删除{removed}个向量")
+            return index
+
+        index_ids = cls.get_ids(index)
+        keep = ~np.isin(index_ids, ids)
+        if keep.all():
+            return index
+
+        inner = cls.unwrap(index)
+        vectors = inner.reconstruct_n(0, inner.ntotal)[keep]
+        new_index = cls.build(cls.HNSW, vectors, ids=index_ids[keep], **options)
+        logger.info(f"HNSW索引不支持删除，已重建索引并删除{int((~keep).sum())}个向量")
+        return new_index
+
+    @classmethod
+    def supports_selector(cls, index: faiss.Index) -> bool:
+        """索引搜索时是否支持通过IDSelector过滤向量（IndexPQ不支持）"""
+        return cls.get_index_type(index) != cls.PQ
+
+    @classmethod
+    def build_search_params(
+        cls,
+        index: faiss.Index,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        selector: Optional[faiss.IDSelector] = None,
+    ) -> Optional[faiss.SearchParameters]:
+        """
+        构建单次搜索使用的参数，不修改共享索引对象，因此可在并发请求间安全使用
+
+        Args:
+            index: 要搜索的索引
+            nprobe: IVF索引搜索的聚类数量
+            ef_search: HNSW索引搜索的候选队列长度
+            selector: 搜索时只考虑该选择器接受的向量ID，索引不支持时忽略
+
+        Returns:
+            搜索参数，未指定或不适用时返回None
+        """
+        index_type = cls.get_index_type(index)
+        inner = cls.unwrap(index)
+        if selector is not None and not cls.supports_selector(index):
+            selector = None
+
+        if index_type in (cls.IVF, cls.IVFPQ) and (nprobe or selector is not None):
+            params = faiss.SearchParametersIVF()
+            params.nprobe = min(int(nprobe), inner.nlist) if nprobe else inner.nprobe
+        elif index_type == cls.HNSW and (ef_search or selector is not None):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = int(ef_search) if ef_search else inner.hnsw.efSearch
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+
+        if selector is not None:
+            params.sel = selector
+        return params
+
+    @classmethod
+    def describe(cls, index: faiss.Index) -> Dict[str, Any]:
+        """返回索引的类型和规模信息，便于日志和监控"""
+        info = {"index_type": cls.get_index_type(index), "ntotal": index.ntotal, "dim": index.d}
+        index = cls.unwrap(index)
+        info["bytes_per_vector"] = index.sa_code_size() if info["index_type"] != cls.HNSW else index.d * 4
+        if info["index_type"] in (cls.IVF, cls.IVFPQ):
+            info.update({"nlist": index.nlist, "nprobe": index.nprobe})
+        elif info["index_type"] == cls.HNSW:
+            info.update({"ef_search": index.hnsw.efSearch})
+        return info
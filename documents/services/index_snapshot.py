@@ -0,0 +1,97 @@
+"""
+索引快照模块
+把某一代manifest对应的段、墓碑和manifest组合为一个不可变对象，
+重新加载时在后台构建新快照，再通过替换一个引用整体发布，搜索线程不会读到新旧混合的状态
+"""
+
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import faiss
+from loguru import logger
+
+from .tombstone_filter import TombstoneFilter
+from .vector_segment_store import VectorSegmentStore
+
+
+class IndexSnapshot:
+    """某一代索引的只读快照，创建后不再修改"""
+
+    __slots__ = ("manifest", "segments", "tombstones")
+
+    def __init__(
+        self, manifest: Dict[str, Any], segments: List[Tuple[str, faiss.Index]], tombstones: TombstoneFilter
+    ):
+        """
+        初始化快照
+
+        Args:
+            manifest: 快照对应的manifest
+            segments: (段文件名, 索引)列表，基础段分片在前
+            tombstones: 快照对应的已删除向量ID
+        """
+        self.manifest = manifest
+        self.segments = segments
+        self.tombstones = tombstones
+
+    @classmethod
+    def empty(cls) -> "IndexSnapshot":
+        """空索引的快照"""
+        return cls(VectorSegmentStore.empty_manifest(), [], TombstoneFilter())
+
+    @property
+    def generation(self) -> int:
+        """manifest代数，每次写入、删除或合并后递增"""
+        return self.manifest.get("generation", 0)
+
+    @property
+    def ntotal(self) -> int:
+        """所有段的向量总数"""
+        return sum(index.ntotal for _, index in self.segments)
+
+    @classmethod
+    def load(
+        cls,
+        segment_store: VectorSegmentStore,
+        manifest: Dict[str, Any],
+        previous: Optional["IndexSnapshot"] = None,
+        loaded: Optional[Dict[str, faiss.Index]] = None,
+        read_index: Callable[[str], faiss.Index] = faiss.read_index,
+    ) -> "IndexSnapshot":
+        """
+        构建manifest对应的快照，上一个快照中已加载的段和墓碑直接复用
+
+        Args:
+            segment_store: 分段存储
+            manifest: 目标manifest
+            previous: 上一个快照
+            loaded: 本进程刚写入、无需从文件读取的段
+            read_index: 读取段文件的函数
+
+        Returns:
+            新的快照
+
+        Raises:
+            FileNotFoundError: 段文件已被合并删除时抛出，调用方应重新读取manifest
+        """
+        current = dict(previous.segments) if previous is not None else {}
+        loaded = loaded or {}
+        segments = []
+        for name in VectorSegmentStore.segment_names(manifest):
+            index = loaded.get(name)
+            if index is None:
+                index = current.get(name)
+            if index is None:
+                path = segment_store.segment_path(name)
+                if not os.path.exists(path):
+                    raise FileNotFoundError(path)
+                index = read_index(path)
+                logger.debug(f"已加载索引段: {name}，包含{index.ntotal}个向量")
+            segments.append((name, index))
+
+        if previous is not None and manifest.get("tombstones") == previous.manifest.get("tombstones"):
+            tombstones = previous.tombstones
+        else:
+            tombstones = TombstoneFilter(segment_store.read_tombstones(manifest))
+
+        return cls(manifest, segments, tombstones)
@@ -0,0 +1,180 @@
+"""
+服务实例注册表模块
+按键（如嵌入模型版本）保存已加载的服务实例，限制全部实例合计占用的内存：
+超出预算时按最近使用顺序淘汰空闲的实例，被淘汰的实例在下一次使用时重新加载
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from loguru import logger
+
+
+class InstanceRegistry:
+    """按内存预算淘汰空闲实例的LRU注册表"""
+
+    def __init__(
+        self,
+        max_bytes: int = 0,
+        idle_seconds: float = 300,
+        check_interval: float = 30,
+        memory_of: Optional[Callable[[Any], int]] = None,
+        on_evict: Optional[Callable[[Any], None]] = None,
+    ):
+        """
+        初始化注册表
+
+        Args:
+            max_bytes: 全部实例合计的内存预算，0表示不限制
+            idle_seconds: 超过该时间未使用的实例才会被淘汰，正在使用的实例不淘汰
+            check_interval: 查找实例时最多每隔多少秒检查一次预算，新增实例时总会检查
+            memory_of: 估算实例内存占用的函数
+            on_evict: 实例被淘汰时调用的函数，用于停止后台线程等清理工作
+        """
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.check_interval = check_interval
+        self.memory_of = memory_of or (lambda instance: 0)
+        self.on_evict = on_evict
+
+        self._instances: OrderedDict[Hashable, Any] = OrderedDict()
+        self._last_used: Dict[Hashable, float] = {}
+        self._pinned = set()
+        self._last_check = time.monotonic()
+        self._lock = threading.RLock()
+
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._instances)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._instances
+
+    def put(self, key: Hashable, instance: Any) -> None:
+        """保存实例并标记为最近使用"""
+        with self._lock:
+            self._instances[key] = instance
+            self._instances.move_to_end(key)
+            self._last_used[key] = time.monotonic()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        读取实例并标记为最近使用
+
+        Args:
+            key: 实例的键
+
+        Returns:
+            实例，不存在（或已被淘汰）时返回None
+        """
+        with self._lock:
+            instance = self._instances.get(key)
+            if instance is not None:
+                self._instances.move_to_end(key)
+                self._last_used[key] = time.monotonic()
+            return instance
+
+    def pin(self, key: Hashable) -> None:
+        """固定实例（如默认模型版本），固定的实例不会被淘汰"""
+        with self._lock:
+            self._pinned.add(key)
+
+    def unpin(self, key: Hashable) -> None:
+        """取消固定，实例空闲后可以被淘汰"""
+        with self._lock:
+            self._pinned.discard(key)
+
+    def maybe_evict(self, force: bool = False, keep: Optional[Hashable] = None) -> List[Hashable]:
+        """
+        距上次检查超过check_interval秒（或force为True）时检查内存预算
+
+        Args:
+            force: 是否忽略检查间隔立即检查，新增实例后使用
+            keep: 本次不淘汰的实例，通常是调用方正要使用的实例
+
+        Returns:
+            被淘汰的实例的键
+        """
+        if not self.max_bytes:
+            return []
+
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_check < self.check_interval:
+                return []
+            self._last_check = now
+            return self._evict(now, keep)
+
+    def _evict(self, now: float, keep: Optional[Hashable] = None) -> List[Hashable]:
+        """按最近使用顺序淘汰空闲实例，直到合计内存不超过预算，调用方需持有锁"""
+        sizes = {key: self.memory_of(instance) for key, instance in self._instances.items()}
+        total = sum(sizes.values())
+        evicted = []
+        # OrderedDict从最久未使用的实例开始遍历
+        for key in list(self._instances):
+            if total <= self.max_bytes:
+                break
+            if key == keep or key in self._pinned or now - self._last_used[key] < self.idle_seconds:
+                continue
+            instance = self._instances.pop(key)
+            idle = now - self._last_used.pop(key)
+            total -= sizes[key]
+            evicted.append(key)
+            self.evictions += 1
+            logger.info(
+                f"实例{key}已空闲{idle:.0f}秒，超出内存预算后淘汰，"
+                f"释放约{sizes[key] / 1024 / 1024:.1f}MB，剩余{total / 1024 / 1024:.1f}MB"
+            )
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(instance)
+                except Exception as e:
+                    logger.error(f"清理被淘汰的实例{key}时出错: {str(e)}")
+
+        if total > self.max_bytes:
+            logger.warning(
+                f"已加载实例合计约{total / 1024 / 1024:.1f}MB，超过内存预算{self.max_bytes / 1024 / 1024:.1f}MB，"
+                f"但没有可淘汰的空闲实例"
+            )
+        return evicted
+
+    def remove(self, key: Hashable) -> Optional[Any]:
+        """移除实例但不调用on_evict，不存在时返回None"""
+        with self._lock:
+            self._last_used.pop(key, None)
+            return self._instances.pop(key, None)
+
+    def clear(self) -> None:
+        """移除全部实例"""
+        with self._lock:
+            self._instances.clear()
+            self._last_used.clear()
+
+    def resident(self, describe: Optional[Callable[[Any], Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        报告已加载的实例
+
+        Args:
+            describe: 返回实例其他信息的函数，结果合并到每一项中
+
+        Returns:
+            按最近使用顺序（最近的在后）的列表，每项包含key、bytes（估算的内存占用）、
+            idle_seconds（空闲时间）、pinned（是否固定）
+        """
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._instances.items())
+            last_used = dict(self._last_used)
+        return [
+            {
+                "key": key,
+                "bytes": self.memory_of(instance),
+                "idle_seconds": now - last_used.get(key, now),
+                "pinned": key in self._pinned,
+                **(describe(instance) if describe is not None else {}),
+            }
+            for key, instance in items
+        ]
@@ -0,0 +1,379 @@
+"""
+词法索引模块
+在进程内为文档块文本维护BM25倒排索引，补充向量检索对产品型号、专有名词等精确词语的召回。
+英文和数字按单词切分，中日韩文字按相邻两字（单字的片段按单字）切分，不依赖分词词典；
+倒排表用紧凑的数组保存，支持增量添加和删除
+
+写入索引段时把段中文档块的词频编码后保存在段文件旁边，其他进程加载段时直接读取，
+不需要从数据库读取文本再重新切分
+"""
+
+import io
+import math
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .tombstone_filter import IdBitmap
+
+# 英文/数字单词，或连续的中日韩文字（汉字、假名、谚文）
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+
+
+class LexicalIndex:
+    """文档块文本的BM25倒排索引，以文档块ID标识文档"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, compact_ratio: float = 0.2):
+        """
+        初始化词法索引
+
+        Args:
+            k1: BM25词频饱和参数
+            b: BM25文档长度归一化参数
+            compact_ratio: 已删除文档占比超过该值时重建倒排表，物理删除已删除的文档
+        """
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+
+        # 词 -> (文档块ID, 词频, 文档长度)，文档长度随倒排项保存，打分时无需逐个查找
+        self._postings: Dict[str, Tuple[array, array, array]] = {}
+        self._doc_len: Dict[int, int] = {}
+        self._total_len = 0
+        # 已删除但仍在倒排表中的文档块，搜索时过滤
+        self._deleted = set()
+        self._deleted_ids = np.empty(0, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    @property
+    def nbytes(self) -> int:
+        """倒排表数组占用的内存（不含字典本身的开销）"""
+        with self._lock:
+            postings = list(self._postings.values())
+        return sum(len(values) * values.itemsize for posting in postings for values in posting)
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """
+        切分文本
+
+        Args:
+            text: 文本
+
+        Returns:
+            词列表，英文转为小写，全角字符转为半角
+        """
+        tokens = []
+        for match in _TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+            word = match.group()
+            if word.isascii() or len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i : i + 2] for i in range(len(word) - 1))
+        return tokens
+
+    def missing(self, ids: Iterable[int]) -> List[int]:
+        """
+        返回尚未加入索引的文档块ID
+
+        Args:
+            ids: 文档块ID
+
+        Returns:
+            不在索引中的ID列表
+        """
+        return [chunk_id for chunk_id in ids if chunk_id not in self._doc_len]
+
+    def add(self, ids: Iterable[int], texts: Iterable[str]) -> int:
+        """
+        添加文档块，已在索引中或已删除的文档块跳过
+
+        Args:
+            ids: 文档块ID
+            texts: 与ids顺序一致的文档块文本
+
+        Returns:
+            int: 新加入的文档块数量
+        """
+        # 切分在锁外完成
+        documents = []
+        for chunk_id, text in zip(ids, texts):
+            counts = Counter(self.tokenize(text or ""))
+            documents.append((int(chunk_id), sum(counts.values()), counts.items()))
+        return self._add_documents(documents)
+
+    def _add_documents(self, documents: List[Tuple[int, int, Iterable[Tuple[str, int]]]]) -> int:
+        """
+        把已切分的文档块加入倒排表
+
+        Args:
+            documents: (文档块ID, 文档长度, (词, 词频)序列)列表
+
+        Returns:
+            int: 新加入的文档块数量
+        """
+        added = 0
+        with self._lock:
+            for chunk_id, length, counts in documents:
+                # 已删除但尚未清理的文档块仍在倒排表中，不重复添加
+                if chunk_id in self._doc_len or chunk_id in self._deleted:
+                    continue
+                self._doc_len[chunk_id] = length
+                self._total_len += length
+                for term, tf in counts:
+                    posting = self._postings.get(term)
+                    if posting is None:
+                        posting = self._postings[term] = (array("q"), array("H"), array("I"))
+                    posting[0].append(chunk_id)
+                    posting[1].append(min(tf, 0xFFFF))
+                    posting[2].append(length)
+                added += 1
+        return added
+
+    @classmethod
+    def encode(cls, ids: Iterable[int], texts: Iterable[str]) -> bytes:
+        """
+        切分文档块并把词频编码为紧凑的二进制格式，随索引段一起保存
+
+        格式为npz：ids、lengths（文档长度）、offsets（每个文档块的词在terms中的起止位置）、
+        terms（词在词表中的序号）、tfs（词频）和vocab（以换行分隔的UTF-8词表，切分出的词不含换行）
+
+        Args:
+            ids: 文档块ID
+            texts: 与ids顺序一致的文档块文本
+
+        Returns:
+            编码后的数据
+        """
+        vocab: Dict[str, int] = {}
+        chunk_ids, lengths, counts_per_doc, terms, tfs = [], [], [], [], []
+        for chunk_id, text in zip(ids, texts):
+            counts = Counter(cls.tokenize(text or ""))
+            chunk_ids.append(int(chunk_id))
+            lengths.append(sum(counts.values()))
+            counts_per_doc.append(len(counts))
+            for term, tf in counts.items():
+                terms.append(vocab.setdefault(term, len(vocab)))
+                tfs.append(min(tf, 0xFFFF))
+
+        return cls._pack(
+            np.array(chunk_ids, dtype=np.int64),
+            np.array(lengths, dtype=np.int64),
+            np.concatenate(([0], np.cumsum(counts_per_doc, dtype=np.int64))),
+            np.array(terms, dtype=np.int64),
+            np.array(tfs, dtype=np.uint16),
+            list(vocab),
+        )
+
+    @staticmethod
+    def _pack(ids, lengths, offsets, terms, tfs, vocab: List[str]) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            ids=ids,
+            lengths=lengths,
+            offsets=offsets,
+            terms=terms.astype(np.int32),
+            tfs=tfs,
+            vocab=np.frombuffer("\n".join(vocab).encode("utf-8"), dtype=np.uint8),
+        )
+        return buffer.getvalue()
+
+    @staticmethod
+    def _unpack(data: bytes) -> Dict[str, Any]:
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            unpacked = {name: arrays[name] for name in ("ids", "lengths", "offsets", "terms", "tfs")}
+            vocab = arrays["vocab"].tobytes().decode("utf-8")
+        unpacked["vocab"] = vocab.split("\n") if vocab else []
+        return unpacked
+
+    def add_encoded(self, data: bytes) -> Tuple[int, np.ndarray]:
+        """
+        添加encode编码的文档块
+
+        Args:
+            data: encode或select_encoded的结果
+
+        Returns:
+            (新加入的文档块数量, 数据中包含的全部文档块ID)
+        """
+        unpacked = self._unpack(data)
+        ids, offsets, vocab = unpacked["ids"], unpacked["offsets"], unpacked["vocab"]
+        terms, tfs = unpacked["terms"].tolist(), unpacked["tfs"].tolist()
+        documents = []
+        for i, (chunk_id, length) in enumerate(zip(ids.tolist(), unpacked["lengths"].tolist())):
+            start, end = offsets[i], offsets[i + 1]
+            postings = [(vocab[term], tf) for term, tf in zip(terms[start:end], tfs[start:end])]
+            documents.append((chunk_id, length, postings))
+        return self._add_documents(documents), ids
+
+    @classmethod
+    def select_encoded(cls, parts: List[bytes], groups: List[np.ndarray]) -> List[bytes]:
+        """
+        从多份编码数据中按文档块ID重新分组，用于合并索引段时生成合并后各段的词频数据
+
+        Args:
+            parts: 被合并的各段的编码数据，同一文档块出现多次时使用最后一份
+            groups: 合并后每个段包含的文档块ID
+
+        Returns:
+            与groups一一对应的编码数据，只包含parts中有词频数据的文档块
+        """
+        vocab: Dict[str, int] = {}
+        all_ids, all_lengths, all_counts, all_terms, all_tfs = [], [], [], [], []
+        for data in parts:
+            unpacked = cls._unpack(data)
+            # 各段的词表序号映射到合并后的词表
+            mapping = np.array([vocab.setdefault(term, len(vocab)) for term in unpacked["vocab"]], dtype=np.int64)
+            all_ids.append(unpacked["ids"])
+            all_lengths.append(unpacked["lengths"])
+            all_counts.append(np.diff(unpacked["offsets"]))
+            all_terms.append(mapping[unpacked["terms"]] if len(mapping) else unpacked["terms"].astype(np.int64))
+            all_tfs.append(unpacked["tfs"])
+
+        words = np.array(list(vocab), dtype=object)
+        if all_ids:
+            ids, lengths, counts = np.concatenate(all_ids), np.concatenate(all_lengths), np.concatenate(all_counts)
+            terms, tfs = np.concatenate(all_terms), np.concatenate(all_tfs)
+        else:
+            ids = lengths = counts = terms = np.empty(0, dtype=np.int64)
+            tfs = np.empty(0, dtype=np.uint16)
+
+        # 同一ID只保留最后出现的一份
+        _, last = np.unique(ids[::-1], return_index=True)
+        latest = np.zeros(len(ids), dtype=bool)
+        latest[len(ids) - 1 - last] = True
+
+        results = []
+        for group in groups:
+            selected = latest & np.isin(ids, group)
+            entries = np.repeat(selected, counts)
+            used, group_terms = np.unique(terms[entries], return_inverse=True)
+            results.append(
+                cls._pack(
+                    ids[selected],
+                    lengths[selected],
+                    np.concatenate(([0], np.cumsum(counts[selected]))),
+                    group_terms.reshape(-1),
+                    tfs[entries],
+                    words[used].tolist(),
+                )
+            )
+        return results
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """
+        删除文档块，倒排项在已删除文档较多时统一清理
+
+        Args:
+            ids: 文档块ID
+
+        Returns:
+            int: 删除的文档块数量
+        """
+        removed = 0
+        with self._lock:
+            for chunk_id in ids:
+                length = self._doc_len.pop(int(chunk_id), None)
+                if length is None:
+                    continue
+                self._total_len -= length
+                self._deleted.add(int(chunk_id))
+                removed += 1
+
+            if removed:
+                if len(self._deleted) > max(1000, self.compact_ratio * len(self._doc_len)):
+                    self._compact()
+                else:
+                    self._deleted_ids = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+        return removed
+
+    def clear(self) -> None:
+        """清空索引"""
+        with self._lock:
+            self._postings = {}
+            self._doc_len = {}
+            self._total_len = 0
+            self._deleted = set()
+            self._deleted_ids = np.empty(0, dtype=np.int64)
+
+    def search(self, query: str, k: int, id_filter: Optional[IdBitmap] = None) -> List[Tuple[int, float]]:
+        """
+        按BM25分数搜索前k个文档块
+
+        Args:
+            query: 查询文本
+            k: 返回结果数量
+            id_filter: 结果的ID过滤，与向量搜索相同（排除墓碑，或只保留某个用户的文档块）
+
+        Returns:
+            (文档块ID, 分数)列表，按分数降序
+        """
+        terms = Counter(self.tokenize(query))
+        with self._lock:
+            num_docs = len(self._doc_len)
+            if not num_docs or not terms:
+                return []
+            avg_len = self._total_len / num_docs
+            # 复制倒排表，打分在锁外进行
+            postings = [
+                (count, np.array(posting[0]), np.array(posting[1], dtype=np.float32), np.array(posting[2]))
+                for term, count in terms.items()
+                if (posting := self._postings.get(term)) is not None
+            ]
+            deleted_ids = self._deleted_ids
+
+        if not postings:
+            return []
+
+        all_ids, all_scores = [], []
+        for count, ids, tfs, lengths in postings:
+            # 文档频率包含尚未清理的已删除文档，清理前略有偏差
+            df = len(ids)
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths / avg_len)
+            all_ids.append(ids)
+            all_scores.append(count * idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+
+        keep = np.ones(len(ids), dtype=bool)
+        if len(deleted_ids):
+            keep &= ~np.isin(ids, deleted_ids)
+        if id_filter is not None:
+            keep &= ~id_filter.rejects(ids)
+        ids, scores = ids[keep], scores[keep]
+
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+    def _compact(self) -> None:
+        """重建倒排表，去掉已删除的文档，调用方需持有锁"""
+        deleted_ids = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+        postings = {}
+        for term, (ids, tfs, lengths) in self._postings.items():
+            ids_array = np.array(ids)
+            live = ~np.isin(ids_array, deleted_ids)
+            if live.all():
+                postings[term] = (ids, tfs, lengths)
+            elif live.any():
+                postings[term] = (
+                    array("q", ids_array[live].tolist()),
+                    array("H", np.array(tfs)[live].tolist()),
+                    array("I", np.array(lengths)[live].tolist()),
+                )
+        self._postings = postings
+        self._deleted = set()
+        self._deleted_ids = np.empty(0, dtype=np.int64)
@@ -1,9 +1,44 @@
 import numpy as np
 from loguru import logger
-from typing import Optional
+from typing import List, Optional
+import concurrent.futures
 import os
 from django.conf import settings
 
+from common.utils.rate_limiter import GlobalTokenBucket
+from .embedding_service import EmbeddingError
+from .micro_batcher import MicroBatcher
+
+
+def plan_length_buckets(lengths: np.ndarray, max_batch_size: int, max_batch_tokens: int) -> List[np.ndarray]:
+    """
+    按token长度把文本分成多个批次
+
+    文本按长度升序排列后依次装入批次，每批补齐到批内最长文本的长度，
+    批次大小不超过max_batch_size，补齐后的token总数（批次大小 × 最长长度）不超过max_batch_tokens，
+    长度相近的文本在同一批中，补齐浪费的计算最少；短文本的批次更大，长文本的批次更小
+
+    Args:
+        lengths: 每个文本的token数
+        max_batch_size: 每批最多包含的文本数量
+        max_batch_tokens: 每批补齐后最多包含的token数，单个文本超过时单独成批
+
+    Returns:
+        每批文本在原列表中的下标
+    """
+    order = np.argsort(lengths, kind="stable")
+    batches = []
+    start = 0
+    for end in range(1, len(order) + 1):
+        # order按长度升序，批内最长的文本总是最后加入的一个
+        if end - start > max_batch_size or (end - start) * lengths[order[end - 1]] > max_batch_tokens:
+            if end - 1 > start:
+                batches.append(order[start : end - 1])
+                start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
 
 class LocalEmbeddingService:
     """本地向量嵌入服务，使用sentence-transformers而不依赖外部API"""
@@ -39,6 +74,23 @@ class LocalEmbeddingService:
 
         self.vector_dim = self.model_dimensions.get(self.embedding_model_version, settings.EMBEDDING_MODEL_DIMENSIONS)
 
+        # 批量编码：按token长度分批，每批的文本数量和补齐后的token数上限，以及推理使用的CPU线程数（0为默认）
+        self.batch_size = max(getattr(settings, "LOCAL_EMBEDDING_BATCH_SIZE", 64), 1)
+        self.max_batch_tokens = max(getattr(settings, "LOCAL_EMBEDDING_MAX_BATCH_TOKENS", 16384), 1)
+        self.num_threads = getattr(settings, "LOCAL_EMBEDDING_NUM_THREADS", 0)
+
+        # 并发的查询向量化请求由后台线程收集后一次批量编码，减少各线程争用模型
+        self.micro_batcher = None
+        if getattr(settings, "LOCAL_EMBEDDING_MICRO_BATCH_ENABLED", True):
+            self.micro_batcher = MicroBatcher(
+                self._encode,
+                max_batch_size=getattr(settings, "LOCAL_EMBEDDING_MICRO_BATCH_SIZE", 32),
+                max_wait_ms=getattr(settings, "LOCAL_EMBEDDING_MICRO_BATCH_WAIT_MS", 5),
+                name=f"embedding-micro-batcher-{self.embedding_model_version}",
+            )
+        # 等待微批处理结果的最长秒数，超时后在请求线程中直接编码，后台线程异常时请求不会一直阻塞
+        self.micro_batch_timeout = getattr(settings, "LOCAL_EMBEDDING_MICRO_BATCH_TIMEOUT", 10)
+
         logger.info(
             f"初始化本地EmbeddingService，使用模型: {self.embedding_model_version}，向量维度: {self.vector_dim}"
         )
@@ -83,27 +135,51 @@ class LocalEmbeddingService:
 
             # 更新向量维度为模型的实际维度
             self.vector_dim = self.model.get_sentence_embedding_dimension()
+
+            if self.num_threads > 0:
+                import torch
+
+                torch.set_num_threads(self.num_threads)
+                logger.info(f"本地嵌入模型推理使用{self.num_threads}个CPU线程")
         except Exception as e:
             logger.exception(f"加载模型时出错: {str(e)}")
             self.model = None
             raise RuntimeError(f"无法加载嵌入模型: {str(e)}")
 
+    @property
+    def nbytes(self) -> int:
+        """模型参数和缓冲区占用的内存，模型未加载时为0"""
+        if self.model is None or not hasattr(self.model, "parameters"):
+            return 0
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
     def get_embedding(self, text: str) -> np.ndarray:
         """
         获取文本的向量表示
 
+        启用微批处理时与其他线程同时提交的文本合并为一批编码
+
         Args:
             text: 输入文本
 
         Returns:
             文本的向量表示
+
+        Raises:
+            EmbeddingError: 模型未加载或编码失败
         """
         if not self.model:
-            # 如果模型未加载成功，返回随机向量
-            logger.warning("模型未加载，返回随机向量（仅用于测试）")
-            return np.random.rand(self.vector_dim).astype("float32")
+            raise EmbeddingError(f"本地嵌入模型{self.embedding_model_version}未加载")
 
         try:
+            if self.micro_batcher is not None:
+                try:
+                    return self.micro_batcher.submit(text).result(timeout=self.micro_batch_timeout)
+                except concurrent.futures.TimeoutError:
+                    logger.warning(f"微批处理超过{self.micro_batch_timeout}秒未返回，在当前线程中编码")
+                    return self._encode([text])[0]
+
             # 使用本地模型生成嵌入
             start_text = text[:100] + "..." if len(text) > 100 else text
             logger.info(f"生成文本嵌入，文本开头: {start_text}")
@@ -118,6 +194,88 @@ class LocalEmbeddingService:
             return embedding
 
         except Exception as e:
+            # 与EmbeddingService一致由调用方处理，随机向量会被当作正常结果写入索引或用于检索
             logger.exception(f"生成嵌入向量时出错: {str(e)}")
-            # 错误时返回随机向量
-            return np.random.rand(self.vector_dim).astype("float32")
+            raise EmbeddingError(f"生成嵌入向量失败: {str(e)}") from e
+
+    def _token_lengths(self, texts: List[str]) -> np.ndarray:
+        """
+        计算文本的token数（按模型的最大序列长度截断），分词器不可用时按字符数估算
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            每个文本的token数
+        """
+        max_length = getattr(self.model, "max_seq_length", None)
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is not None:
+            try:
+                input_ids = tokenizer(texts, truncation=max_length is not None, max_length=max_length)["input_ids"]
+                return np.array([len(ids) for ids in input_ids], dtype=np.int64)
+            except Exception as e:
+                logger.warning(f"计算token数失败，按字符数估算: {str(e)}")
+
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        return np.minimum(lengths, max_length) if max_length else lengths
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """
+        按token长度排序后分批编码（见plan_length_buckets），每批一次encode调用，结果按原顺序返回
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            形状为(len(texts), vector_dim)的float32矩阵
+        """
+        batches = plan_length_buckets(self._token_lengths(texts), self.batch_size, self.max_batch_tokens)
+        embeddings = np.empty((len(texts), self.vector_dim), dtype=np.float32)
+        for batch in batches:
+            # batch_size设为批次大小，encode不再自行拆分
+            embeddings[batch] = self.model.encode(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+        logger.debug(f"批量生成{len(texts)}个嵌入，按长度分为{len(batches)}批")
+        return embeddings
+
+    def get_embeddings(self, texts: List[str], priority: Optional[str] = None) -> np.ndarray:
+        """
+        批量获取文本的向量表示
+
+        文本按token长度分批编码；交互请求（检索时的查询）启用微批处理时与其他线程同时提交的查询合并编码
+
+        Args:
+            texts: 文本列表
+            priority: 与EmbeddingService的参数一致，本地模型不占用API配额，
+                为GlobalTokenBucket.PRIORITY_INTERACTIVE时经过微批处理
+
+        Returns:
+            形状为(len(texts), vector_dim)的float32矩阵，顺序与texts一致
+
+        Raises:
+            EmbeddingError: 模型未加载或编码失败
+        """
+        if not texts:
+            return np.empty((0, self.vector_dim), dtype=np.float32)
+
+        if not self.model:
+            raise EmbeddingError(f"本地嵌入模型{self.embedding_model_version}未加载")
+
+        try:
+            interactive = priority == GlobalTokenBucket.PRIORITY_INTERACTIVE
+            if interactive and self.micro_batcher is not None and len(texts) <= self.micro_batcher.max_batch_size:
+                futures = [self.micro_batcher.submit(text) for text in texts]
+                _, pending = concurrent.futures.wait(futures, timeout=self.micro_batch_timeout)
+                if not pending:
+                    return np.stack([future.result() for future in futures])
+                logger.warning(f"微批处理超过{self.micro_batch_timeout}秒未返回，在当前线程中编码")
+            return self._encode(texts)
+        except Exception as e:
+            logger.exception(f"批量生成嵌入向量时出错: {str(e)}")
+            raise EmbeddingError(f"批量生成嵌入向量失败: {str(e)}") from e
@@ -0,0 +1,147 @@
+"""
+微批处理模块
+多个线程同时提交的单个请求（如检索时的查询向量化）放入队列，由一个后台线程收集最多max_wait_ms毫秒
+或max_batch_size个请求后一次批量处理，再把各自的结果交给对应的Future。
+模型推理的固定开销由整批请求分摊，并发较高时吞吐量成倍提升，单个请求最多多等待max_wait_ms毫秒，没有并发时不等待
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Sequence
+
+from loguru import logger
+
+
+class MicroBatcher:
+    """把并发提交的单个请求合并为批量调用"""
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "micro-batcher",
+    ):
+        """
+        初始化微批处理器
+
+        Args:
+            process_batch: 批量处理函数，参数为请求列表，返回与之一一对应的结果
+            max_batch_size: 每批最多包含的请求数量
+            max_wait_ms: 收到一批中的第一个请求后最多等待的毫秒数，之后即使未满也开始处理
+            name: 后台线程名称
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+
+        self._queue: queue.Queue = queue.Queue()
+        self._worker = None
+        self._worker_pid = None
+        self._worker_lock = threading.Lock()
+        self._closed = False
+        self._last_batch_size = 0
+
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item: Any) -> Future:
+        """
+        提交一个请求
+
+        Args:
+            item: 请求内容
+
+        Returns:
+            Future，批量处理完成后得到该请求的结果或异常
+        """
+        if self._closed:
+            raise RuntimeError(f"{self.name}已关闭")
+
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    def _ensure_worker(self) -> None:
+        """
+        首次提交时启动后台线程；fork出的子进程中（如Celery的prefork worker）或后台线程意外退出后重新启动
+
+        子进程中不存在父进程的后台线程，队列中的请求也属于父进程，因此换用新的队列
+        """
+        worker = self._worker
+        if worker is not None and self._worker_pid == os.getpid() and worker.is_alive():
+            return
+        with self._worker_lock:
+            pid = os.getpid()
+            if self._worker_pid != pid:
+                if self._worker is not None:
+                    self._queue = queue.Queue()
+                    self._last_batch_size = 0
+                self._worker = None
+                self._worker_pid = pid
+            if self._worker is None or not self._worker.is_alive():
+                if self._worker is not None:
+                    logger.warning(f"{self.name}后台线程已退出，重新启动")
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def _collect(self) -> List[Any]:
+        """
+        阻塞等待第一个请求，然后在等待时间内继续收集，直到达到批次上限
+
+        只有存在并发时才等待：上一批不止一个请求，或者处理上一批期间又有请求到达；
+        空闲时的单个请求只取走队列中已有的请求，不增加延迟
+        """
+        concurrent = self._last_batch_size > 1 or not self._queue.empty()
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + (self.max_wait if concurrent else 0.0)
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # 等待时间已过时仍取走队列中已有的请求，不再等待
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._last_batch_size = len(batch)
+        return batch
+
+    def _run(self) -> None:
+        """后台线程：循环收集并批量处理请求"""
+        while True:
+            batch = self._collect()
+            entries = [entry for entry in batch if entry is not None]
+            if entries:
+                self._process(entries)
+            if len(entries) < len(batch):
+                # close()放入的结束标记
+                return
+
+    def _process(self, entries: List[Any]) -> None:
+        """批量处理一批请求，把结果或异常交给各个Future"""
+        futures = [future for _, future in entries]
+        try:
+            results = self.process_batch([item for item, _ in entries])
+            if len(results) != len(entries):
+                raise ValueError(f"批量处理返回{len(results)}个结果，请求数量为{len(entries)}")
+        except Exception as e:
+            logger.error(f"{self.name}批量处理{len(entries)}个请求失败: {str(e)}")
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.items += len(entries)
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def close(self) -> None:
+        """处理完已提交的请求后停止后台线程"""
+        self._closed = True
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout=5)
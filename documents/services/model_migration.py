@@ -0,0 +1,219 @@
+"""
+嵌入模型迁移模块
+从数据库中已有的文档块为新的嵌入模型版本构建索引（不重新解析和分块文档），期间旧版本继续提供检索；
+索引追上后原子切换检索模型版本，再补齐切换期间新增的文档块并更新文档记录的模型版本
+"""
+
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from ..models import Document, DocumentChunk
+from .model_storage import get_active_model_version, set_active_model_version
+from .vector_db_service import VectorDBService
+
+
+class EmbeddingModelMigration:
+    """把检索从当前模型版本迁移到新的模型版本"""
+
+    def __init__(
+        self,
+        target_version: str,
+        source_version: Optional[str] = None,
+        batch_size: int = 256,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        """
+        初始化迁移
+
+        Args:
+            target_version: 迁移到的模型版本
+            source_version: 迁移前的模型版本，默认为当前提供检索的版本
+            batch_size: 每批向量化并提交为一个增量段的文档块数量
+            progress_callback: 每提交一批后调用，参数为进度字典（见progress）
+        """
+        self.target_version = target_version
+        self.source_version = source_version or get_active_model_version()
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+
+        self.started_at = None
+        self.indexed = 0
+        self.removed = 0
+        self.passes = 0
+        self._pass_total = 0
+        self._pass_indexed = 0
+
+    def progress(self) -> Dict[str, Any]:
+        """
+        迁移进度
+
+        Returns:
+            dict: pass（第几轮补齐）、pass_indexed/pass_total（本轮已索引/待索引的文档块数）、
+                indexed（累计索引的文档块数）、removed（删除的过期向量数）、elapsed（秒）、
+                rate（文档块/秒）、eta（本轮预计剩余秒数）
+        """
+        elapsed = time.monotonic() - self.started_at if self.started_at is not None else 0.0
+        rate = self.indexed / elapsed if elapsed > 0 else 0.0
+        remaining = self._pass_total - self._pass_indexed
+        return {
+            "pass": self.passes,
+            "pass_indexed": self._pass_indexed,
+            "pass_total": self._pass_total,
+            "indexed": self.indexed,
+            "removed": self.removed,
+            "elapsed": elapsed,
+            "rate": rate,
+            "eta": remaining / rate if rate > 0 else None,
+        }
+
+    def run(
+        self, switch: bool = True, catch_up_threshold: int = 0, max_passes: int = 10, grace_seconds: float = 5.0
+    ) -> Dict[str, Any]:
+        """
+        执行迁移
+
+        反复补齐新版本索引中缺少的文档块，某一轮需要补齐的数量不超过catch_up_threshold时视为已追上；
+        切换检索模型版本后等待grace_seconds（各进程重新读取当前版本），再补齐一轮并更新文档记录的模型版本
+
+        Args:
+            switch: 追上后是否切换检索模型版本，False时只构建索引
+            catch_up_threshold: 视为已追上的每轮最大补齐数量
+            max_passes: 切换前最多补齐的轮数，达到后仍未追上时不切换
+            grace_seconds: 切换后到最后一轮补齐之间的等待时间
+
+        Returns:
+            dict: 最终进度，另含switched（是否已切换）和documents_updated（更新了模型版本的文档数）
+        """
+        self.started_at = time.monotonic()
+        target = VectorDBService.get_instance(embedding_model_version=self.target_version)
+        logger.info(
+            f"开始迁移嵌入模型: {self.source_version} -> {self.target_version}，"
+            f"新版本索引当前包含{target.ntotal}个向量"
+        )
+
+        caught_up = False
+        for _ in range(max_passes):
+            if self._catch_up(target) <= catch_up_threshold:
+                caught_up = True
+                break
+
+        switched = False
+        documents_updated = 0
+        if caught_up and switch and self.source_version != self.target_version:
+            set_active_model_version(self.target_version, self.source_version)
+            VectorDBService.announce_active_model(self.source_version, self.target_version)
+            VectorDBService.clear_search_cache()
+            # 切换前构建的用户分区只包含新版本的文档，按当前接受的模型版本重新构建
+            target.owner_partitions.clear()
+            switched = True
+
+            # 等待各进程读取到新的检索版本，之后旧版本不再写入新文档，最后一轮补齐切换期间写入旧版本的文档块
+            time.sleep(grace_seconds)
+            self._catch_up(target)
+
+        if caught_up and (switched or get_active_model_version() == self.target_version):
+            documents_updated = self._update_document_versions(target)
+        elif not caught_up:
+            logger.warning(f"补齐{max_passes}轮后仍未追上，未切换检索模型版本，可以再次执行迁移继续补齐")
+
+        result = self.progress()
+        result.update(switched=switched, documents_updated=documents_updated)
+        logger.info(
+            f"嵌入模型迁移结束: 索引{self.indexed}个文档块，删除{self.removed}个过期向量，"
+            f"耗时{result['elapsed']:.1f}秒，平均{result['rate']:.1f}个/秒，"
+            f"{'已切换' if switched else '未切换'}检索模型版本，更新{documents_updated}个文档的模型版本"
+        )
+        return result
+
+    def _diff(self, target: VectorDBService) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        比较数据库与新版本索引
+
+        Returns:
+            (需要索引的文档块ID, 需要删除的向量ID)：已处理完成的文档中尚未索引的文档块，
+            以及索引中已不存在（文档块或文档已删除）的向量
+        """
+        indexed = target.indexed_ids()
+        # 默认管理器已过滤掉软删除的文档；处理中的文档的文档块可能正在写入，不算作过期
+        documents = Document.objects.all()
+        wanted = self._chunk_ids(documents.filter(status="processed"))
+        existing = self._chunk_ids(documents)
+        return np.setdiff1d(wanted, indexed, assume_unique=True), np.setdiff1d(indexed, existing, assume_unique=True)
+
+    @staticmethod
+    def _chunk_ids(documents) -> np.ndarray:
+        """文档的全部文档块ID，排序后返回"""
+        ids = DocumentChunk.objects.filter(document_id__in=documents.values("id")).values_list("id", flat=True)
+        return np.unique(np.fromiter(ids.iterator(chunk_size=10000), dtype=np.int64))
+
+    def _catch_up(self, target: VectorDBService) -> int:
+        """
+        补齐一轮：删除过期向量，分批索引缺少的文档块
+
+        Returns:
+            int: 本轮需要索引的文档块数量
+        """
+        self.passes += 1
+        pending, stale = self._diff(target)
+        if len(stale):
+            self.removed += target.delete_vectors(stale.tolist())
+
+        self._pass_total = len(pending)
+        self._pass_indexed = 0
+        logger.info(f"第{self.passes}轮补齐: 需要索引{len(pending)}个文档块，删除{len(stale)}个过期向量")
+
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i : i + self.batch_size].tolist()
+            rows = list(DocumentChunk.objects.filter(id__in=batch).values_list("id", "content"))
+            # 读取前文档块已被删除的跳过，下一轮作为过期向量处理
+            committed = target.index_chunks([row[0] for row in rows], [row[1] for row in rows])
+            self.indexed += committed
+            self._pass_indexed += len(batch)
+
+            progress = self.progress()
+            logger.info(
+                f"迁移进度: 第{progress['pass']}轮 {progress['pass_indexed']}/{progress['pass_total']}，"
+                f"累计{progress['indexed']}个文档块，{progress['rate']:.1f}个/秒"
+            )
+            if self.progress_callback is not None:
+                self.progress_callback(progress)
+
+        return len(pending)
+
+    def _update_document_versions(self, target: VectorDBService) -> int:
+        """
+        把全部文档块都已在新版本索引中的文档及其文档块标记为新的模型版本
+
+        Returns:
+            int: 更新的文档数量
+        """
+        indexed = target.indexed_ids()
+        rows = list(
+            DocumentChunk.objects.filter(
+                document_id__in=Document.objects.filter(status="processed")
+                .exclude(embedding_model_version=self.target_version)
+                .values("id")
+            ).values_list("document_id", "id")
+        )
+        if not rows:
+            return 0
+
+        document_ids, chunk_ids = np.array(rows, dtype=np.int64).T
+        incomplete = np.unique(document_ids[~np.isin(chunk_ids, indexed)])
+        document_ids = np.setdiff1d(np.unique(document_ids), incomplete).tolist()
+
+        batch_size = 1000
+        for i in range(0, len(document_ids), batch_size):
+            batch = document_ids[i : i + batch_size]
+            Document.objects.filter(id__in=batch).update(embedding_model_version=self.target_version)
+            DocumentChunk.objects.filter(document_id__in=batch).update(embedding_model_version=self.target_version)
+
+        # 文档的模型版本已变化，用户分区按新的文档记录重新构建
+        target.owner_partitions.clear()
+
+        if len(incomplete):
+            logger.warning(f"{len(incomplete)}个文档有文档块不在新版本索引中，保留原模型版本，可以再次执行迁移补齐")
+        return len(document_ids)
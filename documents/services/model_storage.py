@@ -0,0 +1,181 @@
+"""
+嵌入模型存储布局模块
+每个嵌入模型版本的索引（manifest、段文件、原始向量）保存在VECTOR_STORE_PATH/models/<模型目录名>下，不同版本互不覆盖。
+当前提供检索的模型版本记录在VECTOR_STORE_PATH/active_model.json中：迁移到新模型时在后台构建新版本的索引，
+旧版本继续提供检索，追上后原子替换该文件，所有进程随之切换读取
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from loguru import logger
+
+MODELS_DIR = "models"
+ACTIVE_MODEL_FILE = "active_model.json"
+LAYOUT_LOCK_FILE = "layout.lock"
+
+# 旧版本直接保存在VECTOR_STORE_PATH下的索引文件，首次使用默认模型版本时移入其目录
+LEGACY_ENTRIES = (
+    "manifest.json",
+    "manifest.lock",
+    "merge.lock",
+    "segments",
+    "faiss_index.bin",
+    "chunk_mapping.pkl",
+    "raw_vectors.f32",
+    "raw_vector_ids.i64",
+    "raw_vectors.lock",
+)
+
+# 读取active_model.json的结果在进程内缓存，最多每隔该秒数检查一次文件是否变化
+ACTIVE_MODEL_CHECK_SECONDS = 1.0
+
+_active_cache: Dict[str, Any] = {"path": None, "checked_at": 0.0, "mtime": None, "value": None}
+_active_lock = threading.Lock()
+
+
+def storage_name(embedding_model_version: str) -> str:
+    """
+    模型版本对应的目录名
+
+    模型名中的/等字符替换为_，替换过的名称追加哈希后缀，避免不同的模型名得到相同的目录
+
+    Args:
+        embedding_model_version: 嵌入模型版本，如 BAAI/bge-small-zh-v1.5
+
+    Returns:
+        str: 目录名
+    """
+    name = re.sub(r"[^0-9A-Za-z._-]", "_", embedding_model_version).strip(".") or "_"
+    if name != embedding_model_version:
+        name = f"{name}-{hashlib.md5(embedding_model_version.encode('utf-8')).hexdigest()[:8]}"
+    return name
+
+
+def model_storage_path(embedding_model_version: str) -> str:
+    """
+    模型版本的索引目录
+
+    Args:
+        embedding_model_version: 嵌入模型版本
+
+    Returns:
+        str: VECTOR_STORE_PATH/models/<目录名>
+    """
+    return os.path.join(settings.VECTOR_STORE_PATH, MODELS_DIR, storage_name(embedding_model_version))
+
+
+def adopt_root_storage(embedding_model_version: str) -> bool:
+    """
+    把旧布局直接保存在VECTOR_STORE_PATH下的索引移入模型版本的目录
+
+    旧布局不区分模型版本，按默认模型版本的索引处理；目标目录已有索引时不移动
+
+    Args:
+        embedding_model_version: 接收旧索引的模型版本
+
+    Returns:
+        bool: 是否移动了文件
+    """
+    root = settings.VECTOR_STORE_PATH
+    target = model_storage_path(embedding_model_version)
+    Path(root).mkdir(parents=True, exist_ok=True)
+
+    with open(os.path.join(root, LAYOUT_LOCK_FILE), "a") as lock_file:
+        # 多个进程同时启动时只由一个进程移动
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            entries = [name for name in LEGACY_ENTRIES if os.path.exists(os.path.join(root, name))]
+            has_index = any(name in entries for name in ("manifest.json", "faiss_index.bin"))
+            if not has_index or os.path.exists(os.path.join(target, "manifest.json")):
+                return False
+
+            Path(target).mkdir(parents=True, exist_ok=True)
+            for name in entries:
+                os.replace(os.path.join(root, name), os.path.join(target, name))
+            logger.info(f"已将{root}下的旧索引文件移入模型版本{embedding_model_version}的目录: {target}")
+            return True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_active_model() -> Dict[str, Any]:
+    """
+    读取当前提供检索的模型版本
+
+    Returns:
+        dict: embedding_model_version（当前版本）、previous_version（迁移前的版本，没有迁移过时为None）、
+            switched_at（切换时间）；没有记录时为settings中的默认模型版本
+    """
+    now = time.monotonic()
+    path = os.path.join(settings.VECTOR_STORE_PATH, ACTIVE_MODEL_FILE)
+    with _active_lock:
+        if path != _active_cache["path"]:
+            _active_cache.update(path=path, value=None)
+        elif _active_cache["value"] is not None and now - _active_cache["checked_at"] < ACTIVE_MODEL_CHECK_SECONDS:
+            return _active_cache["value"]
+
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+
+        if _active_cache["value"] is None or mtime != _active_cache["mtime"]:
+            value = {
+                "embedding_model_version": settings.EMBEDDING_MODEL_VERSION,
+                "previous_version": None,
+                "switched_at": None,
+            }
+            if mtime is not None:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        value.update(json.load(f))
+                except (OSError, ValueError) as e:
+                    logger.error(f"读取当前模型版本失败，使用默认模型版本: {str(e)}")
+            _active_cache["value"] = value
+            _active_cache["mtime"] = mtime
+        _active_cache["checked_at"] = now
+        return _active_cache["value"]
+
+
+def get_active_model_version() -> str:
+    """当前提供检索的模型版本"""
+    return get_active_model()["embedding_model_version"]
+
+
+def set_active_model_version(embedding_model_version: str, previous_version: Optional[str] = None) -> None:
+    """
+    原子替换active_model.json，切换所有进程的检索模型版本
+
+    Args:
+        embedding_model_version: 新的模型版本
+        previous_version: 切换前的模型版本
+    """
+    path = os.path.join(settings.VECTOR_STORE_PATH, ACTIVE_MODEL_FILE)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    data = {
+        "embedding_model_version": embedding_model_version,
+        "previous_version": previous_version,
+        "switched_at": time.time(),
+    }
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    with _active_lock:
+        _active_cache["value"] = None
+    logger.info(f"检索模型版本已切换: {previous_version} -> {embedding_model_version}")
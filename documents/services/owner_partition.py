@@ -0,0 +1,130 @@
+"""
+用户分区模块
+检索只在某个用户自己的文档块中进行，避免其他用户的文档块占用top_k名额：
+文档块较少的用户把原始向量加载为小矩阵做精确搜索，耗时只取决于该用户的文档规模；
+文档块较多的用户通过ID位图在FAISS搜索内部只保留该用户的向量
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .tombstone_filter import IdBitmap
+
+
+class OwnerPartition:
+    """某个用户在某一代索引下的文档块，创建后不再修改，可在多个搜索线程间共享"""
+
+    def __init__(self, owner_id: int, generation: int, chunk_ids: np.ndarray, vectors: Optional[np.ndarray] = None):
+        """
+        初始化用户分区
+
+        Args:
+            owner_id: 用户ID
+            generation: 构建分区时的manifest代数，代数变化后需要重新构建
+            chunk_ids: 该用户未删除的文档块ID
+            vectors: 与chunk_ids对应的归一化原始向量，为None时通过ID位图在索引中搜索
+        """
+        self.owner_id = owner_id
+        self.generation = generation
+        self.chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        self.vectors = vectors
+        self.id_filter = IdBitmap(self.chunk_ids)
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """分区占用的内存，用于缓存的容量控制"""
+        vectors_bytes = self.vectors.nbytes if self.vectors is not None else 0
+        return self.chunk_ids.nbytes + self.id_filter.nbytes + vectors_bytes
+
+    def search_exact(self, query_vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        用矩阵乘法在分区的原始向量中精确搜索
+
+        Args:
+            query_vectors: 归一化后的查询向量，形状(nq, dim)
+            k: 返回结果数量
+
+        Returns:
+            (distances, indices): 形状均为(nq, k)，按分数降序，不足k个时ID为-1
+        """
+        out_distances = np.full((len(query_vectors), k), -np.inf, dtype=np.float32)
+        out_indices = np.full((len(query_vectors), k), -1, dtype=np.int64)
+        if self.vectors is None or not len(self.chunk_ids):
+            return out_distances, out_indices
+
+        scores = query_vectors @ self.vectors.T
+        n = min(k, scores.shape[1])
+        # 先用argpartition取出前n个，再只对这n个排序
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+
+        out_distances[:, :n] = np.take_along_axis(top_scores, order, axis=1)
+        out_indices[:, :n] = self.chunk_ids[top]
+        return out_distances, out_indices
+
+
+class OwnerPartitionCache:
+    """按最近使用淘汰的用户分区缓存，同时限制分区数量和总内存"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最多缓存的分区数量
+            max_bytes: 所有分区合计的最大内存
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._partitions: OrderedDict[int, OwnerPartition] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._partitions)
+
+    @property
+    def nbytes(self) -> int:
+        """已缓存分区的总内存"""
+        return self._nbytes
+
+    def get(self, owner_id: int) -> Optional[OwnerPartition]:
+        """读取分区并标记为最近使用，不存在时返回None"""
+        with self._lock:
+            partition = self._partitions.get(owner_id)
+            if partition is not None:
+                self._partitions.move_to_end(owner_id)
+            return partition
+
+    def put(self, partition: OwnerPartition) -> None:
+        """
+        保存分区，超出容量时淘汰最久未使用的分区
+
+        超过总内存上限的单个分区不缓存，每次搜索时重新构建
+        """
+        with self._lock:
+            previous = self._partitions.pop(partition.owner_id, None)
+            if previous is not None:
+                self._nbytes -= previous.nbytes
+            if partition.nbytes > self.max_bytes:
+                return
+
+            self._partitions[partition.owner_id] = partition
+            self._nbytes += partition.nbytes
+            while len(self._partitions) > self.max_entries or self._nbytes > self.max_bytes:
+                _, evicted = self._partitions.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._partitions.clear()
+            self._nbytes = 0
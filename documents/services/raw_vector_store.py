@@ -0,0 +1,226 @@
+"""
+原始向量存储模块
+把归一化后的float32原始向量以追加写的方式保存在磁盘上，通过内存映射按需读取，
+供压缩索引的精确重排等场景使用，原始向量不常驻进程内存
+"""
+
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+class RawVectorStore:
+    """磁盘上的原始向量存储，按向量ID读取"""
+
+    VECTORS_FILE = "raw_vectors.f32"
+    IDS_FILE = "raw_vector_ids.i64"
+    LOCK_FILE = "raw_vectors.lock"
+
+    # 压缩时每批复制的向量数，控制峰值内存
+    COMPACT_BATCH_SIZE = 65536
+
+    def __init__(self, directory: str, dim: int):
+        """
+        初始化原始向量存储
+
+        Args:
+            directory: 存储目录
+            dim: 向量维度
+        """
+        self.dim = dim
+        self.vectors_file = os.path.join(directory, self.VECTORS_FILE)
+        self.ids_file = os.path.join(directory, self.IDS_FILE)
+        self.lock_file = os.path.join(directory, self.LOCK_FILE)
+
+        self._lock = threading.Lock()
+        # (向量文件标识, 行数, 向量的np.memmap, 排序后的向量ID, 对应的行号)，整体替换，读取时无需加锁
+        self._state = (None, 0, None, None, None)
+        self.refresh()
+
+    @property
+    def count(self) -> int:
+        """已存储的向量数量（同一ID写入多次时重复计数）"""
+        return self._state[1]
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False) -> Iterator[None]:
+        """
+        基于fcntl的跨进程文件锁
+
+        追加写入和压缩持有排他锁，向量文件和ID文件在锁内一起修改；
+        重新映射时持有共享锁，不会读到只写了其中一个文件的中间状态
+        """
+        with open(self.lock_file, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _file_state(self) -> Tuple[Optional[Tuple[int, int]], int]:
+        """
+        向量文件的(设备号, inode)和ID文件的行数
+
+        压缩或清空时两个文件一起被替换，标识随之变化；已映射的向量文件不会被释放，inode不会被新文件复用
+        """
+        try:
+            stat = os.stat(self.vectors_file)
+            return (stat.st_dev, stat.st_ino), os.path.getsize(self.ids_file) // 8
+        except FileNotFoundError:
+            return None, 0
+
+    def _complete_rows(self) -> int:
+        """向量和ID都已完整写入的行数，写入中断时两个文件的长度可能不一致"""
+        if not os.path.exists(self.vectors_file) or not os.path.exists(self.ids_file):
+            return 0
+        return min(os.path.getsize(self.ids_file) // 8, os.path.getsize(self.vectors_file) // (self.dim * 4))
+
+    def refresh(self) -> None:
+        """
+        按需重新映射磁盘文件，其他进程追加写入或压缩后生效
+
+        文件的大小和标识都没有变化时直接返回；追加的向量只读取新增部分的ID并合并进已排序的索引，
+        不重新读取和排序全部ID
+        """
+        state = self._state
+        if self._file_state() == (state[0], state[1]):
+            return
+
+        with self._lock, self._file_lock(shared=True):
+            key, _ = self._file_state()
+            rows = self._complete_rows()
+            old_key, old_rows, _, sorted_ids, sorted_rows = self._state
+            if key == old_key and rows == old_rows:
+                return
+            if key is None or rows == 0:
+                self._state = (key, 0, None, None, None)
+                return
+
+            if key != old_key or rows < old_rows or sorted_ids is None:
+                ids = np.fromfile(self.ids_file, dtype=np.int64, count=rows)
+                sorted_rows = np.argsort(ids, kind="stable")
+                sorted_ids = ids[sorted_rows]
+            else:
+                # 新向量排在相同ID的旧向量之后，读取时取最后一个即为最新写入的向量
+                new_ids = np.fromfile(self.ids_file, dtype=np.int64, count=rows - old_rows, offset=old_rows * 8)
+                order = np.argsort(new_ids, kind="stable")
+                positions = np.searchsorted(sorted_ids, new_ids[order], side="right")
+                sorted_ids = np.insert(sorted_ids, positions, new_ids[order])
+                sorted_rows = np.insert(sorted_rows, positions, order + old_rows)
+
+            vectors = np.memmap(self.vectors_file, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            self._state = (key, rows, vectors, sorted_ids, sorted_rows)
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """
+        追加保存向量，在跨进程文件锁内写入，多个进程同时追加时向量和ID的行不会错位
+
+        追加后不立即重新映射，下一次读取时按ID文件大小的变化只加载新增部分
+
+        Args:
+            ids: 向量ID，形状(n,)
+            vectors: 归一化后的向量，形状(n, dim)
+        """
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(ids) != len(vectors) or vectors.shape[1] != self.dim:
+            raise ValueError(f"向量ID数量或维度不匹配: ids={ids.shape}, vectors={vectors.shape}")
+
+        with self._file_lock():
+            # 之前的写入中断时截掉多出的部分，新写入的向量和ID从同一行开始
+            rows = self._complete_rows()
+            with open(self.vectors_file, "ab") as f:
+                f.truncate(rows * self.dim * 4)
+                vectors.tofile(f)
+            with open(self.ids_file, "ab") as f:
+                f.truncate(rows * 8)
+                ids.tofile(f)
+
+    def get(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按向量ID读取原始向量
+
+        Args:
+            ids: 向量ID，形状(n,)
+
+        Returns:
+            (vectors, found): vectors形状(n, dim)，未找到的行为0；found为布尔掩码
+        """
+        self.refresh()
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.zeros((len(ids), self.dim), dtype=np.float32)
+
+        _, _, mapped, sorted_ids, sorted_rows = self._state
+        if sorted_ids is None or mapped is None or len(ids) == 0:
+            return vectors, np.zeros(len(ids), dtype=bool)
+
+        # 同一ID被写入多次时使用最后写入的向量
+        positions = np.searchsorted(sorted_ids, ids, side="right") - 1
+        positions = np.clip(positions, 0, len(sorted_ids) - 1)
+        found = sorted_ids[positions] == ids
+
+        if found.any():
+            rows = sorted_rows[positions[found]]
+            vectors[found] = mapped[rows]
+        return vectors, found
+
+    def compact(self, deleted_ids: np.ndarray) -> int:
+        """
+        重写磁盘文件，去掉已删除的向量和同一ID被覆盖的旧向量，在索引段合并进基础段后调用
+
+        只删除明确给出的ID，尚未提交到索引的新向量不受影响；新文件写完后原子替换，
+        其他进程已有的内存映射继续使用旧文件，下一次读取时检测到文件标识变化后重新映射
+
+        Args:
+            deleted_ids: 已从索引中物理删除的向量ID
+
+        Returns:
+            int: 删除的行数
+        """
+        with self._file_lock():
+            rows = self._complete_rows()
+            if rows == 0:
+                return 0
+            ids = np.fromfile(self.ids_file, dtype=np.int64, count=rows)
+
+            # 每个ID只保留最后写入的一行
+            order = np.argsort(ids, kind="stable")
+            last = np.ones(rows, dtype=bool)
+            last[:-1] = ids[order[:-1]] != ids[order[1:]]
+            keep_rows = np.sort(order[last & ~np.isin(ids[order], deleted_ids)])
+            removed = rows - len(keep_rows)
+            if removed == 0:
+                return 0
+
+            vectors = np.memmap(self.vectors_file, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            tmp_vectors, tmp_ids = f"{self.vectors_file}.tmp.{os.getpid()}", f"{self.ids_file}.tmp.{os.getpid()}"
+            try:
+                with open(tmp_vectors, "wb") as f:
+                    for start in range(0, len(keep_rows), self.COMPACT_BATCH_SIZE):
+                        vectors[keep_rows[start : start + self.COMPACT_BATCH_SIZE]].tofile(f)
+                ids[keep_rows].tofile(tmp_ids)
+                # 读取方在共享锁内重新映射，两个文件的替换对其是原子的
+                os.replace(tmp_vectors, self.vectors_file)
+                os.replace(tmp_ids, self.ids_file)
+            finally:
+                for path in (tmp_vectors, tmp_ids):
+                    if os.path.exists(path):
+                        os.remove(path)
+            del vectors
+
+        logger.info(f"原始向量存储已压缩: 删除{removed}行，保留{len(keep_rows)}行")
+        return removed
+
+    def clear(self) -> None:
+        """删除磁盘上的原始向量文件"""
+        with self._lock, self._file_lock():
+            for path in (self.vectors_file, self.ids_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._state = (None, 0, None, None, None)
+        logger.info("已清空原始向量存储")
@@ -0,0 +1,188 @@
+"""
+检索结果去冗余模块
+分块时相邻文档块有约10%的重叠，章节过长时还会被切成“部分 i/n”的多个块，检索结果中常出现同一文档的相邻块。
+本模块把同一文档中相邻的文档块合并为一个结果（去掉重叠部分），再按最大边际相关性(MMR)选择结果，
+减少送入LLM的重复上下文
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# 相邻文档块的重叠部分短于该长度时视为没有重叠，避免把偶然相同的标点或单字当作重叠去掉
+MIN_OVERLAP_CHARS = 8
+
+
+def overlap_length(previous: str, following: str, min_overlap: int = MIN_OVERLAP_CHARS) -> int:
+    """
+    计算previous的后缀与following的前缀的最长重叠长度
+
+    Args:
+        previous: 前一个文档块的文本
+        following: 后一个文档块的文本
+        min_overlap: 最短重叠长度，更短的重叠返回0
+
+    Returns:
+        int: 重叠的字符数
+    """
+    limit = min(len(previous), len(following))
+    if limit < min_overlap:
+        return 0
+
+    # KMP前缀函数：following前缀 + 分隔符 + previous后缀，末尾的值即为最长的“既是后缀又是前缀”的长度
+    text = following[:limit] + "\0" + previous[-limit:]
+    prefix = [0] * len(text)
+    for i in range(1, len(text)):
+        j = prefix[i - 1]
+        while j and text[i] != text[j]:
+            j = prefix[j - 1]
+        if text[i] == text[j]:
+            j += 1
+        prefix[i] = j
+
+    return prefix[-1] if prefix[-1] >= min_overlap else 0
+
+
+# 表示结果排序依据的分数字段，按优先级排列：重排分数、融合分数，都没有时为向量相似度
+RANKING_FIELDS = ("rerank_score", "fused_score", "score")
+
+
+def ranking_score(result: Dict[str, Any]) -> float:
+    """
+    检索结果当前排序所依据的分数
+
+    混合检索和重排不覆盖score（向量相似度），各自的分数保存在fused_score和rerank_score中
+
+    Args:
+        result: 检索结果
+
+    Returns:
+        重排分数，其次为融合分数，都没有时为score
+    """
+    for field in RANKING_FIELDS:
+        if field in result:
+            return result[field]
+    return 0.0
+
+
+def merge_adjacent_chunks(results: List[Dict[str, Any]], max_chunks: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    合并同一文档中chunk_index连续的文档块
+
+    合并后的结果位于其中排名最靠前的文档块的位置，score等分数字段为其中的最高分数，content按chunk_index顺序拼接并去掉重叠部分，
+    chunk_id和chunk_index取第一个文档块，chunk_ids为全部文档块ID
+
+    Args:
+        results: 按相关性降序的检索结果
+        max_chunks: 每个合并结果最多包含的文档块数量，更长的连续段按顺序拆开，默认不限制
+
+    Returns:
+        合并后的检索结果，仍按相关性降序
+    """
+    if len(results) < 2:
+        return [{**result, "chunk_ids": [result["chunk_id"]]} for result in results]
+
+    document_ids = np.array([result["id"] for result in results], dtype=np.int64)
+    chunk_indexes = np.array([result["chunk_index"] for result in results], dtype=np.int64)
+
+    # 按(文档, chunk_index)排序，文档不变且chunk_index连续的位置属于同一段
+    order = np.lexsort((chunk_indexes, document_ids))
+    breaks = (np.diff(document_ids[order]) != 0) | (np.diff(chunk_indexes[order]) != 1)
+    run_labels = np.empty(len(results), dtype=np.int64)
+    sorted_labels = np.concatenate(([0], np.cumsum(breaks)))
+    if max_chunks:
+        # 连续段内的位置按max_chunks分组，每组作为一个新的段
+        run_starts = np.flatnonzero(np.concatenate(([True], breaks)))
+        positions = np.arange(len(results)) - run_starts[sorted_labels]
+        pieces = np.concatenate(([0], np.diff(sorted_labels) + (np.diff(positions // max_chunks) > 0)))
+        sorted_labels = np.cumsum(pieces)
+    run_labels[order] = sorted_labels
+
+    # 每段中排名最靠前的位置（results已按相关性降序）
+    num_runs = int(run_labels.max()) + 1
+    first_rank = np.full(num_runs, len(results), dtype=np.int64)
+    np.minimum.at(first_rank, run_labels, np.arange(len(results)))
+
+    merged = []
+    for run in np.argsort(first_rank, kind="stable"):
+        members = [results[i] for i in order[run_labels[order] == run]]
+        best = results[first_rank[run]]
+        if len(members) == 1:
+            merged.append({**best, "chunk_ids": [best["chunk_id"]]})
+            continue
+
+        content = members[0]["content"]
+        for member in members[1:]:
+            overlap = overlap_length(content, member["content"])
+            content += member["content"][overlap:] if overlap else "\n\n" + member["content"]
+
+        scores = {
+            field: max(member[field] for member in members if field in member)
+            for field in RANKING_FIELDS
+            if any(field in member for member in members)
+        }
+        merged.append(
+            {
+                **best,
+                **scores,
+                "content": content,
+                "chunk_id": members[0]["chunk_id"],
+                "chunk_index": members[0]["chunk_index"],
+                "chunk_ids": [member["chunk_id"] for member in members],
+            }
+        )
+    return merged
+
+
+def mmr_select(
+    relevance: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    lambda_: float = 0.7,
+    costs: Optional[Sequence[int]] = None,
+) -> List[int]:
+    """
+    按最大边际相关性(MMR)选择结果
+
+    每一步选择 lambda_ * 相关性 - (1 - lambda_) * 与已选结果的最大相似度 最高的候选
+
+    Args:
+        relevance: 候选的相关性分数，形状(n,)，按最小值-最大值归一化到[0, 1]后使用
+        vectors: 归一化后的候选向量，形状(n, dim)
+        k: 最多选择的数量（costs不为空时为总成本上限）
+        lambda_: 相关性的权重，1表示只按相关性选择
+        costs: 每个候选占用的数量，合并的结果按其包含的文档块数计算，默认均为1
+
+    Returns:
+        被选中候选的下标，按选择顺序
+    """
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+
+    relevance = np.asarray(relevance, dtype=np.float32)
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(n, dtype=np.float32)
+    costs = np.ones(n, dtype=np.int64) if costs is None else np.asarray(costs, dtype=np.int64)
+
+    similarity = vectors @ vectors.T
+    max_similarity = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    budget = k
+    selected = []
+
+    while True:
+        # 第一个结果总是选中，即使它的成本超过上限
+        candidates = available & ((costs <= budget) if selected else True)
+        if not candidates.any():
+            break
+        scores = lambda_ * relevance - (1 - lambda_) * max_similarity
+        best = int(np.argmax(np.where(candidates, scores, -np.inf)))
+        selected.append(best)
+        available[best] = False
+        budget -= costs[best]
+        if budget <= 0:
+            break
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+    return selected
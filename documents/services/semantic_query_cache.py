@@ -0,0 +1,198 @@
+"""
+语义查询缓存模块
+把最近查询的向量保存在一个小的内存FAISS索引中，新查询与缓存查询的余弦相似度超过阈值时直接返回缓存的检索结果，
+措辞略有不同的相同问题不再重复搜索和加载文档块。缓存与索引代数绑定，索引写入、删除或合并后整体失效
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional
+
+import faiss
+import numpy as np
+from loguru import logger
+
+
+class _Entry(NamedTuple):
+    scope: Hashable
+    created: float
+    results: List[Dict[str, Any]]
+
+
+class SemanticQueryCache:
+    """按查询向量相似度命中的检索结果缓存"""
+
+    def __init__(
+        self,
+        dim: int,
+        threshold: float = 0.95,
+        max_entries: int = 10000,
+        ttl: float = 3600,
+        candidates: int = 16,
+        report_interval: int = 1000,
+    ):
+        """
+        初始化语义查询缓存
+
+        Args:
+            dim: 查询向量维度
+            threshold: 命中所需的最低余弦相似度
+            max_entries: 最多缓存的查询数量，超过时淘汰最久未命中的查询
+            ttl: 缓存有效期（秒）
+            candidates: 每个查询检查的最相似缓存查询数量，其中第一个同一范围且未过期的查询即为命中
+            report_interval: 每查找多少个查询记录一次命中率日志，0表示不记录
+        """
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.candidates = candidates
+        self.report_interval = report_interval
+
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._next_id = 0
+        self._generation = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        """缓存的查询向量占用的内存（不含缓存的检索结果）"""
+        return len(self._entries) * self.dim * 4
+
+    def get_many(
+        self, query_vectors: np.ndarray, scope: Hashable, generation: Hashable
+    ) -> List[Optional[List[Dict[str, Any]]]]:
+        """
+        查找与各查询足够相似的缓存查询
+
+        Args:
+            query_vectors: 归一化后的查询向量，形状(nq, dim)
+            scope: 结果的适用范围（用户、top_k、搜索参数），只有范围相同的缓存查询才能命中
+            generation: 当前索引代数，与缓存的代数不同时清空缓存
+
+        Returns:
+            与query_vectors顺序一致的缓存结果，未命中时为None
+        """
+        results = [None] * len(query_vectors)
+        with self._lock:
+            self._sync_generation(generation)
+
+            if self._entries:
+                scores, ids = self._index.search(query_vectors, min(self.candidates, len(self._entries)))
+                now = time.monotonic()
+                expired = set()
+                for q in range(len(query_vectors)):
+                    for score, entry_id in zip(scores[q], ids[q].tolist()):
+                        # 结果按相似度降序，低于阈值后不再检查
+                        if entry_id < 0 or score < self.threshold:
+                            break
+                        entry = self._entries.get(entry_id)
+                        if entry is None or entry_id in expired:
+                            continue
+                        if now - entry.created > self.ttl:
+                            expired.add(entry_id)
+                            continue
+                        if entry.scope != scope:
+                            continue
+                        self._entries.move_to_end(entry_id)
+                        results[q] = [dict(result) for result in entry.results]
+                        break
+                if expired:
+                    self._remove(list(expired))
+
+            hits = sum(result is not None for result in results)
+            lookups = self.hits + self.misses
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        if self.report_interval and lookups // self.report_interval != (lookups + len(results)) // self.report_interval:
+            stats = self.stats()
+            logger.info(
+                f"语义查询缓存命中率: {stats['hit_ratio']:.1%} ({stats['hits']}/{stats['hits'] + stats['misses']})，"
+                f"缓存查询数: {stats['entries']}"
+            )
+        return results
+
+    def put_many(
+        self,
+        query_vectors: np.ndarray,
+        scope: Hashable,
+        generation: Hashable,
+        results: List[List[Dict[str, Any]]],
+    ) -> None:
+        """
+        缓存查询的检索结果
+
+        Args:
+            query_vectors: 归一化后的查询向量，形状(nq, dim)
+            scope: 结果的适用范围
+            generation: 搜索时使用的索引代数，与缓存当前代数不同时不缓存
+            results: 与query_vectors顺序一致的检索结果，空结果不缓存
+        """
+        keep = [q for q, query_results in enumerate(results) if query_results]
+        if not keep or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            # 搜索期间索引已更新，结果属于旧的代数
+            if generation != self._generation:
+                return
+
+            ids = np.arange(self._next_id, self._next_id + len(keep), dtype=np.int64)
+            self._next_id += len(keep)
+            self._index.add_with_ids(np.ascontiguousarray(query_vectors[keep], dtype="float32"), ids)
+
+            now = time.monotonic()
+            for entry_id, q in zip(ids.tolist(), keep):
+                self._entries[entry_id] = _Entry(scope, now, [dict(result) for result in results[q]])
+
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._remove(list(self._entries)[:overflow])
+
+    def clear(self) -> None:
+        """清空缓存，保留命中统计"""
+        with self._lock:
+            self._reset()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        缓存统计
+
+        Returns:
+            dict: entries（缓存查询数）、hits、misses、hit_ratio
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _sync_generation(self, generation: Hashable) -> None:
+        """索引代数变化时清空缓存，调用方需持有锁"""
+        if generation != self._generation:
+            if self._entries:
+                logger.debug(f"索引代数变化，清空{len(self._entries)}个语义缓存查询")
+            self._reset()
+            self._generation = generation
+
+    def _reset(self) -> None:
+        """调用方需持有锁"""
+        self._index.reset()
+        self._entries.clear()
+
+    def _remove(self, entry_ids: List[int]) -> None:
+        """删除缓存查询，调用方需持有锁"""
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
+        self._index.remove_ids(np.array(entry_ids, dtype=np.int64))
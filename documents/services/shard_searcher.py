@@ -0,0 +1,91 @@
+"""
+分片搜索模块
+把一次查询并行分发到多个索引分片（基础段分片和增量段），再用堆合并各分片的前k个结果。
+FAISS搜索时会释放GIL，线程池即可让多个分片在不同CPU核心上同时搜索
+"""
+
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Sequence, Tuple, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+SearchResult = Tuple[np.ndarray, np.ndarray]
+
+
+class ShardSearcher:
+    """在线程池中并行搜索多个分片并合并结果"""
+
+    def __init__(self, max_workers: int):
+        """
+        初始化分片搜索
+
+        Args:
+            max_workers: 并行搜索的线程数，不大于1时在调用线程中依次搜索
+        """
+        self.max_workers = max_workers
+        self._executor = None
+        if max_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="faiss-shard")
+
+    def map(self, func: Callable[[T], SearchResult], shards: Sequence[T]) -> List[SearchResult]:
+        """
+        对每个分片执行搜索
+
+        Args:
+            func: 搜索单个分片的函数，返回(distances, indices)
+            shards: 分片列表
+
+        Returns:
+            与shards顺序一致的搜索结果
+        """
+        executor = self._executor
+        if executor is not None and len(shards) > 1:
+            try:
+                return list(executor.map(func, shards))
+            except RuntimeError:
+                # 线程池已关闭（实例被淘汰时仍在进行的搜索），在当前线程中依次搜索
+                if self._executor is not None:
+                    raise
+        return [func(shard) for shard in shards]
+
+    @staticmethod
+    def merge_top_k(results: List[SearchResult], k: int) -> SearchResult:
+        """
+        合并各分片按分数降序排列的结果，取全局前k个
+
+        每个分片的结果已有序，对每个查询做k路堆合并，只需取出前k个元素
+
+        Args:
+            results: 各分片的(distances, indices)，形状均为(nq, k_i)，ID为-1表示空结果
+            k: 返回结果数量
+
+        Returns:
+            (distances, indices): 形状均为(nq, k)，按分数降序，不足k个时ID为-1
+        """
+        if len(results) == 1 and results[0][1].shape[1] == k:
+            return results[0]
+
+        nq = len(results[0][0]) if results else 0
+        out_distances = np.full((nq, k), -np.inf, dtype=np.float32)
+        out_indices = np.full((nq, k), -1, dtype=np.int64)
+
+        for q in range(nq):
+            streams = [
+                zip((-distances[q][indices[q] >= 0]).tolist(), indices[q][indices[q] >= 0].tolist())
+                for distances, indices in results
+            ]
+            for rank, (neg_score, idx) in enumerate(heapq.merge(*streams)):
+                if rank >= k:
+                    break
+                out_distances[q, rank] = -neg_score
+                out_indices[q, rank] = idx
+
+        return out_distances, out_indices
+
+    def shutdown(self) -> None:
+        """关闭线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,89 @@
+"""
+墓碑过滤模块
+把向量ID集合保存为位图，构造FAISS的IDSelector在搜索内部过滤向量：
+IdBitmap只接受集合中的ID（如某个用户的文档块），TombstoneFilter排除已删除的ID
+"""
+
+from typing import Optional
+
+import faiss
+import numpy as np
+
+
+class IdBitmap:
+    """向量ID集合的位图，创建后不再修改，可在多个搜索线程间共享"""
+
+    def __init__(self, ids: Optional[np.ndarray] = None):
+        """
+        初始化位图
+
+        Args:
+            ids: 向量ID（即文档块ID）
+        """
+        ids = np.asarray(ids if ids is not None else [], dtype=np.int64)
+        ids = ids[ids >= 0]
+        self.count = len(np.unique(ids))
+        self.size = int(ids.max()) + 1 if len(ids) else 0
+
+        # FAISS的IDSelectorBitmap按小端位序读取：第i个ID对应bitmap[i >> 3]的第(i & 7)位
+        self._bitmap = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        np.bitwise_or.at(self._bitmap, ids >> 3, (1 << (ids & 7)).astype(np.uint8))
+
+        # IDSelector只保存指针，位图需要和选择器保持相同的生命周期
+        self._bitmap_selector = None
+        if self.count:
+            self._bitmap_selector = faiss.IDSelectorBitmap(self.size, faiss.swig_ptr(self._bitmap))
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def nbytes(self) -> int:
+        """位图占用的内存"""
+        return self._bitmap.nbytes
+
+    @property
+    def selector(self) -> Optional[faiss.IDSelector]:
+        """只接受集合中ID的选择器，集合为空时返回None"""
+        return self._bitmap_selector
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """
+        判断向量ID是否在集合中
+
+        Args:
+            ids: 任意形状的向量ID数组，-1表示空结果
+
+        Returns:
+            与ids形状相同的布尔数组
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        found = np.zeros(ids.shape, dtype=bool)
+        if not self.count:
+            return found
+
+        in_range = (ids >= 0) & (ids < self.size)
+        candidates = ids[in_range]
+        found[in_range] = ((self._bitmap[candidates >> 3] >> (candidates & 7)) & 1).astype(bool)
+        return found
+
+    def rejects(self, ids: np.ndarray) -> np.ndarray:
+        """选择器会过滤掉的ID，用于不支持IDSelector的索引在搜索后过滤"""
+        return ~self.contains(ids)
+
+
+class TombstoneFilter(IdBitmap):
+    """已删除向量ID的位图，在FAISS搜索内部过滤已删除的向量"""
+
+    def __init__(self, ids: Optional[np.ndarray] = None):
+        super().__init__(ids)
+        # IDSelectorNot同样只保存内层选择器的指针
+        self._selector = faiss.IDSelectorNot(self._bitmap_selector) if self.count else None
+
+    @property
+    def selector(self) -> Optional[faiss.IDSelector]:
+        """只保留未删除向量的选择器，没有墓碑时返回None"""
+        return self._selector
+
+    def rejects(self, ids: np.ndarray) -> np.ndarray:
+        return self.contains(ids)
@@ -1,12 +1,14 @@
 import os
 import numpy as np
 import faiss
-from typing import List, Dict, Any, Self
+from typing import List, Dict, Any, Optional, Self, Tuple
 from loguru import logger
 from django.conf import settings
+from django.db.models import CharField
+from django.db.models.functions import Cast
 import pickle
 from pathlib import Path
-import gc  # 添加垃圾回收模块
+import math
 import threading
 import time
 
@@ -14,7 +16,20 @@ from ..models import Document, DocumentChunk
 
 # 替换直接导入为使用工厂函数
 from .embedding_factory import get_embedding_service
+from .faiss_index_factory import FaissIndexFactory
+from .index_snapshot import IndexSnapshot
+from .instance_registry import InstanceRegistry
+from .lexical_index import LexicalIndex
+from .model_storage import adopt_root_storage, get_active_model, get_active_model_version, model_storage_path
+from .owner_partition import OwnerPartition, OwnerPartitionCache
+from .raw_vector_store import RawVectorStore
+from .result_diversifier import merge_adjacent_chunks, mmr_select, ranking_score
+from .semantic_query_cache import SemanticQueryCache
+from .shard_searcher import ShardSearcher
+from .tombstone_filter import IdBitmap, TombstoneFilter
+from .vector_segment_store import VectorSegmentStore
 from common.utils.cache_utils import RedisCache, cached
+from common.utils.rate_limiter import GlobalTokenBucket
 
 # loguru不需要getLogger
 
@@ -22,8 +37,9 @@ from common.utils.cache_utils import RedisCache, cached
 class VectorDBService:
     """向量数据库服务，用于存储和检索文档向量"""
 
-    # 单例模式相关变量（使用字典存储不同模型版本的实例）
-    _instances = {}
+    # 单例模式相关变量（每个模型版本一个实例，保存在按内存预算淘汰空闲实例的注册表中，首次使用时创建）
+    _instances: Optional[InstanceRegistry] = None
+    _pinned_version = None  # 注册表中固定的当前检索模型版本
     _instance_lock = threading.Lock()
     _initialized_lock = threading.Lock()
     _is_initialized = {}  # 使用字典跟踪每个模型版本是否已预加载
@@ -32,6 +48,7 @@ class VectorDBService:
     REDIS_META_KEY = "smartdocs:faiss:meta:{}"  # 用于存储元数据
     REDIS_UPDATE_FLAG_KEY = "smartdocs:faiss:updated:{}"  # 用于标记索引更新
     REDIS_EXPIRY = 60 * 60 * 24 * 7  # 7天过期
+    SEARCH_CACHE_NAMESPACE = "vector_search"  # 向量搜索缓存的命名空间，递增版本号即可使全部搜索缓存失效
 
     # Redis Pub/Sub频道
     REDIS_UPDATE_CHANNEL = "smartdocs:faiss:update_channel:{}"  # 索引更新通知频道
@@ -42,30 +59,84 @@ class VectorDBService:
         获取单例实例，确保相同嵌入模型版本只有一个实例
 
         Args:
-            embedding_model_version: 嵌入模型版本，如果未指定则使用settings中的配置
+            embedding_model_version: 嵌入模型版本，如果未指定则使用当前提供检索的模型版本
 
         Returns:
             VectorDBService: 单例实例
         """
-        # 规范化模型版本，确保None使用默认值
-        model_version = embedding_model_version or settings.EMBEDDING_MODEL_VERSION
+        # 规范化模型版本，None使用当前提供检索的版本（迁移完成后随active_model.json切换）
+        active_version = get_active_model_version()
+        model_version = embedding_model_version or active_version
 
-        # 使用锁保证线程安全
+        # 全局锁内只查找、创建和淘汰实例，加载索引在各实例自己的初始化锁内进行，
+        # 加载一个模型版本的索引时不阻塞其他模型版本的请求
         with cls._instance_lock:
-            # 如果该模型版本的实例不存在，则创建
-            if model_version not in cls._instances:
+            registry = cls._get_registry()
+            # 当前检索模型版本的实例始终保留，切换后旧版本的实例空闲后可以被淘汰
+            if active_version != cls._pinned_version:
+                if cls._pinned_version is not None:
+                    registry.unpin(cls._pinned_version)
+                registry.pin(active_version)
+                cls._pinned_version = active_version
+            # 如果该模型版本的实例不存在（或已被淘汰），则创建
+            instance = registry.get(model_version)
+            if instance is None:
                 logger.info(f"创建新的VectorDBService实例 (模型版本: {model_version})")
-                cls._instances[model_version] = super(VectorDBService, cls).__new__(cls)
-                cls._instances[model_version]._initialized = False
+                instance = super(VectorDBService, cls).__new__(cls)
+                instance._initialized = False
+                instance._init_lock = threading.Lock()
+                registry.put(model_version, instance)
+
+        # 如果该实例尚未初始化，调用初始化方法；同一版本的其他请求等待初始化完成
+        created = False
+        if not instance._initialized:
+            with instance._init_lock:
+                if not instance._initialized:
+                    instance._init(model_version)
+                    instance._initialized = True
+                    created = True
+
+        # 新加载的实例可能使合计内存超出预算，立即检查；否则按间隔定期检查
+        registry.maybe_evict(force=created, keep=model_version)
+        return instance
 
-            instance = cls._instances[model_version]
+    @classmethod
+    def _get_registry(cls) -> InstanceRegistry:
+        """创建实例注册表，调用方需持有_instance_lock"""
+        if cls._instances is None:
+            cls._instances = InstanceRegistry(
+                max_bytes=getattr(settings, "VECTOR_INSTANCE_MEMORY_BUDGET_MB", 2048) * 1024 * 1024,
+                idle_seconds=getattr(settings, "VECTOR_INSTANCE_IDLE_SECONDS", 300),
+                memory_of=lambda instance: instance.memory_usage()["total"] if instance._initialized else 0,
+                on_evict=lambda instance: instance.close(),
+            )
+            cls._pinned_version = None
+        return cls._instances
 
-            # 如果该实例尚未初始化，调用初始化方法
-            if not getattr(instance, "_initialized", False):
-                instance._init(model_version)
-                instance._initialized = True
+    @classmethod
+    def resident_instances(cls) -> List[Dict[str, Any]]:
+        """
+        报告本进程已加载的各模型版本实例
 
-            return instance
+        Returns:
+            按最近使用顺序（最近的在后）的列表，每项包含embedding_model_version、bytes（估算的内存占用）、
+            idle_seconds（空闲秒数）、pinned（是否始终保留）、ntotal（向量数量）
+        """
+        with cls._instance_lock:
+            registry = cls._get_registry()
+        resident = registry.resident(
+            describe=lambda instance: {"ntotal": instance.ntotal if instance._initialized else 0}
+        )
+        return [
+            {
+                "embedding_model_version": item["key"],
+                "bytes": item["bytes"],
+                "idle_seconds": round(item["idle_seconds"], 1),
+                "pinned": item["pinned"],
+                "ntotal": item["ntotal"],
+            }
+            for item in resident
+        ]
 
     def __new__(cls, embedding_model_version=None):
         """
@@ -87,7 +158,7 @@ class VectorDBService:
             embedding_model_version: 嵌入模型版本
         """
         # 记录使用的嵌入模型版本
-        self.embedding_model_version = embedding_model_version or settings.EMBEDDING_MODEL_VERSION
+        self.embedding_model_version = embedding_model_version or get_active_model_version()
         logger.info(f"初始化VectorDBService，使用嵌入模型: {self.embedding_model_version}")
 
         # 使用工厂函数初始化嵌入服务，传递模型版本
@@ -97,28 +168,165 @@ class VectorDBService:
         self.vector_dim = self.embedding_service.vector_dim  # 使用嵌入服务的实际向量维度
         logger.info(f"使用向量维度: {self.vector_dim} (来自嵌入服务的实际维度)")
 
-        self.vector_store_path = settings.VECTOR_STORE_PATH
-        self.index_file = os.path.join(self.vector_store_path, "faiss_index.bin")
-        self.mapping_file = os.path.join(self.vector_store_path, "chunk_mapping.pkl")
+        # 每个模型版本的索引保存在单独的目录中，不同版本互不覆盖；旧布局的索引归默认模型版本
+        if self.embedding_model_version == settings.EMBEDDING_MODEL_VERSION:
+            adopt_root_storage(self.embedding_model_version)
+        self.vector_store_path = model_storage_path(self.embedding_model_version)
+        # 旧版本的单文件索引，首次加载时登记为分段存储的基础段
+        self.legacy_index_file = os.path.join(self.vector_store_path, "faiss_index.bin")
+        # 旧版本把向量位置到文档块ID的映射单独pickle保存，加载时迁移为IndexIDMap后删除
+        self.legacy_mapping_file = os.path.join(self.vector_store_path, "chunk_mapping.pkl")
 
         # 确保向量库目录存在
         Path(self.vector_store_path).mkdir(parents=True, exist_ok=True)
 
+        # 索引类型配置：新索引总是从IndexFlatIP开始，向量数量超过阈值后提升为配置的近似索引
+        self.index_type = getattr(settings, "VECTOR_INDEX_TYPE", FaissIndexFactory.FLAT)
+        self.index_promote_threshold = getattr(settings, "VECTOR_INDEX_PROMOTE_THRESHOLD", 100000)
+        self.index_options = {
+            "hnsw_m": getattr(settings, "VECTOR_INDEX_HNSW_M", 32),
+            "hnsw_ef_construction": getattr(settings, "VECTOR_INDEX_HNSW_EF_CONSTRUCTION", 200),
+            "hnsw_ef_search": getattr(settings, "VECTOR_INDEX_HNSW_EF_SEARCH", 64),
+            "ivf_nlist": getattr(settings, "VECTOR_INDEX_IVF_NLIST", 0),
+            "ivf_nprobe": getattr(settings, "VECTOR_INDEX_IVF_NPROBE", 16),
+            "pq_m": getattr(settings, "VECTOR_INDEX_PQ_M", 64),
+        }
+
+        # 原始向量保存在磁盘上（内存映射读取），压缩索引的候选结果用原始向量精确重排
+        self.raw_vector_store = None
+        if getattr(settings, "VECTOR_INDEX_KEEP_RAW_VECTORS", True):
+            self.raw_vector_store = RawVectorStore(self.vector_store_path, self.vector_dim)
+        self.rerank_factor = getattr(settings, "VECTOR_INDEX_RERANK_FACTOR", 4)
+
+        # 只读进程以内存映射方式加载索引，同一主机上的多个worker共享页缓存
+        self.use_mmap = getattr(settings, "VECTOR_INDEX_MMAP", False)
+
+        # 分段存储：新增文档写入增量段，后台任务把增量段合并进基础段
+        self.segment_store = VectorSegmentStore(self.vector_store_path)
+        self.segment_max_deltas = getattr(settings, "VECTOR_SEGMENT_MAX_DELTAS", 8)
+        self.segment_merge_ratio = getattr(settings, "VECTOR_SEGMENT_MERGE_RATIO", 0.1)
+        # 索引文档时每批向量化的文档块数量，嵌入服务再按API的单次请求上限拆分
+        self.index_batch_size = max(getattr(settings, "EMBEDDING_INDEX_BATCH_SIZE", 256), 1)
+        # 基础段按文档块ID分片，合并进基础段时按chunk_id % 分片数写入各分片
+        self.num_shards = max(getattr(settings, "VECTOR_INDEX_SHARDS", 1), 1)
+        # 基础段分片和增量段在线程池中并行搜索
+        self.shard_searcher = ShardSearcher(
+            getattr(settings, "VECTOR_SEARCH_THREADS", 0) or min(self.num_shards + 1, os.cpu_count() or 1)
+        )
+        # 当前发布的索引快照（manifest、段和墓碑），更新时在后台构建新快照后整体替换引用，
+        # 正在搜索的线程继续使用旧快照；锁只用于发布快照，搜索不加锁
+        self.snapshot = IndexSnapshot.empty()
+        self._snapshot_lock = threading.Lock()
+        # 单写者：写入、删除、合并结果和重新加载在此锁内依次提交，搜索只读取快照引用，从不等待此锁。
+        # 文档向量化和合并计算在锁外完成（暂存），只有写段文件、更新manifest和发布快照在锁内
+        self._write_lock = threading.RLock()
+        # 过滤后结果不足top_k时扩大候选数量重新搜索的最多次数
+        self.oversample_rounds = getattr(settings, "VECTOR_SEARCH_OVERSAMPLE_ROUNDS", 3)
+
+        # 按用户检索：文档块不超过该数量的用户在内存中的原始向量矩阵上精确搜索，否则在索引中按ID位图过滤
+        self.owner_exact_search_max_chunks = getattr(settings, "VECTOR_OWNER_EXACT_SEARCH_MAX_CHUNKS", 10000)
+        self.owner_partitions = OwnerPartitionCache(
+            max_entries=getattr(settings, "VECTOR_OWNER_CACHE_MAX_ENTRIES", 256),
+            max_bytes=getattr(settings, "VECTOR_OWNER_CACHE_MAX_MB", 512) * 1024 * 1024,
+        )
+
+        # 词法索引：与向量索引包含相同的文档块，发布新快照时同步，用于混合检索
+        self.lexical_index = LexicalIndex() if getattr(settings, "HYBRID_SEARCH_ENABLED", True) else None
+        # 词法索引已同步到的快照，同步在写锁外进行，由此锁保证依次同步
+        self._lexical_snapshot = IndexSnapshot.empty()
+        self._lexical_lock = threading.Lock()
+
+        # 语义查询缓存：与最近查询足够相似的查询直接返回缓存结果，索引代数变化后失效
+        self.query_cache = None
+        if getattr(settings, "VECTOR_SEMANTIC_CACHE_ENABLED", True):
+            self.query_cache = SemanticQueryCache(
+                self.vector_dim,
+                threshold=getattr(settings, "VECTOR_SEMANTIC_CACHE_THRESHOLD", 0.95),
+                max_entries=getattr(settings, "VECTOR_SEMANTIC_CACHE_MAX_ENTRIES", 10000),
+                ttl=getattr(settings, "VECTOR_SEMANTIC_CACHE_TTL", 3600),
+            )
+
         # Pub/Sub通知相关
         self._subscriber_thread = None
         self._stop_subscriber = threading.Event()
         self._pid = os.getpid()  # 记录当前进程ID用于过滤自己发出的通知
 
+        # 合并索引更新通知：最后一条通知后安静reload_debounce秒再重新加载，
+        # 持续收到通知时最多等待reload_max_delay秒，批量导入期间不会每条通知都重新加载
+        self.reload_debounce = getattr(settings, "VECTOR_RELOAD_DEBOUNCE_SECONDS", 0.5)
+        self.reload_max_delay = getattr(settings, "VECTOR_RELOAD_MAX_DELAY_SECONDS", 5.0)
+        self._latest_notified = (None, 0)  # 通知中最新的(index_id, 代数)
+        self._pending_notifications = 0  # 等待合并的通知数量
+        self._pending_since = None  # 第一条待处理通知的时间
+        self._last_notified_at = None  # 最近一条待处理通知的时间
+
         # 初始化或加载索引
         self._init_index()
 
         # 启动索引更新通知订阅
         self._start_update_subscriber()
 
+    @property
+    def manifest(self) -> Dict[str, Any]:
+        """当前快照的manifest"""
+        return self.snapshot.manifest
+
+    @property
+    def segments(self) -> List[Tuple[str, faiss.Index]]:
+        """当前快照的(段文件名, 索引)列表，基础段分片在前"""
+        return self.snapshot.segments
+
+    @property
+    def tombstones(self) -> TombstoneFilter:
+        """当前快照的已删除向量ID，搜索时在FAISS内部过滤，合并进基础段时物理删除"""
+        return self.snapshot.tombstones
+
+    @property
+    def ntotal(self) -> int:
+        """所有段的向量总数"""
+        return self.snapshot.ntotal
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        估算本实例占用的内存
+
+        段的内存按段文件大小估算（FAISS索引的序列化格式与内存布局基本一致），
+        本地嵌入模型按参数大小计入，每个实例各自加载一个模型
+
+        Returns:
+            dict: segments、tombstones、owner_partitions、lexical_index、query_cache、embedding_model和total，
+            单位为字节
+        """
+        snapshot = self.snapshot
+        segments = 0
+        for name, index in snapshot.segments:
+            try:
+                segments += os.path.getsize(self.segment_store.segment_path(name))
+            except OSError:
+                # 段文件已被合并删除，快照中的索引仍在内存中，按向量数估算
+                segments += index.ntotal * self.vector_dim * 4
+
+        usage = {
+            "segments": segments,
+            "tombstones": snapshot.tombstones.nbytes,
+            "owner_partitions": self.owner_partitions.nbytes,
+            "lexical_index": self.lexical_index.nbytes if self.lexical_index is not None else 0,
+            "query_cache": self.query_cache.nbytes if self.query_cache is not None else 0,
+            # API嵌入服务不在进程内加载模型
+            "embedding_model": getattr(self.embedding_service, "nbytes", 0),
+        }
+        usage["total"] = sum(usage.values())
+        return usage
+
     def _get_redis_key(self, key_template):
         """获取带版本号的Redis键"""
+        return self._redis_key_for(key_template, self.embedding_model_version)
+
+    @staticmethod
+    def _redis_key_for(key_template, embedding_model_version):
+        """获取指定模型版本的Redis键"""
         # 生成安全的版本名，替换不适合作为键的字符
-        safe_version = self.embedding_model_version.replace("/", "_").replace("-", "_")
+        safe_version = embedding_model_version.replace("/", "_").replace("-", "_")
         return key_template.format(safe_version)
 
     def _mark_index_updated_in_redis(self) -> bool:
@@ -132,23 +340,19 @@ class VectorDBService:
         try:
             # 获取索引文件的修改时间
             index_mtime = 0
-            mapping_mtime = 0
 
-            if os.path.exists(self.index_file):
-                index_mtime = os.path.getmtime(self.index_file)
-            if os.path.exists(self.mapping_file):
-                mapping_mtime = os.path.getmtime(self.mapping_file)
+            if self.segment_store.exists():
+                index_mtime = os.path.getmtime(self.segment_store.manifest_file)
 
             # 创建元数据
             meta_data = {
-                "vector_count": self.index.ntotal,
+                "vector_count": self.ntotal,
                 "embedding_model_version": self.embedding_model_version,
                 "timestamp": time.time(),
                 "index_mtime": index_mtime,
-                "mapping_mtime": mapping_mtime,
+                "generation": self.manifest["generation"],
                 "vector_dim": self.vector_dim,
-                "file_path": self.index_file,
-                "mapping_file": self.mapping_file,
+                "file_path": self.segment_store.manifest_file,
                 "source_pid": os.getpid(),  # 添加源进程ID用于识别
             }
             meta_bytes = pickle.dumps(meta_data)
@@ -164,7 +368,9 @@ class VectorDBService:
             update_channel = self._get_redis_key(self.REDIS_UPDATE_CHANNEL)
             notification = {
                 "timestamp": time.time(),
-                "vector_count": self.index.ntotal,
+                "vector_count": self.ntotal,
+                "index_id": self.manifest.get("index_id"),
+                "generation": self.manifest["generation"],
                 "source_pid": os.getpid(),
                 "embedding_model_version": self.embedding_model_version,
             }
@@ -174,7 +380,7 @@ class VectorDBService:
 
             logger.info(
                 f"索引更新已标记到Redis并发布通知 (模型版本: {self.embedding_model_version})，"
-                f"包含{self.index.ntotal}个向量，进程ID: {os.getpid()}"
+                f"包含{self.ntotal}个向量，进程ID: {os.getpid()}"
             )
             return True
         except Exception as e:
@@ -199,18 +405,16 @@ class VectorDBService:
             try:
                 meta_data = pickle.loads(meta_bytes)
                 redis_index_mtime = meta_data.get("index_mtime", 0)
-                redis_mapping_mtime = meta_data.get("mapping_mtime", 0)
 
                 # 检查本地文件是否存在
-                if not os.path.exists(self.index_file) or not os.path.exists(self.mapping_file):
+                if not self.segment_store.exists():
                     return False
 
                 # 检查本地文件的修改时间是否与Redis中的匹配
-                local_index_mtime = os.path.getmtime(self.index_file)
-                local_mapping_mtime = os.path.getmtime(self.mapping_file)
+                local_index_mtime = os.path.getmtime(self.segment_store.manifest_file)
 
                 # 如果Redis中记录的时间比本地文件更新，则表示有其他进程更新了文件
-                if redis_index_mtime > local_index_mtime or redis_mapping_mtime > local_mapping_mtime:
+                if redis_index_mtime > local_index_mtime:
                     logger.info(
                         f"检测到索引文件有更新 (模型版本: {self.embedding_model_version})，"
                         f"Redis记录时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(redis_index_mtime))}，"
@@ -226,23 +430,282 @@ class VectorDBService:
             logger.error(f"检查索引更新失败: {str(e)}")
             return False
 
-    def _load_index_from_file(self) -> bool:
+    def _load_segments(self) -> bool:
         """
-        从文件加载索引到内存
+        按manifest加载索引段，已加载的段直接复用，只读取新出现的段
 
         Returns:
             bool: 是否成功加载
         """
-        try:
-            logger.info(f"从文件加载FAISS索引: {self.index_file}")
-            self.index = faiss.read_index(self.index_file)
-            with open(self.mapping_file, "rb") as f:
-                self.chunk_mapping = pickle.load(f)
-            logger.info(f"已加载FAISS索引，包含{self.index.ntotal}个向量")
+        for attempt in range(2):
+            try:
+                with self._write_lock:
+                    manifest = self.segment_store.read_manifest()
+                    self._apply_manifest(manifest)
+                self._sync_lexical_index()
+                logger.info(
+                    f"已加载FAISS索引段，包含{self.ntotal}个向量，"
+                    f"分段信息: {VectorSegmentStore.describe(manifest)}"
+                )
+                return True
+            except FileNotFoundError as e:
+                # 读取manifest后段文件被合并删除，重新读取manifest
+                if attempt == 0:
+                    logger.info(f"索引段已被合并，重新读取manifest: {str(e)}")
+                    continue
+                logger.error(f"加载索引段失败: {str(e)}")
+            except Exception as e:
+                logger.error(f"加载索引段失败: {str(e)}")
+                break
+        return False
+
+    def _apply_manifest(self, manifest: Dict[str, Any], loaded: Optional[Dict[str, faiss.Index]] = None) -> bool:
+        """
+        构建manifest对应的快照并发布
+
+        新快照在调用线程中持有写锁构建，构建期间搜索继续使用当前快照
+
+        Args:
+            manifest: 目标manifest
+            loaded: 本进程刚写入、无需从文件读取的段
+
+        Returns:
+            bool: 是否发布了新快照，manifest不比当前快照新时不发布
+        """
+        with self._write_lock:
+            previous = self.snapshot
+            snapshot = IndexSnapshot.load(
+                self.segment_store, manifest, previous=previous, loaded=loaded, read_index=self._read_index
+            )
+            return self._publish_snapshot(snapshot)
+
+    def _publish_snapshot(self, snapshot: IndexSnapshot) -> bool:
+        """
+        用一次引用替换发布快照
+
+        同一份索引的快照按代数单调发布，较晚完成加载的旧快照不会覆盖较新的快照；
+        索引被清空重建后（index_id变化）代数重新计数，直接发布
+
+        Returns:
+            bool: 是否发布
+        """
+        with self._snapshot_lock:
+            current = self.snapshot
+            same_index = snapshot.manifest.get("index_id") == current.manifest.get("index_id")
+            if same_index and snapshot.generation < current.generation:
+                logger.debug(f"跳过过期的索引快照: 代数{snapshot.generation} < {current.generation}")
+                return False
+
+            if not same_index:
+                # 已缓存的用户分区按代数判断是否过期，重建后代数不再可比
+                self.owner_partitions.clear()
+
+            self.snapshot = snapshot
             return True
+
+    def _sync_lexical_index(self) -> None:
+        """
+        让词法索引跟随当前发布的快照：加载新段中文档块的词频，移除新增墓碑和被合并掉的段中不再存在的文档块
+
+        在写锁外执行，写入和搜索不等待词法索引同步；同步期间词法搜索仍按当前快照的墓碑过滤结果。
+        新段的词频优先读取段文件旁边保存的词频数据，没有词频数据的文档块（旧版本写入的段）再从数据库读取文本
+        """
+        if self.lexical_index is None:
+            return
+
+        with self._lexical_lock:
+            previous, snapshot = self._lexical_snapshot, self.snapshot
+            if snapshot is previous:
+                return
+
+            try:
+                self._apply_lexical_changes(previous, snapshot)
+            except Exception as e:
+                # 同步失败只影响词法检索的召回，不影响向量检索
+                logger.exception(f"同步词法索引失败: {str(e)}")
+            self._lexical_snapshot = snapshot
+
+    def _apply_lexical_changes(self, previous: IndexSnapshot, snapshot: IndexSnapshot) -> None:
+        """
+        把两个快照之间的变化应用到词法索引，调用方需持有_lexical_lock
+
+        Args:
+            previous: 词法索引已同步到的快照
+            snapshot: 目标快照
+        """
+        same_index = previous.manifest.get("index_id") == snapshot.manifest.get("index_id")
+        if not same_index:
+            self.lexical_index.clear()
+
+        # 墓碑文件只追加，同一个文件只需处理新追加的ID
+        tombstone_ids = np.empty(0, dtype=np.int64)
+        current, old = snapshot.manifest.get("tombstones"), previous.manifest.get("tombstones")
+        if current and current != old:
+            tombstone_ids = self.segment_store.read_tombstones(snapshot.manifest)
+            if same_index and old and old["name"] == current["name"]:
+                tombstone_ids = tombstone_ids[old["count"] :]
+            self.lexical_index.remove(tombstone_ids.tolist())
+
+        known_segments = {name for name, _ in previous.segments} if same_index else set()
+        current_segments = {name for name, _ in snapshot.segments}
+        new_segments = [(name, index) for name, index in snapshot.segments if name not in known_segments]
+        new_ids = [FaissIndexFactory.get_ids(index) for _, index in new_segments]
+        new_ids = np.concatenate(new_ids) if new_ids else np.empty(0, dtype=np.int64)
+
+        # 被合并掉的段中、合并结果里已不存在的文档块（合并时物理删除的墓碑）
+        removed_ids = [
+            FaissIndexFactory.get_ids(index) for name, index in previous.segments if name not in current_segments
+        ]
+        removed = 0
+        if same_index and removed_ids:
+            removed_ids = np.concatenate(removed_ids)
+            removed = self.lexical_index.remove(removed_ids[~np.isin(removed_ids, new_ids)].tolist())
+
+        if not len(new_ids):
+            if len(tombstone_ids) or removed:
+                logger.debug(f"词法索引已同步: 删除{len(tombstone_ids) + removed}个，当前{len(self.lexical_index)}个")
+            return
+
+        # 合并得到的段中大多是已加载的文档块，只处理缺少的部分
+        live_ids = new_ids[~snapshot.tombstones.contains(new_ids)]
+        missing = set(self.lexical_index.missing(live_ids.tolist()))
+        added = 0
+        for name, _ in new_segments:
+            if not missing:
+                break
+            terms = self.segment_store.read_terms(name)
+            if terms is not None:
+                segment_added, covered = self.lexical_index.add_encoded(terms)
+                added += segment_added
+                missing.difference_update(covered.tolist())
+
+        # 没有词频数据的文档块从数据库读取文本
+        missing = sorted(missing)
+        loaded_from_db = 0
+        batch_size = 1000
+        for i in range(0, len(missing), batch_size):
+            rows = list(DocumentChunk.objects.filter(id__in=missing[i : i + batch_size]).values_list("id", "content"))
+            loaded_from_db += self.lexical_index.add([row[0] for row in rows], [row[1] for row in rows])
+        added += loaded_from_db
+
+        # 新段的词频数据中可能包含已被墓碑删除的文档块
+        dead = new_ids[snapshot.tombstones.contains(new_ids)]
+        if len(dead):
+            self.lexical_index.remove(dead.tolist())
+
+        logger.debug(
+            f"词法索引已同步: 新增{added}个文档块（其中{loaded_from_db}个从数据库读取），"
+            f"删除{len(tombstone_ids) + removed}个，当前{len(self.lexical_index)}个"
+        )
+
+    def _read_index(self, path: str) -> faiss.Index:
+        """
+        读取索引文件，启用内存映射时以只读方式映射文件而不是复制到进程堆内存
+
+        段文件写入后不再修改，合并时先复制索引再写入，因此内存映射的段不会被修改。
+        IO_FLAG_MMAP只映射IVF的倒排表，IndexFlat、SQ、PQ和HNSW的向量编码仍会复制到堆内存，
+        IO_FLAG_MMAP_IFC对这些索引（包括IndexIDMap包装的内层索引）同样直接引用映射的文件内容
+
+        Args:
+            path: 索引文件路径
+
+        Returns:
+            索引对象
+        """
+        if self.use_mmap:
+            try:
+                return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
+            except Exception as e:
+                logger.warning(f"以内存映射方式加载索引失败，改为完整读取: {str(e)}")
+        return faiss.read_index(path)
+
+    def _adopt_legacy_index(self) -> None:
+        """把旧版本的单文件索引登记为分段存储的基础段，必要时先迁移为IndexIDMap"""
+        try:
+            index = self._read_index(self.legacy_index_file)
+            if not isinstance(index, faiss.IndexIDMap):
+                # 旧格式索引以位置作为向量ID，需要借助pickle映射迁移；迁移会修改索引，不能使用内存映射
+                index = self._migrate_legacy_index(faiss.read_index(self.legacy_index_file))
+            self.segment_store.adopt_base(os.path.basename(self.legacy_index_file), index.ntotal)
+            logger.info(f"已将单文件索引登记为基础段，包含{index.ntotal}个向量")
         except Exception as e:
-            logger.error(f"加载索引失败: {str(e)}")
-            return False
+            logger.error(f"登记旧版本索引失败: {str(e)}")
+
+    def _migrate_legacy_index(self, legacy_index: faiss.Index) -> faiss.Index:
+        """
+        把以位置为向量ID的旧索引和chunk_mapping.pkl迁移为以文档块ID为向量ID的IndexIDMap
+
+        原始向量存储中有的向量直接使用原始向量，其余向量从旧索引中重建；
+        迁移完成后保存新索引、按文档块ID重写原始向量存储并删除pickle映射文件
+
+        Args:
+            legacy_index: 旧格式的索引
+
+        Returns:
+            迁移后的索引
+
+        Raises:
+            FileNotFoundError: 缺少旧的映射文件时抛出
+        """
+        if not os.path.exists(self.legacy_mapping_file):
+            raise FileNotFoundError(f"旧格式索引缺少映射文件: {self.legacy_mapping_file}")
+
+        start_time = time.time()
+        with open(self.legacy_mapping_file, "rb") as f:
+            chunk_mapping = pickle.load(f)
+
+        positions = np.array([pos for pos in sorted(chunk_mapping) if pos < legacy_index.ntotal], dtype=np.int64)
+        chunk_ids = np.array([chunk_mapping[pos] for pos in positions], dtype=np.int64)
+        del chunk_mapping
+
+        inner = FaissIndexFactory.unwrap(legacy_index)
+        if isinstance(inner, faiss.IndexIVF):
+            inner.make_direct_map()
+        vectors = inner.reconstruct_batch(positions) if len(positions) else np.empty((0, legacy_index.d), "float32")
+
+        if self.raw_vector_store is not None:
+            raw_vectors, found = self.raw_vector_store.get(positions)
+            vectors[found] = raw_vectors[found]
+            self.raw_vector_store.clear()
+            self.raw_vector_store.append(chunk_ids, vectors)
+
+        index_type = FaissIndexFactory.get_index_type(legacy_index)
+        try:
+            index = FaissIndexFactory.build(index_type, vectors, ids=chunk_ids, **self.index_options)
+        except ValueError as e:
+            # 剩余向量不足以训练原来的近似索引时退回精确索引
+            logger.warning(f"无法按{index_type}重建索引，改用精确索引: {str(e)}")
+            index = FaissIndexFactory.build(FaissIndexFactory.FLAT, vectors, ids=chunk_ids)
+
+        self._atomic_write(self.legacy_index_file, lambda path: faiss.write_index(index, path))
+        os.remove(self.legacy_mapping_file)
+
+        # 向量ID与文档块ID一致
+        DocumentChunk.objects.filter(id__in=chunk_ids.tolist()).update(vector_id=Cast("id", CharField()))
+
+        logger.info(
+            f"已将旧格式索引迁移为IndexIDMap，包含{index.ntotal}个向量，耗时: {time.time() - start_time:.2f}秒"
+        )
+        return index
+
+    @staticmethod
+    def _atomic_write(path: str, write_func) -> None:
+        """
+        先写入临时文件再原子替换目标文件
+
+        其他进程对旧文件的内存映射在替换后依然有效，不会读到写了一半的文件
+
+        Args:
+            path: 目标文件路径
+            write_func: 接收临时文件路径并完成写入的函数
+        """
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        try:
+            write_func(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
     def _init_index(self) -> None:
         """初始化FAISS索引，使用Redis更新标记来检测文件变化"""
@@ -250,40 +713,222 @@ class VectorDBService:
         if self._check_index_updated_in_redis():
             logger.info("检测到其他进程更新了索引文件，将重新加载")
 
-        # 2. 尝试从文件加载
-        if os.path.exists(self.index_file) and os.path.exists(self.mapping_file):
-            # 使用共享方法加载索引
-            if self._load_index_from_file():
+        # 2. 旧版本的单文件索引登记为基础段
+        if not self.segment_store.exists() and os.path.exists(self.legacy_index_file):
+            self._adopt_legacy_index()
+
+        # 3. 按manifest加载索引段
+        if self.segment_store.exists():
+            if self._load_segments():
                 logger.info("从文件成功加载索引")
             else:
-                # 加载失败，创建新索引
-                logger.error("加载索引失败，将创建新索引")
-                self._create_new_index()
+                logger.error("加载索引失败，将使用空索引")
         else:
-            # 3. 创建新索引
-            self._create_new_index()
-
-    def _create_new_index(self) -> None:
-        """创建新的FAISS索引"""
-        # 使用内积索引，效率更高，且内存占用更小
-        # 对于更大规模应用，可以考虑使用HNSW或IVF索引
-        self.index = faiss.IndexFlatIP(self.vector_dim)
-        self.chunk_mapping = {}  # 存储向量ID到文档块ID的映射
-        logger.info("已创建新的FAISS索引")
-
-    def _save_index(self) -> None:
-        """保存索引到文件和更新Redis标记"""
+            # 4. 没有索引时从空索引开始，同时清理上一份索引遗留的原始向量
+            logger.info("未找到索引文件，将使用空索引")
+            if self.raw_vector_store is not None:
+                self.raw_vector_store.clear()
+
+    def _maybe_promote_index(self, index: faiss.Index) -> faiss.Index:
+        """
+        当精确索引的向量数量超过阈值时，重新训练并提升为配置的近似索引
+
+        阈值针对全部向量，分片后按每个分片平均分到的向量数量判断
+
+        Args:
+            index: 合并得到的基础段分片
+
+        Returns:
+            提升后的索引，无需提升或提升失败时返回原索引
+        """
+        threshold = math.ceil(self.index_promote_threshold / self.num_shards)
+        if not FaissIndexFactory.should_promote(index, self.index_type, threshold):
+            return index
+
         try:
-            # 保存到文件
-            faiss.write_index(self.index, self.index_file)
-            with open(self.mapping_file, "wb") as f:
-                pickle.dump(self.chunk_mapping, f)
-            logger.info(f"FAISS索引已保存到文件，包含{self.index.ntotal}个向量")
+            return FaissIndexFactory.promote(index, self.index_type, **self.index_options)
+        except Exception as e:
+            # 提升失败时继续使用精确索引，不影响索引和搜索
+            logger.exception(f"提升FAISS索引为{self.index_type}失败: {str(e)}")
+            return index
+
+    def _new_segment_index(self) -> faiss.Index:
+        """创建空的增量段，增量段规模小，使用精确的内积索引"""
+        return FaissIndexFactory.with_ids(FaissIndexFactory.create_index(FaissIndexFactory.FLAT, self.vector_dim))
+
+    def merge_segments(self) -> bool:
+        """
+        合并索引段，通常由后台Celery任务调用
+
+        增量段数量过多时把增量段合并为一个增量段；增量向量占基础段的比例足够大时，
+        把全部增量段按文档块ID分别并入各基础段分片，此时按配置把分片提升为近似索引。
+        并入基础段时同时物理删除墓碑中的向量。合并期间新写入的增量段和墓碑不受影响，保留在manifest中。
+
+        Returns:
+            bool: 是否进行了合并
+        """
+        with self.segment_store.merge_lock() as acquired:
+            if not acquired:
+                logger.info("其他进程正在合并索引段，跳过本次合并")
+                return False
+
+            if not self._load_segments():
+                return False
+            snapshot = self.snapshot
+            manifest, segments, tombstones = snapshot.manifest, dict(snapshot.segments), snapshot.tombstones
+            tombstone_ids = self.segment_store.read_tombstones(manifest)
 
-            # 更新Redis中的标记
+            plan = VectorSegmentStore.plan_merge(
+                manifest, self.segment_max_deltas, self.segment_merge_ratio, self.num_shards
+            )
+            if plan is None:
+                return False
+
+            start_time = time.time()
+            delta_names = [delta["name"] for delta in manifest["deltas"]]
+            base_names = [base["name"] for base in manifest["base"]]
+            if plan == "major" and len(base_names) == self.num_shards:
+                # 复制基础段分片再写入，正在使用（或内存映射）的基础段保持不变
+                merged_indexes = [
+                    FaissIndexFactory.remove_ids(
+                        self._writable_copy(segments[name]), tombstone_ids, **self.index_options
+                    )
+                    for name in base_names
+                ]
+                source_names = delta_names
+            elif plan == "major":
+                # 分片数变化（包括从不分片升级），把原基础段的向量重新分配到新的分片
+                merged_indexes = [self._new_segment_index() for _ in range(self.num_shards)]
+                source_names = [*base_names, *delta_names]
+            else:
+                merged_indexes = [self._new_segment_index()]
+                source_names = delta_names
+
+            # 已删除的向量不再写入合并结果
+            for name in source_names:
+                ids, vectors = self._segment_vectors(segments[name])
+                live = ~tombstones.contains(ids)
+                ids, vectors = ids[live], vectors[live]
+                shard_of = ids % len(merged_indexes)
+                for shard, merged_index in enumerate(merged_indexes):
+                    selected = shard_of == shard
+                    if selected.any():
+                        merged_index.add_with_ids(vectors[selected], ids[selected])
+
+            if plan == "major":
+                merged_indexes = [self._maybe_promote_index(index) for index in merged_indexes]
+                merged_names = [*base_names, *delta_names]
+            else:
+                merged_names = delta_names
+            terms = self._merge_terms(merged_names, merged_indexes)
+
+            # 合并计算在写锁外完成，只有替换段和发布快照需要与写入互斥
+            with self._write_lock:
+                manifest = self.segment_store.replace_segments(
+                    merged_names,
+                    merged_indexes,
+                    as_base=plan == "major",
+                    applied_tombstones=len(tombstone_ids) if plan == "major" else 0,
+                    terms=terms,
+                )
+                written = manifest["base"] if plan == "major" else manifest["deltas"][: len(merged_indexes)]
+                self._apply_manifest(
+                    manifest, {segment["name"]: index for segment, index in zip(written, merged_indexes)}
+                )
             self._mark_index_updated_in_redis()
+            self._sync_lexical_index()
+
+            # 已物理删除的向量和被覆盖的旧向量不再需要原始向量，压缩原始向量存储避免其无限增长
+            if plan == "major" and self.raw_vector_store is not None:
+                try:
+                    self.raw_vector_store.compact(tombstone_ids)
+                except Exception as e:
+                    logger.exception(f"压缩原始向量存储失败: {str(e)}")
+
+            logger.info(
+                f"索引段合并完成({plan})，合并了{len(merged_names)}个段，"
+                f"分段信息: {VectorSegmentStore.describe(manifest)}，耗时: {time.time() - start_time:.2f}秒"
+            )
+            return True
+
+    def _merge_terms(self, names: List[str], indexes: List[faiss.Index]) -> Optional[List[bytes]]:
+        """
+        由被合并段的词频数据生成合并结果各段的词频数据
+
+        Args:
+            names: 被合并的段文件名
+            indexes: 合并后的索引
+
+        Returns:
+            与indexes一一对应的词频数据；未启用混合检索或被合并的段都没有词频数据时返回None
+        """
+        if self.lexical_index is None:
+            return None
+        parts = [terms for terms in (self.segment_store.read_terms(name) for name in names) if terms is not None]
+        if not parts:
+            return None
+        try:
+            return LexicalIndex.select_encoded(parts, [FaissIndexFactory.get_ids(index) for index in indexes])
+        except Exception as e:
+            # 合并后的段没有词频数据时，加载该段的进程从数据库读取文本
+            logger.exception(f"合并词频数据失败: {str(e)}")
+            return None
+
+    def _writable_copy(self, index: faiss.Index) -> faiss.Index:
+        """
+        复制段用于修改，正在使用的段保持不变
+
+        内存映射加载的段经clone_index复制后仍引用只读的映射内存，修改副本时FAISS会直接崩溃，
+        因此通过序列化得到完整持有数据的副本
+
+        Args:
+            index: 已加载的段
+
+        Returns:
+            可以写入和删除向量的副本
+        """
+        if self.use_mmap:
+            return faiss.deserialize_index(faiss.serialize_index(index))
+        return faiss.clone_index(index)
+
+    def _segment_vectors(self, index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        读取段中的全部向量ID和向量，压缩索引优先使用原始向量
+
+        Args:
+            index: IndexIDMap包装的段
+
+        Returns:
+            (ids, vectors)
+        """
+        ids = FaissIndexFactory.get_ids(index)
+        inner = FaissIndexFactory.unwrap(index)
+        if isinstance(inner, faiss.IndexIVF):
+            # 按位置重建IVF向量需要直接映射，在副本上建立，不修改正在使用的段
+            inner = faiss.clone_index(inner)
+            inner.make_direct_map()
+        vectors = inner.reconstruct_n(0, inner.ntotal) if inner.ntotal else np.empty((0, index.d), "float32")
+
+        if self.raw_vector_store is not None and FaissIndexFactory.is_compressed(index):
+            raw_vectors, found = self.raw_vector_store.get(ids)
+            vectors[found] = raw_vectors[found]
+        return ids, vectors
+
+    def _schedule_merge(self) -> None:
+        """增量段需要合并时提交后台合并任务"""
+        plan = VectorSegmentStore.plan_merge(
+            self.manifest, self.segment_max_deltas, self.segment_merge_ratio, self.num_shards
+        )
+        if plan is None:
+            return
+
+        try:
+            from ..tasks import merge_index_segments_task
+
+            merge_index_segments_task.delay(self.embedding_model_version)
         except Exception as e:
-            logger.error(f"保存索引失败: {str(e)}")
+            # 任务提交失败不影响本次索引，下次写入时会再次尝试
+            logger.warning(f"提交索引段合并任务失败: {str(e)}")
 
     def index_document(self, document: Document) -> bool:
         """将文档索引到向量数据库"""
@@ -300,81 +945,68 @@ class VectorDBService:
                 logger.warning(f"文档{document.id}没有分块，无法索引")
                 return False
 
-            # 获取分块文本向量，分批处理以减少内存使用
-            start_idx = self.index.ntotal
-            batch_size = 10  # 每批处理的块数量，调整此值可以平衡内存使用和处理效率
-            total_vectors = 0
+            # 新向量只写入一个新的增量段，不重写已有的段
+            delta_index = self._new_segment_index()
 
-            # 分批处理文档块
-            for i in range(0, chunks.count(), batch_size):
-                # 获取当前批次的文档块
-                batch_chunks = chunks[i : i + batch_size]
-                vectors = []
-                chunk_ids = []
-
-                # 处理每个文档块
-                for chunk in batch_chunks:
-                    try:
-                        # 获取块文本向量
-                        vector = self.embedding_service.get_embedding(chunk.content)
-                        vectors.append(vector)
-                        chunk_ids.append(chunk.id)
-                    except Exception as e:
-                        logger.error(f"处理文档块{chunk.id}时出错: {str(e)}")
-
-                if not vectors:
-                    continue
+            # 分批获取文档块向量，每批由嵌入服务打包为尽量少的API请求，批次大小限制同时驻留的向量
+            batch_size = self.index_batch_size
+            total_vectors = 0
+            rows = list(chunks.order_by("id").values_list("id", "content"))
+            # 原始向量在增量段提交成功后再追加保存，失败的文档不在原始向量文件中留下向量
+            raw_batches = []
 
-                # 将向量转换为NumPy数组
-                vectors_array = np.array(vectors).astype("float32")
+            for i in range(0, len(rows), batch_size):
+                batch_rows = rows[i : i + batch_size]
+                chunk_ids = [row[0] for row in batch_rows]
+                try:
+                    vectors_array = np.asarray(
+                        self.embedding_service.get_embeddings([row[1] for row in batch_rows]), dtype="float32"
+                    )
+                except Exception as e:
+                    # 任何一批失败时整个文档都不写入索引，由调用方标记为失败，不留下只索引了一部分的文档
+                    logger.error(f"获取文档{document.id}第{i + 1}-{i + len(chunk_ids)}个文档块的向量时出错: {str(e)}")
+                    return False
 
                 # 归一化向量以提高检索质量
                 faiss.normalize_L2(vectors_array)
 
-                # 添加到FAISS索引
-                self.index.add(vectors_array)
-                batch_start_idx = start_idx + total_vectors
-
-                # 更新映射并保存向量ID到数据库
-                for j, chunk_id in enumerate(chunk_ids):
-                    vector_idx = batch_start_idx + j
-                    self.chunk_mapping[vector_idx] = chunk_id
-
-                    # 保存向量ID到数据库
-                    try:
-                        # 检查batch_chunks的类型并相应处理
-                        if hasattr(batch_chunks, "get"):
-                            # 如果是QuerySet，使用get方法
-                            chunk = batch_chunks.get(id=chunk_id)
-                        else:
-                            # 如果是列表或元组，使用循环查找
-                            chunk = None
-                            for c in batch_chunks:
-                                if c.id == chunk_id:
-                                    chunk = c
-                                    break
-
-                        if chunk:
-                            # 更新文档块的向量ID
-                            chunk.vector_id = vector_idx
-                            chunk.save()
-                    except Exception as e:
-                        logger.error(f"保存向量ID到数据库失败: {str(e)}")
-
-                total_vectors += len(vectors)
-
-                # 释放内存
-                del vectors
-                del vectors_array
-
-                # 每处理一批次，进行垃圾回收
-                gc.collect()
-
-                # 回收内存
-                del batch_chunks
-
-            # 保存索引（同时会标记Redis更新）
-            self._save_index()
+                # 以文档块ID作为向量ID添加到增量段
+                ids_array = np.array(chunk_ids, dtype=np.int64)
+                delta_index.add_with_ids(vectors_array, ids_array)
+
+                if self.raw_vector_store is not None:
+                    raw_batches.append((ids_array, vectors_array))
+
+                total_vectors += len(chunk_ids)
+
+            if delta_index.ntotal == 0:
+                logger.error(f"文档{document.id}没有成功生成向量的分块")
+                return False
+
+            # 提交前保存向量ID到数据库，向量ID即文档块ID；用户分区按向量ID选取文档块，
+            # 先提交时新段生效后的第一次分区构建会漏掉这些文档块，并在该代数内一直缓存
+            try:
+                chunks.update(vector_id=Cast("id", CharField()))
+            except Exception as e:
+                logger.error(f"保存文档{document.id}的向量ID到数据库失败: {str(e)}")
+                return False
+
+            # 写入增量段并更新manifest，其他进程收到通知后只需加载这个新段
+            try:
+                self.commit_delta(delta_index, self._encode_terms([row[0] for row in rows], [row[1] for row in rows]))
+            except Exception:
+                chunks.update(vector_id=None)
+                raise
+
+            # 原始向量追加保存到磁盘，用于压缩索引的精确重排
+            if raw_batches:
+                self._append_raw_vectors(
+                    np.concatenate([ids for ids, _ in raw_batches]),
+                    np.concatenate([vectors for _, vectors in raw_batches]),
+                )
+
+            # 增量段过多时由后台任务合并
+            self._schedule_merge()
 
             # 清除查询缓存，因为新的文档可能会影响搜索结果
             self.clear_search_cache()
@@ -386,78 +1018,700 @@ class VectorDBService:
             logger.exception(f"索引文档{document.id}失败: {str(e)}")
             return False
 
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """根据查询文本搜索相关文档块"""
+    def index_chunks(self, chunk_ids: List[int], texts: List[str]) -> int:
+        """
+        向量化一批文档块并作为一个增量段提交，用于迁移等已有文档块的批量索引
+
+        Args:
+            chunk_ids: 文档块ID
+            texts: 与chunk_ids顺序一致的文档块文本
+
+        Returns:
+            int: 提交的向量数量
+        """
+        if not chunk_ids:
+            return 0
+
+        vectors = np.asarray(self.embedding_service.get_embeddings(list(texts)), dtype="float32")
+        faiss.normalize_L2(vectors)
+        ids = np.asarray(chunk_ids, dtype=np.int64)
+
+        delta_index = self._new_segment_index()
+        delta_index.add_with_ids(vectors, ids)
+
+        # 与index_document相同，提交前保存向量ID，新段生效时用户分区即可选取这些文档块
+        DocumentChunk.objects.filter(id__in=chunk_ids, vector_id__isnull=True).update(vector_id=Cast("id", CharField()))
+        self.commit_delta(delta_index, self._encode_terms(list(chunk_ids), list(texts)))
+        self._append_raw_vectors(ids, vectors)
+        self._schedule_merge()
+        return len(ids)
+
+    def _append_raw_vectors(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """
+        增量段提交后追加保存原始向量，未启用原始向量存储时跳过
+
+        保存失败时只记录错误：向量已在索引中，缺少原始向量的文档块在精确重排和用户分区精确搜索时按索引结果处理
+
+        Args:
+            ids: 向量ID
+            vectors: 归一化后的向量
+        """
+        if self.raw_vector_store is None:
+            return
         try:
+            self.raw_vector_store.append(ids, vectors)
+        except Exception as e:
+            logger.error(f"保存{len(ids)}个原始向量失败: {str(e)}")
+
+    def indexed_ids(self) -> np.ndarray:
+        """
+        当前快照中未删除的向量ID（即文档块ID）
+
+        Returns:
+            排序后的向量ID数组
+        """
+        snapshot = self.snapshot
+        if not snapshot.segments:
+            return np.empty(0, dtype=np.int64)
+        ids = np.unique(np.concatenate([FaissIndexFactory.get_ids(index) for _, index in snapshot.segments]))
+        return ids[~snapshot.tombstones.contains(ids)]
+
+    def commit_delta(self, delta_index: faiss.Index, terms: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        提交暂存好的增量段：写入段文件、更新manifest并发布新快照
+
+        多个线程可以同时向量化文档并构建各自的增量段，提交在写锁内依次进行
+
+        Args:
+            delta_index: 只包含新增向量的索引
+            terms: 段中文档块的词频数据（LexicalIndex.encode），与段文件一起保存
+
+        Returns:
+            更新后的manifest
+        """
+        with self._write_lock:
+            manifest = self.segment_store.add_delta(delta_index, terms)
+            self._apply_manifest(manifest, {manifest["deltas"][-1]["name"]: delta_index})
+        self._mark_index_updated_in_redis()
+        self._sync_lexical_index()
+        return manifest
+
+    def _encode_terms(self, chunk_ids: List[int], texts: List[str]) -> Optional[bytes]:
+        """切分文档块文本，得到随增量段保存的词频数据，未启用混合检索时返回None"""
+        if self.lexical_index is None:
+            return None
+        return LexicalIndex.encode(chunk_ids, texts)
+
+    def delete_vectors(self, chunk_ids: List[int]) -> int:
+        """
+        删除文档块的向量
+
+        向量ID写入墓碑文件后立即从搜索结果中消失，合并进基础段时再从索引中物理删除
+
+        Args:
+            chunk_ids: 文档块ID列表
+
+        Returns:
+            int: 标记删除的向量数量
+        """
+        ids = np.unique(np.asarray(chunk_ids, dtype=np.int64))
+        with self._write_lock:
+            # 在写锁内检查，并发删除同一批向量时不会重复写入墓碑
+            ids = ids[~self.tombstones.contains(ids)]
+            if len(ids) == 0:
+                return 0
+
+            manifest = self.segment_store.add_tombstones(ids)
+            self._apply_manifest(manifest)
+        self._mark_index_updated_in_redis()
+        self._sync_lexical_index()
+
+        # 墓碑较多时由后台任务合并并物理删除
+        self._schedule_merge()
+
+        logger.info(f"已标记删除{len(ids)}个向量，当前墓碑数量: {len(self.tombstones)}")
+        return len(ids)
+
+    @staticmethod
+    def delete_document_vectors(document_id: int) -> int:
+        """
+        删除文档全部文档块的向量，按文档块的嵌入模型版本删除对应索引中的向量
+
+        Args:
+            document_id: 文档ID
+
+        Returns:
+            int: 标记删除的向量数量
+        """
+        chunk_ids_by_version = {}
+        chunks = DocumentChunk.objects.filter(document_id=document_id).values_list("id", "embedding_model_version")
+        for chunk_id, model_version in chunks:
+            chunk_ids_by_version.setdefault(model_version or settings.EMBEDDING_MODEL_VERSION, []).append(chunk_id)
+
+        # 迁移后的检索版本中同样有这些文档块的向量，即使文档块仍记录为迁移前的版本
+        active_version = get_active_model_version()
+        if chunk_ids_by_version and active_version not in chunk_ids_by_version:
+            chunk_ids_by_version[active_version] = [
+                chunk_id for chunk_ids in chunk_ids_by_version.values() for chunk_id in chunk_ids
+            ]
+
+        deleted = 0
+        for model_version, chunk_ids in chunk_ids_by_version.items():
+            instance = VectorDBService.get_instance(embedding_model_version=model_version)
+            deleted += instance.delete_vectors(chunk_ids)
+        return deleted
+
+    def filter_deleted(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        从检索结果（通常来自缓存）中去掉已删除的文档块
+
+        Args:
+            results: 检索结果列表
+
+        Returns:
+            未删除的检索结果，顺序不变
+        """
+        if not results or not len(self.tombstones):
+            return results
+
+        deleted = self.tombstones.contains(np.array([result["chunk_id"] for result in results], dtype=np.int64))
+        return [result for result, is_deleted in zip(results, deleted) if not is_deleted]
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        owner_id: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        根据查询文本搜索相关文档块
+
+        Args:
+            query: 查询文本
+            top_k: 返回结果数量
+            nprobe: IVF索引本次搜索的聚类数量，未指定时使用索引默认值
+            ef_search: HNSW索引本次搜索的候选队列长度，未指定时使用索引默认值
+            owner_id: 只在该用户的文档中搜索，未指定时搜索全部文档
+
+        Returns:
+            检索结果列表
+        """
+        return self.search_many([query], top_k, nprobe=nprobe, ef_search=ef_search, owner_id=owner_id)[0]
+
+    def search_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        owner_id: Optional[int] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量搜索多个查询
+
+        一次批量获取全部查询的向量，以(nq, dim)矩阵做一次FAISS搜索，再一次加载全部命中的文档块和文档
+
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回的结果数量
+            nprobe: IVF索引本次搜索的聚类数量，未指定时使用索引默认值
+            ef_search: HNSW索引本次搜索的候选队列长度，未指定时使用索引默认值
+            owner_id: 只在该用户的文档中搜索，未指定时搜索全部文档
+
+        Returns:
+            与queries顺序一致的检索结果列表
+        """
+        if not queries:
+            return []
+
+        try:
+            # 读取一次快照，搜索期间其他线程发布新快照不影响本次搜索
+            snapshot = self.snapshot
+            segments, tombstones, manifest = snapshot.segments, snapshot.tombstones, snapshot.manifest
+            ntotal = snapshot.ntotal
+
             # 检查索引是否为空
-            if self.index.ntotal == 0:
+            if ntotal == 0:
                 logger.warning("向量索引为空，无法进行搜索")
-                return []
+                return [[] for _ in queries]
+
+            partition = None
+            if owner_id is not None:
+                partition = self._get_owner_partition(owner_id, manifest, tombstones)
+                if not len(partition):
+                    return [[] for _ in queries]
+                # 分区中的ID已排除墓碑，候选数量以该用户的文档块数量为上限
+                ntotal = min(ntotal, len(partition))
+
+            # 批量将查询文本转换为向量并归一化，查询按交互请求的优先级使用嵌入API的全局配额
+            query_vectors = np.ascontiguousarray(
+                self.embedding_service.get_embeddings(queries, priority=GlobalTokenBucket.PRIORITY_INTERACTIVE),
+                dtype="float32",
+            )
+            faiss.normalize_L2(query_vectors)
+
+            # 与最近的相似查询（同一用户和搜索参数）命中语义缓存的查询不再搜索
+            scope = (owner_id, top_k, nprobe, ef_search)
+            generation = (manifest.get("index_id"), snapshot.generation)
+            results = [[] for _ in queries]
+            pending = np.arange(len(queries))
+            if self.query_cache is not None:
+                cached_results = self.query_cache.get_many(query_vectors, scope, generation)
+                for q, query_results in enumerate(cached_results):
+                    if query_results is not None:
+                        results[q] = query_results
+                pending = np.array(
+                    [q for q, query_results in enumerate(cached_results) if query_results is None], dtype=np.int64
+                )
+            searched = pending
+
+            # 已删除的向量在FAISS搜索内部过滤；其他原因（软删除、模型版本不匹配）过滤后不足top_k时，
+            # 只对结果不足的查询按过滤比例扩大候选数量重新搜索
+            k = min(top_k, ntotal)
+            for _ in range(max(self.oversample_rounds, 0) + 1):
+                if not len(pending):
+                    break
+                if partition is None:
+                    distances, indices = self._search_vectors(
+                        segments, tombstones, query_vectors[pending], k, nprobe, ef_search
+                    )
+                elif partition.vectors is not None:
+                    distances, indices = partition.search_exact(query_vectors[pending], k)
+                else:
+                    distances, indices = self._search_vectors(
+                        segments, partition.id_filter, query_vectors[pending], k, nprobe, ef_search
+                    )
 
-            # 将查询文本转换为向量并归一化
-            query_vector = self.embedding_service.get_embedding(query)
-            query_vector = np.array([query_vector]).astype("float32")  # 转换为2D数组
-            faiss.normalize_L2(query_vector)  # 归一化查询向量
+                # 批量加载文档块和文档，保持FAISS返回的排序
+                hits = [
+                    [(int(idx), float(score)) for idx, score in zip(row_indices, row_distances) if idx >= 0]
+                    for row_distances, row_indices in zip(distances, indices)
+                ]
+                for q, query_results in zip(pending, self._hydrate_many(hits)):
+                    results[q] = query_results
+
+                short = np.array([len(results[q]) < top_k for q in pending])
+                if not short.any() or k >= ntotal:
+                    break
+                pending = pending[short]
+                fewest = min(len(results[q]) for q in pending)
+                k = min(ntotal, max(k * 2, math.ceil(k * top_k / max(fewest, 1))))
+                logger.debug(f"{len(pending)}个查询过滤后结果不足，扩大候选数量到{k}重新搜索")
+
+            results = [query_results[:top_k] for query_results in results]
+            if self.query_cache is not None and len(searched):
+                self.query_cache.put_many(query_vectors[searched], scope, generation, [results[q] for q in searched])
+            return results
+        except Exception as e:
+            logger.exception(f"搜索失败: {str(e)}")
+            return [[] for _ in queries]
 
-            # 在向量数据库中检索最相似的向量
-            distances, indices = self.index.search(query_vector, min(top_k, self.index.ntotal))
+    def lexical_search_many(
+        self, queries: List[str], top_k: int = 5, owner_id: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        在词法索引中按BM25分数批量搜索，结果与向量搜索的结果格式相同
 
-            # 获取检索结果
-            results = []
-            version_mismatch_count = 0  # 跟踪模型版本不匹配的块数量
+        score与向量搜索一样为查询向量与文档块原始向量的余弦相似度（缺少原始向量时为0），
+        BM25分数在lexical_score字段中
 
-            for i, idx in enumerate(indices[0]):  # indices是二维数组，取第一个结果
-                if idx < 0:  # faiss在结果不足时会返回-1
-                    continue
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回的结果数量
+            owner_id: 只在该用户的文档中搜索，未指定时搜索全部文档
 
-                chunk_id = self.chunk_mapping.get(int(idx))
-                logger.info(f"chunk_id: {chunk_id}")
-                if chunk_id is None:
-                    continue
+        Returns:
+            与queries顺序一致的检索结果列表，按BM25分数降序，未启用混合检索时为空列表
+        """
+        if self.lexical_index is None or not queries:
+            return [[] for _ in queries]
 
+        try:
+            snapshot = self.snapshot
+            id_filter = snapshot.tombstones
+            if owner_id is not None:
+                partition = self._get_owner_partition(owner_id, snapshot.manifest, snapshot.tombstones)
+                if not len(partition):
+                    return [[] for _ in queries]
+                id_filter = partition.id_filter
+
+            hits = [self.lexical_index.search(query, top_k, id_filter) for query in queries]
+            results = [query_results[:top_k] for query_results in self._hydrate_many(hits)]
+            for query_results in results:
+                for result in query_results:
+                    result["lexical_score"] = result["score"]
+                    result["score"] = 0.0
+            if self.raw_vector_store is not None and any(results):
                 try:
-                    # 不使用select_related，因为document_id是整数字段而非关系字段
-                    chunk = DocumentChunk.objects.get(id=chunk_id)
-
-                    # 检查嵌入模型版本是否匹配
-                    document = Document.objects.get(id=chunk.document_id)
-
-                    # 如果文档已被删除，跳过
-                    if document.is_deleted:
-                        continue
-
-                    # 如果文档使用的嵌入模型与当前不同，记录并跳过
-                    if document.embedding_model_version != self.embedding_model_version:
-                        version_mismatch_count += 1
-                        continue
-
-                    results.append(
-                        {
-                            "id": document.id,
-                            "title": document.title,
-                            "content": chunk.content,
-                            "score": float(distances[0][i]),  # 转换numpy.float32为Python float
-                            "chunk_index": chunk.chunk_index,
-                            "embedding_model_version": document.embedding_model_version,
-                        }
-                    )
-                except (DocumentChunk.DoesNotExist, Document.DoesNotExist):
-                    # 如果文档块或文档不存在，跳过
-                    continue
+                    self._fill_vector_scores(queries, results)
+                except Exception as e:
+                    # 查询向量化失败时仍返回词法检索结果，score保持为0
+                    logger.warning(f"计算词法检索结果的向量相似度失败: {str(e)}")
+            return results
+        except Exception as e:
+            logger.exception(f"词法搜索失败: {str(e)}")
+            return [[] for _ in queries]
+
+    def _fill_vector_scores(self, queries: List[str], results: List[List[Dict[str, Any]]]) -> None:
+        """
+        用原始向量计算词法检索结果与查询的余弦相似度，写入各结果的score
 
-            if version_mismatch_count > 0:
-                logger.warning(f"跳过了{version_mismatch_count}个模型版本不匹配的文档块")
+        Args:
+            queries: 查询文本列表
+            results: 与queries顺序一致的检索结果，原地修改
+        """
+        query_vectors = np.ascontiguousarray(
+            self.embedding_service.get_embeddings(queries, priority=GlobalTokenBucket.PRIORITY_INTERACTIVE),
+            dtype="float32",
+        )
+        faiss.normalize_L2(query_vectors)
+
+        chunk_ids = np.fromiter((result["chunk_id"] for rows in results for result in rows), dtype=np.int64)
+        chunk_vectors, found = self.raw_vector_store.get(chunk_ids)
+        owners = np.repeat(np.arange(len(results)), [len(rows) for rows in results])
+        scores = np.einsum("ij,ij->i", chunk_vectors, query_vectors[owners])
+
+        position = 0
+        for rows in results:
+            for result in rows:
+                if found[position]:
+                    result["score"] = float(scores[position])
+                position += 1
+
+    def diversify(
+        self, results: List[Dict[str, Any]], top_k: int, mmr_lambda: float = 0.7, merge_adjacent: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        去掉检索结果中的冗余内容：合并同一文档的相邻文档块，再按最大边际相关性(MMR)选择结果
+
+        MMR使用原始向量存储中的文档块向量，合并的结果使用其各文档块向量的平均值；
+        缺少原始向量时只按相关性选择。合并的结果按其包含的文档块数计入top_k，送入LLM的上下文不会因合并而变长
 
-            # 按相似度分数排序
-            results = sorted(results, key=lambda x: x["score"], reverse=True)
+        Args:
+            results: 按相关性降序的检索结果（候选数量通常多于top_k）
+            top_k: 最多返回的文档块数量
+            mmr_lambda: MMR中相关性的权重，1表示只按相关性选择
+            merge_adjacent: 是否合并相邻文档块
+
+        Returns:
+            去冗余后的检索结果，合并的结果带有chunk_ids字段
+        """
+        if not results:
             return results
-        except Exception as e:
-            logger.exception(f"搜索失败: {str(e)}")
-            return []
 
-    @cached(prefix="vector_search", timeout=60 * 60)  # 缓存1小时
+        candidates = merge_adjacent_chunks(results, top_k) if merge_adjacent else [dict(result) for result in results]
+        member_ids = [result.get("chunk_ids", [result["chunk_id"]]) for result in candidates]
+        costs = np.array([len(ids) for ids in member_ids], dtype=np.int64)
+        relevance = np.array([ranking_score(result) for result in candidates], dtype=np.float32)
+
+        vectors = np.zeros((len(candidates), self.vector_dim), dtype=np.float32)
+        if mmr_lambda < 1 and self.raw_vector_store is not None and len(candidates) > 1:
+            chunk_ids = np.fromiter((chunk_id for ids in member_ids for chunk_id in ids), dtype=np.int64)
+            chunk_vectors, found = self.raw_vector_store.get(chunk_ids)
+            if found.all():
+                # 合并结果的向量为各文档块向量的平均值，再归一化
+                owners = np.repeat(np.arange(len(candidates)), costs)
+                np.add.at(vectors, owners, chunk_vectors)
+                faiss.normalize_L2(vectors)
+            else:
+                logger.debug(f"{int((~found).sum())}个文档块缺少原始向量，只按相关性选择")
+                mmr_lambda = 1.0
+        else:
+            mmr_lambda = 1.0
+
+        selected = mmr_select(relevance, vectors, top_k, mmr_lambda, costs)
+        return [candidates[i] for i in selected]
+
+    def _get_owner_partition(
+        self, owner_id: int, manifest: Dict[str, Any], tombstones: TombstoneFilter
+    ) -> OwnerPartition:
+        """
+        获取用户在当前manifest下的分区，manifest代数变化后重新构建
+
+        Args:
+            owner_id: 用户ID
+            manifest: 本次搜索使用的manifest
+            tombstones: 本次搜索使用的墓碑
+
+        Returns:
+            用户分区
+        """
+        generation = manifest.get("generation", 0)
+        cached = self.owner_partitions.get(owner_id)
+        if cached is not None and cached.generation == generation:
+            return cached
+
+        # 只取已写入索引的文档块；软删除的文档由默认管理器过滤。
+        # 迁移切换后、文档的模型版本字段更新完成前，文档仍标记为迁移前版本
+        chunk_ids = np.fromiter(
+            DocumentChunk.objects.filter(
+                document_id__in=Document.objects.filter(
+                    owner_id=owner_id, embedding_model_version__in=self._accepted_document_versions()
+                ).values("id"),
+                vector_id__isnull=False,
+            ).values_list("id", flat=True),
+            dtype=np.int64,
+        )
+        chunk_ids = np.sort(chunk_ids[~tombstones.contains(chunk_ids)])
+
+        vectors = None
+        if cached is not None and np.array_equal(cached.chunk_ids, chunk_ids):
+            # 该用户的文档块没有变化，复用已加载的向量
+            vectors = cached.vectors
+        elif self.raw_vector_store is not None and 0 < len(chunk_ids) <= self.owner_exact_search_max_chunks:
+            vectors, found = self.raw_vector_store.get(chunk_ids)
+            if not found.all():
+                # 原始向量不完整（例如其他进程刚写入、尚未刷新），本次使用索引搜索
+                vectors = None
+
+        partition = OwnerPartition(owner_id, generation, chunk_ids, vectors)
+        self.owner_partitions.put(partition)
+        logger.debug(
+            f"已构建用户{owner_id}的检索分区: {len(partition)}个文档块，"
+            f"{'精确搜索' if vectors is not None else '索引过滤'}"
+        )
+        return partition
+
+    def _search_vectors(
+        self,
+        segments: List[Tuple[str, faiss.Index]],
+        id_filter: IdBitmap,
+        query_vectors: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        搜索前k个通过ID过滤的向量，压缩索引的结果使用原始向量精确重排
+
+        Args:
+            segments: (段文件名, 索引)列表
+            id_filter: 搜索时的ID过滤（排除墓碑，或只保留某个用户的文档块）
+            query_vectors: 归一化后的查询向量，形状(nq, dim)
+            k: 返回结果数量
+            nprobe: IVF索引本次搜索的聚类数量
+            ef_search: HNSW索引本次搜索的候选队列长度
+
+        Returns:
+            (distances, indices): 形状均为(nq, k)，按分数降序，不足k个时ID为-1
+        """
+        ntotal = sum(index.ntotal for _, index in segments)
+        rerank = self._should_rerank(segments)
+        fetch_k = min(k * self.rerank_factor, ntotal) if rerank else k
+
+        distances, indices = self._search_segments(segments, id_filter, query_vectors, fetch_k, nprobe, ef_search)
+
+        # 压缩索引的分数是近似值，用磁盘上的原始向量重新计算并截取前k个
+        if rerank:
+            distances, indices = self._rerank_exact(query_vectors, distances, indices, k)
+        return distances, indices
+
+    def _search_segments(
+        self,
+        segments: List[Tuple[str, faiss.Index]],
+        id_filter: IdBitmap,
+        query_vectors: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在线程池中并行搜索每个段（基础段分片和增量段），再用堆合并为全局的前k个结果
+
+        Args:
+            segments: (段文件名, 索引)列表
+            id_filter: 搜索时的ID过滤，通过IDSelector在搜索内部过滤
+            query_vectors: 归一化后的查询向量，形状(nq, dim)
+            k: 返回结果数量
+            nprobe: IVF索引本次搜索的聚类数量
+            ef_search: HNSW索引本次搜索的候选队列长度
+
+        Returns:
+            (distances, indices): 形状均为(nq, k)，按分数降序，不足k个时ID为-1
+        """
+
+        def search_segment(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+            params = FaissIndexFactory.build_search_params(
+                index, nprobe=nprobe, ef_search=ef_search, selector=id_filter.selector
+            )
+            distances, indices = index.search(query_vectors, min(k, index.ntotal), params=params)
+
+            # 不支持IDSelector的索引（IndexPQ）在搜索后过滤
+            if id_filter.selector is not None and not FaissIndexFactory.supports_selector(index):
+                rejected = id_filter.rejects(indices)
+                indices[rejected] = -1
+                distances[rejected] = -np.inf
+            return distances, indices
+
+        indexes = [index for _, index in segments if index.ntotal > 0]
+        return ShardSearcher.merge_top_k(self.shard_searcher.map(search_segment, indexes), k)
+
+    def _should_rerank(self, segments: List[Tuple[str, faiss.Index]]) -> bool:
+        """是否对搜索结果做精确重排，任一段为压缩索引时重排"""
+        return (
+            self.rerank_factor > 1
+            and self.raw_vector_store is not None
+            and any(FaissIndexFactory.is_compressed(index) for _, index in segments)
+        )
+
+    def _rerank_exact(
+        self, query_vectors: np.ndarray, distances: np.ndarray, indices: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        使用原始向量对压缩索引返回的候选结果精确重排
+
+        Args:
+            query_vectors: 归一化后的查询向量，形状(nq, dim)
+            distances: 近似分数，形状(nq, fetch_k)
+            indices: 候选向量ID，形状(nq, fetch_k)
+            k: 重排后保留的结果数量
+
+        Returns:
+            (distances, indices): 形状均为(nq, k)，按精确分数降序
+        """
+        out_distances = np.full((len(query_vectors), k), -np.inf, dtype=np.float32)
+        out_indices = np.full((len(query_vectors), k), -1, dtype=np.int64)
+
+        for q in range(len(query_vectors)):
+            valid = indices[q] >= 0
+            candidate_ids = indices[q][valid]
+            vectors, found = self.raw_vector_store.get(candidate_ids)
+
+            # 缺少原始向量的候选保留近似分数
+            scores = np.where(found, vectors @ query_vectors[q], distances[q][valid])
+            order = np.argsort(-scores, kind="stable")[:k]
+
+            out_distances[q, : len(order)] = scores[order]
+            out_indices[q, : len(order)] = candidate_ids[order]
+
+        return out_distances, out_indices
+
+    def _hydrate_results(self, hits: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+        """
+        将单个查询的FAISS命中结果批量转换为检索结果
+
+        Args:
+            hits: (文档块ID, 相似度分数)列表，按FAISS返回的排序
+
+        Returns:
+            检索结果列表，顺序与hits一致
+        """
+        return self._hydrate_many([hits])[0]
+
+    def _hydrate_many(self, hits_per_query: List[List[Tuple[int, float]]]) -> List[List[Dict[str, Any]]]:
+        """
+        将多个查询的FAISS命中结果批量转换为检索结果
+
+        一次查询加载所有文档块，一次查询加载其所属文档，避免逐条查询数据库。
+        已删除的文档和使用其他嵌入模型版本的文档会被过滤掉。
+
+        Args:
+            hits_per_query: 每个查询的(文档块ID, 相似度分数)列表，按FAISS返回的排序
+
+        Returns:
+            每个查询的检索结果列表，顺序与hits一致
+        """
+        chunk_ids = {chunk_id for hits in hits_per_query for chunk_id, _ in hits}
+        if not chunk_ids:
+            return [[] for _ in hits_per_query]
+
+        # 不使用select_related，因为document_id是整数字段而非关系字段
+        chunks = DocumentChunk.objects.in_bulk(list(chunk_ids))
+        document_ids = {chunk.document_id for chunk in chunks.values()}
+        # 默认管理器已过滤掉软删除的文档
+        documents = Document.objects.in_bulk(document_ids)
+
+        version_mismatch_count = 0  # 跟踪模型版本不匹配的块数量
+        all_results = []
+        for hits in hits_per_query:
+            results, mismatched = self._build_results(hits, chunks, documents)
+            version_mismatch_count += mismatched
+            all_results.append(results)
+
+        if version_mismatch_count > 0:
+            logger.warning(f"跳过了{version_mismatch_count}个模型版本不匹配的文档块")
+
+        return all_results
+
+    def _build_results(
+        self, hits: List[Tuple[int, float]], chunks: Dict[int, DocumentChunk], documents: Dict[int, Document]
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        用已加载的文档块和文档组装一个查询的检索结果
+
+        Returns:
+            (检索结果列表, 模型版本不匹配的块数量)
+        """
+        results = []
+        version_mismatch_count = 0
+        accepted_versions = self._accepted_document_versions()
+
+        for chunk_id, score in hits:
+            chunk = chunks.get(chunk_id)
+            if chunk is None:
+                continue
+
+            document = documents.get(chunk.document_id)
+            if document is None:
+                continue
+
+            # 如果文档使用的嵌入模型与当前不同，记录并跳过
+            if document.embedding_model_version not in accepted_versions:
+                version_mismatch_count += 1
+                continue
+
+            results.append(
+                {
+                    "id": document.id,
+                    "title": document.title,
+                    "content": chunk.content,
+                    "score": score,
+                    "chunk_id": chunk.id,
+                    "chunk_index": chunk.chunk_index,
+                    "embedding_model_version": document.embedding_model_version,
+                }
+            )
+
+        return results, version_mismatch_count
+
+    def _accepted_document_versions(self) -> set:
+        """
+        检索结果可以包含的文档模型版本
+
+        迁移切换后、文档的模型版本字段更新完成前，新版本的索引已包含这些文档的向量，
+        因此当前检索版本同时接受迁移前版本的文档
+        """
+        accepted = {self.embedding_model_version}
+        active = get_active_model()
+        if active["embedding_model_version"] == self.embedding_model_version and active.get("previous_version"):
+            accepted.add(active["previous_version"])
+        return accepted
+
     @staticmethod
-    def search_static(query: str, top_k: int = 5, embedding_model_version=None) -> List[Dict[str, Any]]:
+    def _is_cached_search_valid(
+        results: List[Dict[str, Any]], query: str, top_k: int = 5, embedding_model_version=None, **kwargs
+    ) -> bool:
+        """缓存的检索结果中不包含已删除的文档块时有效"""
+        if not results:
+            return True
+        instance = VectorDBService.get_instance(embedding_model_version=embedding_model_version)
+        return len(instance.filter_deleted(results)) == len(results)
+
+    # 删除文档不再清空全部搜索缓存，命中的缓存结果包含已删除的文档块时重新搜索
+    @cached(
+        prefix="vector_search", timeout=60 * 60, validator=_is_cached_search_valid, namespace=SEARCH_CACHE_NAMESPACE
+    )  # 缓存1小时
+    @staticmethod
+    def search_static(
+        query: str,
+        top_k: int = 5,
+        embedding_model_version=None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        owner_id: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
         """
         静态方法版本的搜索，方便缓存和共享
 
@@ -465,24 +1719,55 @@ class VectorDBService:
             query: 查询文本
             top_k: 返回结果数量
             embedding_model_version: 嵌入模型版本
+            nprobe: IVF索引本次搜索的聚类数量
+            ef_search: HNSW索引本次搜索的候选队列长度
+            owner_id: 只在该用户的文档中搜索
 
         Returns:
             检索结果列表
         """
         instance = VectorDBService.get_instance(embedding_model_version=embedding_model_version)
-        return instance.search(query, top_k)
+        return instance.search(query, top_k, nprobe=nprobe, ef_search=ef_search, owner_id=owner_id)
 
     @staticmethod
     def clear_search_cache():
-        """清除所有向量搜索缓存"""
+        """
+        使所有向量搜索缓存失效
 
-        pattern = "smartdocs:cache:vector_search:*"
-        count = RedisCache.clear_pattern(pattern)
+        只递增搜索缓存命名空间的版本号，旧的缓存键由过期时间淘汰，不遍历Redis中的键
 
-        if count:
-            logger.info(f"已清除{count}个向量搜索缓存")
+        Returns:
+            int: 新的命名空间版本号
+        """
+        version = RedisCache.invalidate_namespace(VectorDBService.SEARCH_CACHE_NAMESPACE)
+        logger.debug(f"向量搜索缓存已失效，命名空间版本: {version}")
+        return version
 
-        return count
+    @staticmethod
+    def announce_active_model(previous_version: str, active_version: str) -> bool:
+        """
+        在切换前版本的更新频道上通知其他进程检索模型版本已切换，订阅该频道的进程随即预加载新版本的索引
+
+        Args:
+            previous_version: 切换前的检索模型版本
+            active_version: 切换后的检索模型版本
+
+        Returns:
+            bool: 是否成功发布
+        """
+        try:
+            notification = {
+                "timestamp": time.time(),
+                "active_model_version": active_version,
+                "source_pid": os.getpid(),
+                "embedding_model_version": previous_version,
+            }
+            channel = VectorDBService._redis_key_for(VectorDBService.REDIS_UPDATE_CHANNEL, previous_version)
+            RedisCache.publish(channel, pickle.dumps(notification))
+            return True
+        except Exception as e:
+            logger.error(f"发布检索模型版本切换通知失败: {str(e)}")
+            return False
 
     @staticmethod
     def preload_index_async(embedding_model_version=None):
@@ -543,11 +1828,12 @@ class VectorDBService:
             # 持续监听消息，直到收到停止信号
             while not self._stop_subscriber.is_set():
                 try:
-                    # 获取消息，设置超时以便定期检查停止标志
-                    message = pubsub.get_message(timeout=1.0)
+                    # 获取消息，设置超时以便定期检查停止标志和待合并的通知
+                    message = pubsub.get_message(timeout=min(1.0, max(self.reload_debounce, 0.05)))
                     if message and message["type"] == "message":
                         # 处理收到的通知消息
                         self._handle_update_notification(message["data"])
+                    self._maybe_reload()
                 except Exception as e:
                     logger.error(f"处理订阅消息时出错: {str(e)}")
                     # 短暂暂停避免CPU占用过高
@@ -562,7 +1848,12 @@ class VectorDBService:
             logger.exception(f"索引更新订阅线程异常: {str(e)}")
 
     def _handle_update_notification(self, notification_data):
-        """处理收到的索引更新通知"""
+        """
+        处理收到的索引更新通知
+
+        只记录待加载的代数，由_maybe_reload合并一段时间内的通知后统一重新加载；
+        已加载的代数直接跳过
+        """
         try:
             # 解析通知数据
             notification = pickle.loads(notification_data)
@@ -573,29 +1864,110 @@ class VectorDBService:
                 logger.debug("忽略自己发出的索引更新通知")
                 return
 
-            logger.info(
-                f"收到索引更新通知 (来源进程: {source_pid}, "
-                f"向量数量: {notification.get('vector_count')}, "
-                f"时间戳: {notification.get('timestamp')})"
-            )
+            # 检索模型版本已切换，提前加载新版本的索引，切换后的第一个请求不必等待加载
+            active_version = notification.get("active_model_version")
+            if active_version:
+                if active_version != self.embedding_model_version:
+                    logger.info(f"检索模型版本已切换为{active_version}，开始预加载其索引")
+                    VectorDBService.preload_index_async(active_version)
+                return
 
-            # 重新加载索引
-            self.reload_index()
+            index_id = notification.get("index_id")
+            generation = notification.get("generation")
+            snapshot = self.snapshot
+            if generation is not None and index_id == snapshot.manifest.get("index_id"):
+                if generation <= snapshot.generation:
+                    logger.debug(f"索引代数{generation}已加载（当前代数{snapshot.generation}），跳过通知")
+                    return
+
+            latest_id, latest_generation = self._latest_notified
+            if index_id != latest_id or (generation or 0) > latest_generation:
+                self._latest_notified = (index_id, generation or 0)
+
+            now = time.monotonic()
+            if self._pending_since is None:
+                self._pending_since = now
+            self._last_notified_at = now
+            self._pending_notifications += 1
+
+            logger.debug(
+                f"收到索引更新通知 (来源进程: {source_pid}, 代数: {generation}, "
+                f"向量数量: {notification.get('vector_count')})，待合并通知: {self._pending_notifications}"
+            )
 
         except Exception as e:
             logger.error(f"处理索引更新通知时出错: {str(e)}")
 
+    def _maybe_reload(self) -> bool:
+        """
+        通知安静了reload_debounce秒，或第一条待处理通知已等待reload_max_delay秒时，重新加载一次索引
+
+        Returns:
+            bool: 是否进行了重新加载
+        """
+        if self._pending_since is None:
+            return False
+
+        now = time.monotonic()
+        if now - self._last_notified_at < self.reload_debounce and now - self._pending_since < self.reload_max_delay:
+            return False
+
+        lag = self.get_reload_lag()
+        notifications = self._pending_notifications
+        self._pending_since = None
+        self._last_notified_at = None
+        self._pending_notifications = 0
+
+        reloaded = self.reload_index()
+        logger.info(
+            f"合并{notifications}条索引更新通知后重新加载{'成功' if reloaded else '失败'}，"
+            f"加载前落后{lag['generations_behind']}代，等待{lag['pending_seconds']:.2f}秒，"
+            f"当前代数: {self.snapshot.generation}"
+        )
+        return reloaded
+
+    def get_reload_lag(self) -> Dict[str, Any]:
+        """
+        报告本进程加载的索引落后于其他进程通知的程度
+
+        Returns:
+            dict: loaded_generation（已加载代数）、latest_generation（通知中的最新代数）、
+                generations_behind（落后代数）、pending_notifications（待合并通知数）、
+                pending_seconds（最早的待处理通知已等待的秒数）
+        """
+        snapshot = self.snapshot
+        latest_id, latest_generation = self._latest_notified
+        behind = 0
+        if self._pending_since is not None:
+            if latest_id == snapshot.manifest.get("index_id"):
+                behind = max(latest_generation - snapshot.generation, 0)
+            else:
+                # 索引已重建，代数不可比，以待处理的通知数量估计
+                behind = self._pending_notifications
+
+        return {
+            "loaded_generation": snapshot.generation,
+            "latest_generation": max(latest_generation, snapshot.generation),
+            "generations_behind": behind,
+            "pending_notifications": self._pending_notifications,
+            "pending_seconds": time.monotonic() - self._pending_since if self._pending_since is not None else 0.0,
+        }
+
     def reload_index(self):
         """重新加载索引文件"""
         try:
-            logger.info(f"开始重新加载索引文件: {self.index_file}")
+            logger.info(f"开始重新加载索引段: {self.segment_store.manifest_file}")
 
-            if not os.path.exists(self.index_file) or not os.path.exists(self.mapping_file):
+            if not self.segment_store.exists():
                 logger.warning("索引文件不存在，无法重新加载")
                 return False
 
-            # 使用共享方法加载索引
-            if self._load_index_from_file():
+            # 先重新映射其他进程追加的原始向量，新快照发布时精确重排所需的向量已经可用
+            if self.raw_vector_store is not None:
+                self.raw_vector_store.refresh()
+
+            # 只加载新出现的段，已加载的段直接复用
+            if self._load_segments():
                 # 清除搜索缓存确保使用新索引
                 self.clear_search_cache()
                 logger.info("索引重新加载完成并清除搜索缓存")
@@ -607,9 +1979,26 @@ class VectorDBService:
             logger.exception(f"重新加载索引时异常: {str(e)}")
             return False
 
+    def close(self) -> None:
+        """
+        停止后台订阅线程和分片搜索线程池，实例被注册表淘汰时调用
+
+        正在使用本实例的请求可以继续完成（分片改为在请求线程中依次搜索），之后实例随引用释放；
+        下一次获取该模型版本时重新加载
+        """
+        self._stop_subscriber.set()
+        self.shard_searcher.shutdown()
+        if self.query_cache is not None:
+            self.query_cache.clear()
+        self.owner_partitions.clear()
+        logger.info(f"VectorDBService实例已淘汰 (模型版本: {self.embedding_model_version})")
+
     def __del__(self):
         """析构函数，确保清理资源"""
         try:
+            if hasattr(self, "shard_searcher"):
+                self.shard_searcher.shutdown()
+
             # 停止订阅线程
             if hasattr(self, "_stop_subscriber"):
                 self._stop_subscriber.set()
@@ -0,0 +1,397 @@
+"""
+向量索引分段存储模块
+采用类似LSM的布局：较大的基础段加若干个只追加的增量段，由manifest.json记录当前有效的段，
+新增文档只写入新的增量段，后台合并再把增量段压缩为更大的段
+
+基础段可按文档块ID分为多个分片（chunk_id % 分片数），每个分片是单独的段文件，搜索时并行查询
+
+删除的向量ID以只追加的方式写入墓碑文件，搜索时过滤，合并进基础段时再物理删除
+
+段文件旁边可以保存同名的.terms文件（段中文档块的词频数据，用于词法索引），与段文件一起写入和删除
+"""
+
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import faiss
+import numpy as np
+from loguru import logger
+
+
+class VectorSegmentStore:
+    """管理段文件和manifest，段文件一旦写入就不再修改"""
+
+    MANIFEST_FILE = "manifest.json"
+    MANIFEST_LOCK_FILE = "manifest.lock"
+    MERGE_LOCK_FILE = "merge.lock"
+    SEGMENTS_DIR = "segments"
+    TERMS_SUFFIX = ".terms"
+
+    def __init__(self, directory: str):
+        """
+        初始化分段存储
+
+        Args:
+            directory: 向量库目录
+        """
+        self.directory = directory
+        self.segments_dir = os.path.join(directory, self.SEGMENTS_DIR)
+        self.manifest_file = os.path.join(directory, self.MANIFEST_FILE)
+        self.manifest_lock_file = os.path.join(directory, self.MANIFEST_LOCK_FILE)
+        self.merge_lock_file = os.path.join(directory, self.MERGE_LOCK_FILE)
+        Path(self.segments_dir).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def empty_manifest() -> Dict[str, Any]:
+        """
+        空的manifest
+
+        index_id标识一份索引，清空重建后变化，同一index_id下generation单调递增；
+        base为按分片顺序排列的基础段列表，base和deltas中的段记录格式为
+        {"name": 相对向量库目录的文件名, "ntotal": 向量数量}，
+        tombstones记录格式为{"name": 墓碑文件名, "count": 有效的ID数量}
+        """
+        return {
+            "index_id": uuid.uuid4().hex,
+            "generation": 0,
+            "next_segment_id": 1,
+            "base": [],
+            "deltas": [],
+            "tombstones": None,
+        }
+
+    @staticmethod
+    def segment_names(manifest: Dict[str, Any]) -> List[str]:
+        """按基础段分片、增量段的顺序返回manifest中的段文件名"""
+        names = [base["name"] for base in manifest.get("base", [])]
+        names.extend(delta["name"] for delta in manifest.get("deltas", []))
+        return names
+
+    def exists(self) -> bool:
+        """manifest是否存在"""
+        return os.path.exists(self.manifest_file)
+
+    def segment_path(self, name: str) -> str:
+        """段文件的绝对路径"""
+        return os.path.join(self.directory, name)
+
+    def read_manifest(self) -> Dict[str, Any]:
+        """读取manifest，不存在时返回空manifest"""
+        if not self.exists():
+            return self.empty_manifest()
+        with open(self.manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        # 不分片时的旧manifest中base为单个段记录
+        if isinstance(manifest.get("base"), dict) or manifest.get("base") is None:
+            manifest["base"] = [manifest["base"]] if manifest.get("base") else []
+        return manifest
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        """
+        原子替换manifest文件
+
+        manifest是当前版本的指针：段文件写入后不再修改，新版本只在rename完成后对读取方可见，
+        读取方要么看到完整的旧版本，要么看到完整的新版本
+        """
+        tmp_path = f"{self.manifest_file}.tmp.{os.getpid()}"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.manifest_file)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        # 同步目录项，保证断电后rename不会丢失
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    @contextmanager
+    def _file_lock(self, path: str, blocking: bool = True) -> Iterator[bool]:
+        """基于fcntl的跨进程文件锁，非阻塞模式下获取失败时返回False"""
+        with open(path, "a") as lock_file:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def merge_lock(self) -> Iterator[bool]:
+        """合并锁，保证同一时间只有一个进程在合并段，已被占用时返回False"""
+        with self._file_lock(self.merge_lock_file, blocking=False) as acquired:
+            yield acquired
+
+    @staticmethod
+    def _write_file(path: str, write_func) -> None:
+        """先写入临时文件再原子替换目标文件"""
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        try:
+            write_func(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _write_segment(
+        self, manifest: Dict[str, Any], prefix: str, index: faiss.Index, terms: Optional[bytes] = None
+    ) -> Dict[str, Any]:
+        """分配段编号并写入段文件和词频数据，调用方需持有manifest锁"""
+        segment_id = manifest["next_segment_id"]
+        manifest["next_segment_id"] = segment_id + 1
+        name = f"{self.SEGMENTS_DIR}/{prefix}-{segment_id:08d}.index"
+
+        path = self.segment_path(name)
+        if terms is not None:
+            # 先于manifest写入，其他进程看到新段时词频数据已经存在
+            self._write_file(path + self.TERMS_SUFFIX, lambda tmp_path: Path(tmp_path).write_bytes(terms))
+        self._write_file(path, lambda tmp_path: faiss.write_index(index, tmp_path))
+        return {"name": name, "ntotal": int(index.ntotal)}
+
+    def read_terms(self, name: str) -> Optional[bytes]:
+        """
+        读取段的词频数据
+
+        Args:
+            name: 段文件名
+
+        Returns:
+            写入段时保存的词频数据，没有保存或段已被合并删除时返回None
+        """
+        try:
+            return Path(self.segment_path(name) + self.TERMS_SUFFIX).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def add_delta(self, index: faiss.Index, terms: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        把新向量写成一个增量段并追加到manifest
+
+        Args:
+            index: 只包含新增向量的索引
+            terms: 段中文档块的词频数据，可选
+
+        Returns:
+            更新后的manifest，其中最后一个增量段即为新写入的段
+        """
+        with self._file_lock(self.manifest_lock_file):
+            manifest = self.read_manifest()
+            manifest["deltas"].append(self._write_segment(manifest, "delta", index, terms))
+            manifest["generation"] += 1
+            self._write_manifest(manifest)
+        return manifest
+
+    def read_tombstones(self, manifest: Dict[str, Any]) -> np.ndarray:
+        """
+        读取manifest对应的已删除向量ID
+
+        墓碑文件只追加，按manifest中记录的数量读取，不会读到之后追加的ID
+
+        Args:
+            manifest: 当前manifest
+
+        Returns:
+            int64的向量ID数组
+        """
+        tombstones = manifest.get("tombstones")
+        if not tombstones or not tombstones["count"]:
+            return np.empty(0, dtype=np.int64)
+        return np.fromfile(self.segment_path(tombstones["name"]), dtype=np.int64, count=tombstones["count"])
+
+    def add_tombstones(self, ids: np.ndarray) -> Dict[str, Any]:
+        """
+        追加已删除的向量ID
+
+        Args:
+            ids: 向量ID
+
+        Returns:
+            更新后的manifest
+        """
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        with self._file_lock(self.manifest_lock_file):
+            manifest = self.read_manifest()
+            tombstones = manifest.get("tombstones")
+            if not tombstones:
+                tombstones = self._new_tombstone_file(manifest, np.empty(0, dtype=np.int64))
+
+            path = self.segment_path(tombstones["name"])
+            with open(path, "r+b") as f:
+                # 丢弃上次未登记到manifest的写入
+                f.truncate(tombstones["count"] * 8)
+                f.seek(0, os.SEEK_END)
+                ids.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            manifest["tombstones"] = {"name": tombstones["name"], "count": tombstones["count"] + len(ids)}
+            manifest["generation"] += 1
+            self._write_manifest(manifest)
+        return manifest
+
+    def _new_tombstone_file(self, manifest: Dict[str, Any], ids: np.ndarray) -> Dict[str, Any]:
+        """写入新的墓碑文件，调用方需持有manifest锁"""
+        segment_id = manifest["next_segment_id"]
+        manifest["next_segment_id"] = segment_id + 1
+        name = f"{self.SEGMENTS_DIR}/tombstones-{segment_id:08d}.i64"
+        ids.astype(np.int64).tofile(self.segment_path(name))
+        return {"name": name, "count": len(ids)}
+
+    def adopt_base(self, name: str, ntotal: int) -> Dict[str, Any]:
+        """
+        把已存在的索引文件登记为基础段，用于从单文件索引升级到分段布局
+
+        Args:
+            name: 相对向量库目录的文件名
+            ntotal: 向量数量
+
+        Returns:
+            更新后的manifest
+        """
+        with self._file_lock(self.manifest_lock_file):
+            manifest = self.read_manifest()
+            if not manifest["base"]:
+                manifest["base"] = [{"name": name, "ntotal": int(ntotal)}]
+                manifest["generation"] += 1
+                self._write_manifest(manifest)
+        return manifest
+
+    def replace_segments(
+        self,
+        merged: List[str],
+        indexes: List[faiss.Index],
+        as_base: bool,
+        applied_tombstones: int = 0,
+        terms: Optional[List[Optional[bytes]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        用合并后的段替换被合并的段，合并期间新写入的增量段和墓碑保持不变
+
+        Args:
+            merged: 被合并的段文件名（可包含当前基础段）
+            indexes: 合并后的索引，作为基础段时按分片顺序排列，作为增量段时只有一个
+            as_base: 合并结果是否作为新的基础段
+            applied_tombstones: 已在合并中物理删除的墓碑数量，仅在合并全部段为基础段时可以丢弃这些墓碑
+            terms: 与indexes一一对应的词频数据，可选
+
+        Returns:
+            更新后的manifest，合并结果为基础段或第一个增量段
+        """
+        terms = terms or [None] * len(indexes)
+        with self._file_lock(self.manifest_lock_file):
+            manifest = self.read_manifest()
+            written = [
+                self._write_segment(manifest, "base" if as_base else "delta", index, index_terms)
+                for index, index_terms in zip(indexes, terms)
+            ]
+
+            removed = [delta["name"] for delta in manifest["deltas"] if delta["name"] in merged]
+            remaining = [delta for delta in manifest["deltas"] if delta["name"] not in merged]
+            if as_base:
+                removed.extend(base["name"] for base in manifest["base"])
+                manifest["base"] = written
+                manifest["deltas"] = remaining
+            else:
+                manifest["deltas"] = [*written, *remaining]
+
+            tombstones = manifest.get("tombstones")
+            if as_base and tombstones and applied_tombstones:
+                # 合并期间新写入的增量段只包含新的文档块ID，不受已丢弃的墓碑影响
+                # 墓碑文件可能正被其他进程按旧manifest读取，写入新文件而不是截断原文件
+                pending = self.read_tombstones(manifest)[applied_tombstones:]
+                manifest["tombstones"] = self._new_tombstone_file(manifest, pending)
+                removed.append(tombstones["name"])
+            manifest["generation"] += 1
+            self._write_manifest(manifest)
+
+        # 已加载旧段的进程不受影响：完整读取的段已在内存中，内存映射的段在文件删除后依然有效
+        self._remove_files(removed)
+        return manifest
+
+    def _remove_files(self, names: List[str]) -> None:
+        for name in names:
+            for path in (self.segment_path(name), self.segment_path(name) + self.TERMS_SUFFIX):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.warning(f"删除已合并的段文件失败: {path}, 错误: {str(e)}")
+
+    def clear(self) -> None:
+        """删除manifest和全部段文件"""
+        with self._file_lock(self.manifest_lock_file):
+            manifest = self.read_manifest()
+            names = self.segment_names(manifest)
+            if manifest.get("tombstones"):
+                names.append(manifest["tombstones"]["name"])
+            if self.exists():
+                os.remove(self.manifest_file)
+        self._remove_files(names)
+        logger.info("已清空向量索引分段存储")
+
+    @staticmethod
+    def plan_merge(
+        manifest: Dict[str, Any], max_deltas: int, merge_ratio: float, num_shards: int = 1
+    ) -> Optional[str]:
+        """
+        根据manifest决定是否需要合并
+
+        - 增量段和墓碑总量达到基础段的merge_ratio时，把全部增量段并入基础段并物理删除墓碑（major）
+        - 基础段的分片数与配置不一致时，重新分片（major）
+        - 增量段数量达到max_deltas时，只把增量段合并为一个较大的增量段（minor），不重写基础段
+
+        Args:
+            manifest: 当前manifest
+            max_deltas: 允许的最多增量段数量
+            merge_ratio: 触发并入基础段的增量向量和墓碑占比
+            num_shards: 配置的基础段分片数
+
+        Returns:
+            "major"、"minor"或None
+        """
+        bases = manifest.get("base", [])
+        if bases and len(bases) != num_shards:
+            return "major"
+
+        deltas = manifest.get("deltas", [])
+        tombstone_count = manifest["tombstones"]["count"] if manifest.get("tombstones") else 0
+        if not deltas and not tombstone_count:
+            return None
+
+        base_ntotal = sum(base["ntotal"] for base in bases)
+        pending = sum(delta["ntotal"] for delta in deltas) + tombstone_count
+        if pending >= base_ntotal * merge_ratio and (base_ntotal > 0 or len(deltas) >= max_deltas):
+            return "major"
+        if len(deltas) >= max_deltas:
+            return "minor"
+        return None
+
+    @staticmethod
+    def describe(manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """返回分段的规模信息，便于日志和监控"""
+        deltas = manifest.get("deltas", [])
+        bases = manifest.get("base", [])
+        return {
+            "generation": manifest.get("generation", 0),
+            "base_shards": len(bases),
+            "base_ntotal": sum(base["ntotal"] for base in bases),
+            "delta_segments": len(deltas),
+            "delta_ntotal": sum(delta["ntotal"] for delta in deltas),
+            "tombstones": manifest["tombstones"]["count"] if manifest.get("tombstones") else 0,
+        }
@@ -86,3 +86,25 @@ def reprocess_document_task(self, document_id, embedding_model_version=None):
 
         # 重新抛出异常以触发重试机制
         raise
+
+
+@shared_task(
+    bind=True,
+    max_retries=3,
+    default_retry_delay=60,  # 1分钟后重试
+    autoretry_for=(Exception,),  # 自动重试所有异常
+    name="documents.merge_index_segments",
+)
+def merge_index_segments_task(self, embedding_model_version=None):
+    """Celery任务：在后台合并向量索引的增量段"""
+    # 绑定任务信息到日志
+    task_logger = celery_logger.bind(task_id=self.request.id, task_name="merge_index_segments")
+    task_logger.info(f"开始合并索引段, 嵌入模型: {embedding_model_version}")
+
+    # 延迟导入，避免与vector_db_service中的任务提交形成循环导入
+    from documents.services.vector_db_service import VectorDBService
+
+    vector_db = VectorDBService.get_instance(embedding_model_version=embedding_model_version)
+    merged = vector_db.merge_segments()
+
+    return {"embedding_model_version": embedding_model_version, "merged": merged, "task_id": self.request.id}
@@ -1,3 +1,1370 @@
-from django.test import TestCase
+import os
+import pickle
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import faiss
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from common.utils.cache_utils import RedisCache, cached
+from common.utils.rate_limiter import GlobalTokenBucket, RateLimiter, TokenBucket
+from documents.models import Document, DocumentChunk
+from documents.services.embedding_service import EmbeddingError, EmbeddingService, estimate_tokens
+from documents.services.faiss_index_factory import FaissIndexFactory
+from documents.services.index_snapshot import IndexSnapshot
+from documents.services.instance_registry import InstanceRegistry
+from documents.services.lexical_index import LexicalIndex
+from documents.services.micro_batcher import MicroBatcher
+from documents.services.local_embedding_service import LocalEmbeddingService, plan_length_buckets
+from documents.services.model_storage import (
+    adopt_root_storage,
+    get_active_model,
+    model_storage_path,
+    set_active_model_version,
+    storage_name,
+)
+from documents.services.owner_partition import OwnerPartition, OwnerPartitionCache
+from documents.services.raw_vector_store import RawVectorStore
+from documents.services.result_diversifier import merge_adjacent_chunks, mmr_select, ranking_score
+from documents.services.semantic_query_cache import SemanticQueryCache
+from documents.services.shard_searcher import ShardSearcher
+from documents.services.tombstone_filter import TombstoneFilter
+from documents.services.vector_db_service import VectorDBService
+from documents.services.vector_segment_store import VectorSegmentStore
+
+
+class VectorSearchHydrationTest(TestCase):
+    """检索结果批量加载测试"""
+
+    MODEL_VERSION = "text-embedding-v4"
+
+    def setUp(self):
+        # 绕过单例初始化，避免加载嵌入模型和索引文件
+        self.service = object.__new__(VectorDBService)
+        self.service.embedding_model_version = self.MODEL_VERSION
+
+        self.doc = self._create_document("当前文档", self.MODEL_VERSION)
+        self.deleted_doc = self._create_document("已删除文档", self.MODEL_VERSION)
+        self.deleted_doc.soft_delete()
+        self.old_doc = self._create_document("旧模型文档", "text-embedding-v3")
+
+        self.chunks = [self._create_chunk(self.doc, i) for i in range(5)]
+        self.deleted_chunk = self._create_chunk(self.deleted_doc, 0)
+        self.old_chunk = self._create_chunk(self.old_doc, 0)
+        self.all_chunks = [*self.chunks, self.deleted_chunk, self.old_chunk]
+
+    def _create_document(self, title, model_version):
+        return Document.objects.create(
+            title=title,
+            file_type="txt",
+            owner_id=1,
+            status="processed",
+            embedding_model_version=model_version,
+        )
+
+    def _create_chunk(self, document, chunk_index):
+        return DocumentChunk.objects.create(
+            document_id=document.id,
+            content=f"{document.title} 块{chunk_index}",
+            chunk_index=chunk_index,
+            embedding_model_version=document.embedding_model_version,
+        )
+
+    def test_hydration_uses_constant_number_of_queries(self):
+        hits = [(chunk.id, 1.0 - i * 0.01) for i, chunk in enumerate(self.all_chunks)]
+
+        with self.assertNumQueries(2):
+            results = self.service._hydrate_results(hits)
+
+        self.assertEqual(len(results), len(self.chunks))
+
+    def test_hydration_keeps_faiss_rank_order(self):
+        hits = [(self.chunks[i].id, score) for i, score in [(3, 0.9), (0, 0.8), (4, 0.7), (1, 0.6)]]
+
+        results = self.service._hydrate_results(hits)
+
+        self.assertEqual([r["chunk_index"] for r in results], [3, 0, 4, 1])
+        self.assertEqual([r["score"] for r in results], [0.9, 0.8, 0.7, 0.6])
+
+    def test_hydration_drops_deleted_and_mismatched_documents(self):
+        missing_chunk_id = max(chunk.id for chunk in self.all_chunks) + 100
+        hits = [
+            (self.deleted_chunk.id, 0.95),
+            (self.old_chunk.id, 0.9),
+            (self.chunks[2].id, 0.5),
+            (missing_chunk_id, 0.4),
+        ]
+
+        results = self.service._hydrate_results(hits)
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["id"], self.doc.id)
+        self.assertEqual(results[0]["chunk_id"], self.chunks[2].id)
+
+    def test_hydrate_many_loads_all_queries_at_once(self):
+        hits_per_query = [
+            [(self.chunks[0].id, 0.9), (self.deleted_chunk.id, 0.8)],
+            [],
+            [(self.chunks[4].id, 0.7), (self.chunks[0].id, 0.6)],
+        ]
+
+        with self.assertNumQueries(2):
+            results = self.service._hydrate_many(hits_per_query)
+
+        self.assertEqual([[r["chunk_index"] for r in query_results] for query_results in results], [[0], [], [4, 0]])
+
+
+class FaissIndexFactoryTest(SimpleTestCase):
+    """索引工厂测试"""
+
+    THRESHOLD = 600
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((self.THRESHOLD, 16)).astype("float32")
+        faiss.normalize_L2(self.vectors)
+        self.ids = np.arange(self.THRESHOLD, dtype=np.int64) * 5 + 7
+
+        # 绕过单例初始化，只保留提升索引所需的配置
+        self.service = object.__new__(VectorDBService)
+        self.service.index_promote_threshold = self.THRESHOLD
+        self.service.num_shards = 1
+        self.service.index_options = {"hnsw_m": 16, "ivf_nlist": 8, "ivf_nprobe": 2}
+
+    def _flat(self, count):
+        return FaissIndexFactory.build(FaissIndexFactory.FLAT, self.vectors[:count], ids=self.ids[:count])
+
+    def test_flat_is_promoted_at_threshold(self):
+        for index_type in (FaissIndexFactory.HNSW, FaissIndexFactory.IVF):
+            self.service.index_type = index_type
+
+            below = self._flat(self.THRESHOLD - 1)
+            self.assertIs(self.service._maybe_promote_index(below), below, index_type)
+
+            promoted = self.service._maybe_promote_index(self._flat(self.THRESHOLD))
+            self.assertEqual(FaissIndexFactory.get_index_type(promoted), index_type)
+            self.assertEqual(FaissIndexFactory.get_ids(promoted).tolist(), self.ids.tolist())
+            # 提升后仍以文档块ID作为向量ID，每个向量最近的是它自己
+            params = FaissIndexFactory.build_search_params(promoted, nprobe=8, ef_search=128)
+            _, indices = promoted.search(self.vectors[:20], 1, params=params)
+            self.assertEqual(indices[:, 0].tolist(), self.ids[:20].tolist(), index_type)
+
+    def test_promoted_index_is_not_promoted_again(self):
+        index = FaissIndexFactory.build(FaissIndexFactory.HNSW, self.vectors, ids=self.ids, hnsw_m=16)
+
+        self.assertFalse(FaissIndexFactory.should_promote(index, FaissIndexFactory.IVF, 1))
+        self.assertFalse(FaissIndexFactory.should_promote(self._flat(10), FaissIndexFactory.FLAT, 1))
+
+    def test_per_request_params_reach_search_params(self):
+        ivf = FaissIndexFactory.build(FaissIndexFactory.IVF, self.vectors, ids=self.ids, ivf_nlist=8, ivf_nprobe=2)
+        hnsw = FaissIndexFactory.build(FaissIndexFactory.HNSW, self.vectors, ids=self.ids, hnsw_ef_search=32)
+
+        self.assertEqual(FaissIndexFactory.build_search_params(ivf, nprobe=4).nprobe, 4)
+        # nprobe不超过聚类中心数量，未指定时使用索引的默认值
+        self.assertEqual(FaissIndexFactory.build_search_params(ivf, nprobe=100).nprobe, 8)
+        self.assertEqual(FaissIndexFactory.build_search_params(ivf, selector=TombstoneFilter(self.ids[:1]).selector).nprobe, 2)
+        self.assertEqual(FaissIndexFactory.build_search_params(hnsw, ef_search=256).efSearch, 256)
+        self.assertIsNone(FaissIndexFactory.build_search_params(hnsw))
+        # 搜索参数不修改共享的索引对象
+        self.assertEqual(FaissIndexFactory.unwrap(ivf).nprobe, 2)
+        self.assertEqual(FaissIndexFactory.unwrap(hnsw).hnsw.efSearch, 32)
+
+        # 扫描全部聚类时与精确搜索结果一致
+        _, expected = self._flat(self.THRESHOLD).search(self.vectors[:10], 5)
+        _, indices = ivf.search(self.vectors[:10], 5, params=FaissIndexFactory.build_search_params(ivf, nprobe=8))
+        self.assertEqual(indices.tolist(), expected.tolist())
+
+    def test_remove_ids_on_hnsw_keeps_remaining_vectors_searchable(self):
+        index = FaissIndexFactory.build(FaissIndexFactory.HNSW, self.vectors, ids=self.ids, hnsw_m=16)
+        removed = self.ids[::3]
+
+        rebuilt = FaissIndexFactory.remove_ids(index, removed, hnsw_m=16)
+
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(FaissIndexFactory.get_index_type(rebuilt), FaissIndexFactory.HNSW)
+        self.assertEqual(rebuilt.ntotal, len(self.ids) - len(removed))
+        _, indices = rebuilt.search(self.vectors[:30], 1)
+        kept = ~np.isin(self.ids[:30], removed)
+        self.assertEqual(indices[kept, 0].tolist(), self.ids[:30][kept].tolist())
+        self.assertFalse(np.isin(indices, removed).any())
+        # 不包含要删除的ID时返回原索引
+        self.assertIs(FaissIndexFactory.remove_ids(rebuilt, removed), rebuilt)
+
+
+class RawVectorStoreTest(SimpleTestCase):
+    """原始向量存储测试"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((400, 16)).astype("float32")
+        faiss.normalize_L2(self.vectors)
+        self.ids = np.arange(400, dtype=np.int64) * 3 + 11
+
+    def test_append_read_back_and_rerank(self):
+        store = RawVectorStore(self.directory, 16)
+        for start in range(0, 400, 100):
+            store.append(self.ids[start : start + 100], self.vectors[start : start + 100])
+
+        vectors, found = store.get(np.array([self.ids[5], -1, self.ids[399]]))
+        self.assertEqual(found.tolist(), [True, False, True])
+        np.testing.assert_array_equal(vectors[[0, 2]], self.vectors[[5, 399]])
+
+        # 压缩索引的近似结果用原始向量重排后与精确搜索一致
+        service = object.__new__(VectorDBService)
+        service.raw_vector_store = store
+        sq8 = FaissIndexFactory.build(FaissIndexFactory.SQ8, self.vectors, ids=self.ids)
+        queries = self.vectors[:5]
+        distances, indices = sq8.search(queries, 20)
+        _, reranked = service._rerank_exact(queries, distances, indices, 5)
+        _, expected = FaissIndexFactory.build(FaissIndexFactory.FLAT, self.vectors, ids=self.ids).search(queries, 5)
+        self.assertEqual(reranked[:, 0].tolist(), self.ids[:5].tolist())
+        self.assertEqual(reranked.tolist(), expected.tolist())
+
+    def test_appends_from_other_instances_are_loaded_incrementally(self):
+        reader = RawVectorStore(self.directory, 16)
+        writer = RawVectorStore(self.directory, 16)
+
+        writer.append(self.ids[:100], self.vectors[:100])
+        self.assertTrue(reader.get(self.ids[:100])[1].all())
+        # 同一ID再次写入时读取最后写入的向量
+        writer.append(self.ids[:1], self.vectors[1:2])
+        writer.append(self.ids[100:200], self.vectors[100:200])
+
+        with mock.patch("numpy.argsort", wraps=np.argsort) as argsort:
+            vectors, found = reader.get(self.ids[:200])
+        self.assertTrue(found.all())
+        np.testing.assert_array_equal(vectors[0], self.vectors[1])
+        np.testing.assert_array_equal(vectors[1:], self.vectors[1:200])
+        # 只对新增的ID排序
+        self.assertEqual(len(argsort.call_args.args[0]), 101)
+
+    def test_incomplete_write_is_truncated_before_next_append(self):
+        store = RawVectorStore(self.directory, 16)
+        store.append(self.ids[:10], self.vectors[:10])
+        # 模拟向量写入后进程退出、ID未写入
+        with open(store.vectors_file, "ab") as f:
+            self.vectors[10:15].tofile(f)
+
+        store.append(self.ids[15:20], self.vectors[15:20])
+
+        vectors, found = store.get(self.ids[:20])
+        self.assertEqual(found.tolist(), [True] * 10 + [False] * 5 + [True] * 5)
+        np.testing.assert_array_equal(vectors[15:], self.vectors[15:20])
+
+    def test_compact_drops_deleted_and_overwritten_vectors(self):
+        store = RawVectorStore(self.directory, 16)
+        reader = RawVectorStore(self.directory, 16)
+        store.append(self.ids[:100], self.vectors[:100])
+        store.append(self.ids[:10], self.vectors[100:110])
+        self.assertTrue(reader.get(self.ids[:1])[1].all())
+
+        removed = store.compact(self.ids[50:60])
+
+        self.assertEqual(removed, 20)
+        vectors, found = reader.get(self.ids[:100])
+        self.assertEqual(reader.count, 90)
+        self.assertEqual(found.tolist(), [True] * 50 + [False] * 10 + [True] * 40)
+        np.testing.assert_array_equal(vectors[:10], self.vectors[100:110])
+        np.testing.assert_array_equal(vectors[60:], self.vectors[60:100])
+        self.assertEqual(store.compact(self.ids[50:60]), 0)
+
+
+class MmapIndexTest(SimpleTestCase):
+    """内存映射加载索引测试"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((500, 16)).astype("float32")
+        faiss.normalize_L2(self.vectors)
+        self.ids = np.arange(500, dtype=np.int64) * 2 + 1
+
+        self.service = object.__new__(VectorDBService)
+        self.service.use_mmap = True
+
+    @staticmethod
+    def _is_mapped(path):
+        with open("/proc/self/maps") as f:
+            return any(line.rstrip().endswith(path) for line in f)
+
+    def test_segment_files_are_mapped_and_copied_before_writing(self):
+        for index_type in (FaissIndexFactory.FLAT, FaissIndexFactory.SQ8, FaissIndexFactory.HNSW):
+            index = FaissIndexFactory.build(index_type, self.vectors, ids=self.ids)
+            path = os.path.join(self.directory, f"{index_type}.index")
+            faiss.write_index(index, path)
+
+            loaded = self.service._read_index(path)
+
+            self.assertTrue(self._is_mapped(path), index_type)
+            np.testing.assert_array_equal(loaded.search(self.vectors[:5], 3)[1], index.search(self.vectors[:5], 3)[1])
+
+            copy = FaissIndexFactory.remove_ids(self.service._writable_copy(loaded), self.ids[:10])
+            copy.add_with_ids(self.vectors[:2], np.array([9001, 9003], dtype=np.int64))
+            self.assertEqual(copy.ntotal, 492, index_type)
+            self.assertEqual(loaded.ntotal, 500, index_type)
+
+
+class TombstoneFilterTest(SimpleTestCase):
+    """墓碑过滤测试"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((200, 16)).astype("float32")
+        faiss.normalize_L2(self.vectors)
+        # 文档块ID不连续
+        self.ids = np.arange(200, dtype=np.int64) * 3 + 1000
+        self.deleted = self.ids[::2]
+
+    def _build(self, index_type):
+        return FaissIndexFactory.build(index_type, self.vectors, ids=self.ids)
+
+    def test_contains_matches_deleted_ids(self):
+        tombstones = TombstoneFilter(self.deleted)
+
+        mask = tombstones.contains(np.array([*self.ids, -1, 10**9]))
+
+        self.assertEqual(mask[: len(self.ids)].tolist(), np.isin(self.ids, self.deleted).tolist())
+        self.assertFalse(mask[-2:].any())
+
+    def test_selector_filters_inside_search(self):
+        tombstones = TombstoneFilter(self.deleted)
+
+        for index_type in (FaissIndexFactory.FLAT, FaissIndexFactory.HNSW):
+            index = self._build(index_type)
+            params = FaissIndexFactory.build_search_params(index, selector=tombstones.selector)
+            _, indices = index.search(self.vectors[:5], 10, params=params)
+
+            self.assertTrue((indices >= 0).all(), index_type)
+            self.assertFalse(np.isin(indices, self.deleted).any(), index_type)
+
+    def test_remove_ids_rebuilds_hnsw(self):
+        index = FaissIndexFactory.remove_ids(self._build(FaissIndexFactory.HNSW), self.deleted)
+
+        self.assertEqual(index.ntotal, len(self.ids) - len(self.deleted))
+        self.assertFalse(np.isin(FaissIndexFactory.get_ids(index), self.deleted).any())
+
+
+class OwnerPartitionTest(SimpleTestCase):
+    """用户分区测试"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((300, 16)).astype("float32")
+        faiss.normalize_L2(self.vectors)
+        self.ids = np.arange(300, dtype=np.int64) * 2 + 1
+        # 该用户只拥有其中一部分文档块
+        self.owned = np.sort(rng.choice(len(self.ids), 40, replace=False))
+
+    def test_exact_search_matches_selector_search(self):
+        partition = OwnerPartition(1, 0, self.ids[self.owned], self.vectors[self.owned])
+        index = FaissIndexFactory.build(FaissIndexFactory.FLAT, self.vectors, ids=self.ids)
+        params = FaissIndexFactory.build_search_params(index, selector=partition.id_filter.selector)
+
+        expected_distances, expected_indices = index.search(self.vectors[:3], 5, params=params)
+        distances, indices = partition.search_exact(self.vectors[:3], 5)
+
+        self.assertEqual(indices.tolist(), expected_indices.tolist())
+        np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+        self.assertTrue(np.isin(indices, self.ids[self.owned]).all())
+
+    def test_cache_evicts_least_recently_used(self):
+        partitions = [OwnerPartition(owner_id, 0, self.ids[:10], self.vectors[:10]) for owner_id in range(3)]
+        cache = OwnerPartitionCache(max_entries=10, max_bytes=partitions[0].nbytes * 2)
+
+        cache.put(partitions[0])
+        cache.put(partitions[1])
+        cache.get(0)
+        cache.put(partitions[2])
+
+        self.assertIsNone(cache.get(1))
+        self.assertIs(cache.get(0), partitions[0])
+        self.assertEqual(cache.nbytes, partitions[0].nbytes * 2)
+
+
+class ShardSearcherTest(SimpleTestCase):
+    """分片搜索测试"""
+
+    def test_sharded_search_matches_single_index(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((500, 16)).astype("float32")
+        faiss.normalize_L2(vectors)
+        ids = np.arange(500, dtype=np.int64) * 7 + 3
+        single = FaissIndexFactory.build(FaissIndexFactory.FLAT, vectors, ids=ids)
+        shards = [
+            FaissIndexFactory.build(FaissIndexFactory.FLAT, vectors[ids % 4 == shard], ids=ids[ids % 4 == shard])
+            for shard in range(4)
+        ]
+        searcher = ShardSearcher(4)
+        self.addCleanup(searcher.shutdown)
+
+        expected_distances, expected_indices = single.search(vectors[:5], 10)
+        distances, indices = ShardSearcher.merge_top_k(
+            searcher.map(lambda index: index.search(vectors[:5], 10), shards), 10
+        )
+
+        self.assertEqual(indices.tolist(), expected_indices.tolist())
+        np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+
+        # 线程池关闭后仍在进行的搜索在当前线程中依次完成
+        searcher.shutdown()
+        self.assertEqual(len(searcher.map(lambda index: index.search(vectors[:5], 10), shards)), 4)
+
+
+def make_segment_service(directory, num_shards=1):
+    """绕过单例初始化，构建只包含分段存储和写入路径的服务，不连接Redis和嵌入模型"""
+    service = object.__new__(VectorDBService)
+    service.vector_dim = 8
+    service.segment_store = VectorSegmentStore(directory)
+    service.snapshot = IndexSnapshot.empty()
+    service._snapshot_lock = threading.Lock()
+    service._write_lock = threading.RLock()
+    service.owner_partitions = OwnerPartitionCache(max_entries=1, max_bytes=1)
+    service.lexical_index = None
+    service._lexical_snapshot = IndexSnapshot.empty()
+    service._lexical_lock = threading.Lock()
+    service.raw_vector_store = None
+    service.use_mmap = False
+    service.index_type = FaissIndexFactory.FLAT
+    service.index_promote_threshold = 10**9
+    service.index_options = {}
+    service.num_shards = num_shards
+    service.segment_max_deltas = 3
+    service.segment_merge_ratio = 0.5
+    service._mark_index_updated_in_redis = lambda: True
+    service._schedule_merge = lambda: None
+    return service
+
+
+def make_delta(ids, dim=8):
+    """以ids为向量ID构建精确索引，向量由ID确定，便于校验合并结果"""
+    ids = np.asarray(ids, dtype=np.int64)
+    vectors = np.random.default_rng(0).standard_normal((int(ids.max()) + 1 if len(ids) else 0, dim))[ids]
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    faiss.normalize_L2(vectors)
+    return FaissIndexFactory.build(FaissIndexFactory.FLAT, vectors, ids=ids)
+
+
+class VectorSegmentStoreTest(SimpleTestCase):
+    """分段存储测试"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.store = VectorSegmentStore(self.directory)
+
+    def test_manifest_round_trip_and_atomic_replace(self):
+        self.assertFalse(self.store.exists())
+        manifest = self.store.add_delta(make_delta([1, 2]))
+
+        self.assertEqual(VectorSegmentStore(self.directory).read_manifest(), manifest)
+
+        # 写入新manifest的过程中失败时，原manifest保持不变且不留下临时文件
+        with mock.patch("documents.services.vector_segment_store.json.dump", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.store.add_delta(make_delta([3]))
+        self.assertEqual(self.store.read_manifest(), manifest)
+        self.assertFalse([name for name in os.listdir(self.directory) if ".tmp." in name])
+
+    def test_add_delta_and_tombstones(self):
+        first = self.store.add_delta(make_delta([1, 2]))
+        second = self.store.add_delta(make_delta([3]))
+
+        self.assertEqual([delta["ntotal"] for delta in second["deltas"]], [2, 1])
+        self.assertEqual(second["generation"], first["generation"] + 1)
+        self.assertTrue(all(os.path.exists(self.store.segment_path(name)) for name in self.store.segment_names(second)))
+
+        self.store.add_tombstones(np.array([1]))
+        manifest = self.store.add_tombstones(np.array([3]))
+        self.assertEqual(self.store.read_tombstones(manifest).tolist(), [1, 3])
+
+        # 上次写入墓碑后未登记到manifest的ID被丢弃
+        with open(self.store.segment_path(manifest["tombstones"]["name"]), "ab") as f:
+            np.array([99], dtype=np.int64).tofile(f)
+        manifest = self.store.add_tombstones(np.array([2]))
+        self.assertEqual(self.store.read_tombstones(manifest).tolist(), [1, 3, 2])
+
+    def test_replace_segments_keeps_newer_deltas_and_tombstones(self):
+        manifest = self.store.add_delta(make_delta([1, 2]))
+        self.store.add_tombstones(np.array([1]))
+        merged = self.store.segment_names(manifest)
+        old_tombstones = self.store.read_manifest()["tombstones"]["name"]
+        # 合并期间写入的增量段和墓碑
+        self.store.add_delta(make_delta([5]))
+        self.store.add_tombstones(np.array([5]))
+
+        manifest = self.store.replace_segments(merged, [make_delta([2])], as_base=True, applied_tombstones=1)
+
+        self.assertEqual([base["ntotal"] for base in manifest["base"]], [1])
+        self.assertEqual([delta["ntotal"] for delta in manifest["deltas"]], [1])
+        self.assertEqual(self.store.read_tombstones(manifest).tolist(), [5])
+        self.assertFalse(os.path.exists(self.store.segment_path(merged[0])))
+        self.assertFalse(os.path.exists(self.store.segment_path(old_tombstones)))
+
+        # 合并为增量段时排在剩余增量段之前，基础段不变
+        deltas = self.store.segment_names(manifest)[1:]
+        manifest = self.store.replace_segments(deltas, [make_delta([5])], as_base=False)
+        self.assertEqual(len(manifest["base"]), 1)
+        self.assertEqual([delta["ntotal"] for delta in manifest["deltas"]], [1])
+
+    def test_plan_merge_thresholds(self):
+        def plan(base, deltas, tombstones=0, num_shards=1):
+            manifest = dict(
+                VectorSegmentStore.empty_manifest(),
+                base=[{"name": f"b{i}", "ntotal": n} for i, n in enumerate(base)],
+                deltas=[{"name": f"d{i}", "ntotal": n} for i, n in enumerate(deltas)],
+                tombstones={"name": "t", "count": tombstones} if tombstones else None,
+            )
+            return VectorSegmentStore.plan_merge(manifest, max_deltas=4, merge_ratio=0.1, num_shards=num_shards)
+
+        self.assertIsNone(plan([1000], []))
+        self.assertIsNone(plan([1000], [10, 10, 10]))
+        self.assertEqual(plan([1000], [10, 10, 10, 10]), "minor")
+        self.assertEqual(plan([1000], [50, 50]), "major")
+        self.assertEqual(plan([1000], [], tombstones=100), "major")
+        self.assertIsNone(plan([1000], [], tombstones=99))
+        # 没有基础段时增量段数量达到上限才合并为基础段
+        self.assertIsNone(plan([], [10, 10, 10]))
+        self.assertEqual(plan([], [10, 10, 10, 10]), "major")
+        # 分片数变化时重新分片
+        self.assertEqual(plan([1000], [], num_shards=2), "major")
+
+
+class MergeSegmentsTest(SimpleTestCase):
+    """索引段合并测试"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.service = make_segment_service(tmp_dir.name, num_shards=2)
+
+    def _commit_base(self, count):
+        # 没有基础段时增量段数量达到上限才合并为基础段
+        for ids in np.array_split(np.arange(count), self.service.segment_max_deltas):
+            self.service.commit_delta(make_delta(ids))
+        self.assertTrue(self.service.merge_segments())
+
+    def test_minor_merge_keeps_base_and_tombstones(self):
+        self._commit_base(300)
+        base = self.service.manifest["base"]
+        for start in range(300, 330, 10):
+            self.service.commit_delta(make_delta(range(start, start + 10)))
+        self.service.delete_vectors([3, 304])
+
+        self.assertTrue(self.service.merge_segments())
+
+        manifest = self.service.manifest
+        self.assertEqual(manifest["base"], base)
+        self.assertEqual([delta["ntotal"] for delta in manifest["deltas"]], [29])
+        self.assertEqual(manifest["tombstones"]["count"], 2)
+        self.assertEqual(self.service.indexed_ids().tolist(), [i for i in range(330) if i not in (3, 304)])
+
+    def test_major_merge_keeps_live_ids_and_drops_tombstoned(self):
+        expected = make_delta(range(200))
+        self._commit_base(100)
+        self.service.commit_delta(make_delta(range(100, 200)))
+        deleted = list(range(0, 200, 7))
+        self.service.delete_vectors(deleted)
+
+        self.assertTrue(self.service.merge_segments())
+
+        manifest = self.service.manifest
+        self.assertEqual(len(manifest["base"]), 2)
+        self.assertEqual(manifest["deltas"], [])
+        self.assertEqual(self.service.segment_store.read_tombstones(manifest).tolist(), [])
+        live = [i for i in range(200) if i not in deleted]
+        self.assertEqual(self.service.indexed_ids().tolist(), live)
+        # 各分片只包含chunk_id % 分片数对应的向量，物理删除后不再包含墓碑中的ID
+        all_ids = []
+        for shard, (_, index) in enumerate(self.service.segments):
+            ids = FaissIndexFactory.get_ids(index)
+            self.assertTrue((ids % 2 == shard).all())
+            all_ids.extend(ids.tolist())
+        self.assertEqual(sorted(all_ids), live)
+
+        # 合并后的向量与原向量一致，重新加载后得到相同的段
+        reloaded = make_segment_service(self.service.segment_store.directory, num_shards=2)
+        self.assertTrue(reloaded._load_segments())
+        queries = np.stack([expected.index.reconstruct(i) for i in (1, 50, 199)])
+        _, indices = ShardSearcher.merge_top_k([index.search(queries, 1) for _, index in reloaded.segments], 1)
+        self.assertEqual(indices[:, 0].tolist(), [1, 50, 199])
+
+
+class IndexDocumentTest(SimpleTestCase):
+    """文档索引测试"""
+
+    def test_failed_batch_fails_whole_document(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        service = make_segment_service(tmp_dir.name)
+        service.raw_vector_store = mock.Mock()
+        service.index_batch_size = 2
+        service.embedding_service = mock.Mock()
+        service.embedding_service.get_embeddings.side_effect = [np.ones((2, 8)), EmbeddingError("invalid input")]
+        document = mock.Mock(id=1, status="processing")
+
+        with mock.patch("documents.services.vector_db_service.DocumentChunk") as chunk_model:
+            chunks = chunk_model.objects.filter.return_value
+            chunks.order_by.return_value.values_list.return_value = [(1, "a"), (2, "b"), (3, "c")]
+
+            self.assertFalse(service.index_document(document))
+
+        # 已成功的一批也不提交，文档块不记录向量ID，也不保存原始向量
+        self.assertEqual(service.manifest["deltas"], [])
+        chunks.update.assert_not_called()
+        service.raw_vector_store.append.assert_not_called()
+
+    def test_vector_ids_are_saved_before_commit(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        service = make_segment_service(tmp_dir.name)
+        service.index_batch_size = 2
+        service.embedding_service = mock.Mock()
+        service.embedding_service.get_embeddings.side_effect = [np.ones((2, 8)), np.ones((1, 8))]
+        service.clear_search_cache = lambda: None
+        service.raw_vector_store = mock.Mock()
+        document = mock.Mock(id=1, status="processing")
+
+        with mock.patch("documents.services.vector_db_service.DocumentChunk") as chunk_model:
+            chunks = chunk_model.objects.filter.return_value
+            chunks.order_by.return_value.values_list.return_value = [(1, "a"), (2, "b"), (3, "c")]
+            commit_delta = service.commit_delta
+            # 新段生效时文档块已记录向量ID，用户分区可以选取到
+            service.commit_delta = lambda *args: (chunks.update.assert_called_once(), commit_delta(*args))
+
+            self.assertTrue(service.index_document(document))
+
+        self.assertEqual(len(service.manifest["deltas"]), 1)
+        # 原始向量在提交后一次保存
+        service.raw_vector_store.append.assert_called_once()
+        self.assertEqual(service.raw_vector_store.append.call_args[0][0].tolist(), [1, 2, 3])
+
+
+class LexicalSyncTest(SimpleTestCase):
+    """词法索引按段同步测试"""
+
+    TEXTS = {i: f"文档块{i} 型号XK-{i}" for i in range(60)}
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = tmp_dir.name
+        self.service = self._make_service()
+
+    def _make_service(self):
+        service = make_segment_service(self.directory, num_shards=2)
+        service.lexical_index = LexicalIndex()
+        return service
+
+    def _commit(self, ids):
+        ids = list(ids)
+        self.service.commit_delta(make_delta(ids), LexicalIndex.encode(ids, [self.TEXTS[i] for i in ids]))
+
+    def _top_hit(self, service, chunk_id):
+        return service.lexical_index.search(f"XK-{chunk_id}", 1, service.snapshot.tombstones)[0][0]
+
+    def test_terms_are_loaded_from_segments_without_database(self):
+        for start in range(0, 30, 10):
+            self._commit(range(start, start + 10))
+        self.service.delete_vectors([5])
+        self.assertTrue(self.service.merge_segments())
+        self._commit(range(30, 40))
+        self.service.delete_vectors([31])
+
+        # 合并后的基础段和新的增量段都带有词频数据，重新加载时不读取数据库
+        with mock.patch("documents.services.vector_db_service.DocumentChunk") as chunk_model:
+            reloaded = self._make_service()
+            self.assertTrue(reloaded._load_segments())
+        chunk_model.objects.filter.assert_not_called()
+
+        self.assertEqual(len(reloaded.lexical_index), 38)
+        self.assertEqual(self._top_hit(reloaded, 12), 12)
+        self.assertEqual(self._top_hit(reloaded, 35), 35)
+        self.assertEqual(reloaded.lexical_index.missing([5, 12, 31]), [5, 31])
+
+    def test_segments_without_terms_fall_back_to_database(self):
+        rows = [(1, self.TEXTS[1]), (2, self.TEXTS[2])]
+
+        with mock.patch("documents.services.vector_db_service.DocumentChunk") as chunk_model:
+            chunk_model.objects.filter.return_value.values_list.return_value = rows
+            self.service.commit_delta(make_delta([1, 2]))
+            reloaded = self._make_service()
+            self.assertTrue(reloaded._load_segments())
+
+        self.assertEqual(len(reloaded.lexical_index), 2)
+        self.assertEqual(self._top_hit(reloaded, 2), 2)
+
+    def test_select_encoded_regroups_terms(self):
+        first = LexicalIndex.encode([1, 2], [self.TEXTS[1], "旧内容"])
+        second = LexicalIndex.encode([2, 3], [self.TEXTS[2], self.TEXTS[3]])
+
+        groups = LexicalIndex.select_encoded([first, second], [np.array([1, 3]), np.array([2])])
+
+        index = LexicalIndex()
+        self.assertEqual(index.add_encoded(groups[0])[1].tolist(), [1, 3])
+        # 同一文档块保留最后出现的词频
+        self.assertEqual(index.add_encoded(groups[1])[1].tolist(), [2])
+        self.assertEqual(index.search("XK-2", 1)[0][0], 2)
+        self.assertEqual(index.search("旧内容", 1), [])
+
+
+class ConcurrentWriteTest(SimpleTestCase):
+    """并发写入测试"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.service = make_segment_service(tmp_dir.name)
+
+    def test_concurrent_commits_publish_every_vector_without_duplicate_tombstones(self):
+        num_threads, deltas_per_thread, delta_size = 8, 5, 20
+        deleted = np.arange(0, num_threads * deltas_per_thread * delta_size, 9)
+        barrier = threading.Barrier(num_threads * 2)
+        errors = []
+
+        def writer(slot):
+            try:
+                barrier.wait()
+                for i in range(deltas_per_thread):
+                    start = (slot * deltas_per_thread + i) * delta_size
+                    self.service.commit_delta(make_delta(range(start, start + delta_size)))
+            except Exception as e:
+                errors.append(e)
+
+        def deleter():
+            try:
+                barrier.wait()
+                # 所有线程删除同一批ID，只有第一次删除写入墓碑
+                for ids in np.array_split(deleted, deltas_per_thread):
+                    self.service.delete_vectors(ids.tolist())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(slot,)) for slot in range(num_threads)]
+        threads += [threading.Thread(target=deleter) for _ in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        manifest = self.service.segment_store.read_manifest()
+        self.assertEqual(self.service.manifest["generation"], manifest["generation"])
+        self.assertEqual(len(manifest["deltas"]), num_threads * deltas_per_thread)
+        tombstones = self.service.segment_store.read_tombstones(manifest)
+        self.assertEqual(sorted(tombstones.tolist()), deleted.tolist())
+
+        all_ids = np.arange(num_threads * deltas_per_thread * delta_size)
+        live = all_ids[~np.isin(all_ids, deleted)]
+        self.assertEqual(self.service.indexed_ids().tolist(), live.tolist())
+        self.assertEqual(self.service.ntotal, len(all_ids))
+
+
+class IndexSnapshotTest(SimpleTestCase):
+    """索引快照测试"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.store = VectorSegmentStore(tmp_dir.name)
+
+        # 绕过单例初始化，只保留发布快照所需的属性
+        self.service = object.__new__(VectorDBService)
+        self.service.snapshot = IndexSnapshot.empty()
+        self.service._snapshot_lock = threading.Lock()
+        self.service.owner_partitions = OwnerPartitionCache(max_entries=1, max_bytes=1)
+
+    def _add_delta(self, ids):
+        vectors = np.eye(8, dtype="float32")[: len(ids)]
+        return self.store.add_delta(FaissIndexFactory.build(FaissIndexFactory.FLAT, vectors, ids=np.array(ids)))
+
+    def test_load_reuses_segments_of_previous_snapshot(self):
+        first = IndexSnapshot.load(self.store, self._add_delta([1, 2]))
+        second = IndexSnapshot.load(self.store, self._add_delta([3]), previous=first)
+
+        self.assertIs(second.segments[0][1], first.segments[0][1])
+        self.assertEqual(second.ntotal, 3)
+
+    def test_stale_snapshot_is_not_published(self):
+        stale = IndexSnapshot.load(self.store, self._add_delta([1]))
+        fresh = IndexSnapshot.load(self.store, self._add_delta([2]), previous=stale)
+
+        self.assertTrue(self.service._publish_snapshot(fresh))
+        self.assertFalse(self.service._publish_snapshot(stale))
+        self.assertIs(self.service.snapshot, fresh)
+
+
+class ReloadNotificationTest(SimpleTestCase):
+    """索引更新通知合并测试"""
+
+    def setUp(self):
+        self.service = object.__new__(VectorDBService)
+        self.service.snapshot = IndexSnapshot(dict(VectorSegmentStore.empty_manifest(), generation=5), [], None)
+        self.service._pid = os.getpid()
+        self.service.reload_debounce = 60
+        self.service.reload_max_delay = 120
+        self.service._latest_notified = (None, 0)
+        self.service._pending_notifications = 0
+        self.service._pending_since = None
+        self.service._last_notified_at = None
+        self.service.reload_index = mock.Mock(return_value=True)
+
+    def _notify(self, generation, index_id=None):
+        index_id = index_id or self.service.snapshot.manifest["index_id"]
+        self.service._handle_update_notification(
+            pickle.dumps({"source_pid": -1, "index_id": index_id, "generation": generation})
+        )
+
+    def test_loaded_generations_are_skipped(self):
+        self._notify(4)
+        self._notify(5)
+
+        self.assertEqual(self.service.get_reload_lag()["pending_notifications"], 0)
+
+    def test_burst_is_coalesced_into_one_reload(self):
+        for generation in range(6, 11):
+            self._notify(generation)
+
+        # 仍在合并窗口内，不重新加载
+        self.assertFalse(self.service._maybe_reload())
+        lag = self.service.get_reload_lag()
+        self.assertEqual(lag["generations_behind"], 5)
+        self.assertEqual(lag["pending_notifications"], 5)
+
+        self.service.reload_debounce = 0
+        self.assertTrue(self.service._maybe_reload())
+        self.service.reload_index.assert_called_once()
+        self.assertFalse(self.service._maybe_reload())
+
+
+class SemanticQueryCacheTest(SimpleTestCase):
+    """语义查询缓存测试"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((3, 16)).astype("float32")
+        faiss.normalize_L2(self.vectors)
+        self.cache = SemanticQueryCache(16, threshold=0.95, max_entries=2)
+        self.cache.get_many(self.vectors[:1], "user-1", 1)
+        self.cache.put_many(self.vectors[:1], "user-1", 1, [[{"chunk_id": 1}]])
+
+    def _paraphrase(self):
+        vector = self.vectors[:1] + 0.05 * self.vectors[1:2]
+        faiss.normalize_L2(vector)
+        return vector
+
+    def test_similar_query_hits_within_scope(self):
+        self.assertEqual(self.cache.get_many(self._paraphrase(), "user-1", 1), [[{"chunk_id": 1}]])
+        self.assertEqual(self.cache.get_many(self._paraphrase(), "user-2", 1), [None])
+        self.assertEqual(self.cache.get_many(self.vectors[1:2], "user-1", 1), [None])
+        self.assertAlmostEqual(self.cache.stats()["hit_ratio"], 1 / 4)
+
+    def test_generation_change_invalidates(self):
+        self.assertEqual(self.cache.get_many(self._paraphrase(), "user-1", 2), [None])
+        self.assertEqual(len(self.cache), 0)
+
+        # 旧代数的搜索结果不再缓存
+        self.cache.put_many(self.vectors[:1], "user-1", 1, [[{"chunk_id": 1}]])
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_query_is_evicted(self):
+        self.cache.put_many(self.vectors[1:], "user-1", 1, [[{"chunk_id": 2}], [{"chunk_id": 3}]])
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get_many(self.vectors[:1], "user-1", 1), [None])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class NamespaceCacheTest(SimpleTestCase):
+    """命名空间版本缓存失效测试"""
+
+    def test_invalidate_namespace_skips_old_keys(self):
+        calls = []
+
+        @cached(prefix="namespace_test", namespace="namespace_test")
+        def compute(value):
+            calls.append(value)
+            return value * 2
+
+        self.assertEqual(compute(1), 2)
+        self.assertEqual(compute(1), 2)
+        self.assertEqual(len(calls), 1)
+
+        version = RedisCache.get_namespace_version("namespace_test")
+        self.assertEqual(RedisCache.invalidate_namespace("namespace_test"), version + 1)
+        self.assertEqual(compute(1), 2)
+        self.assertEqual(len(calls), 2)
+
+
+class LexicalIndexTest(SimpleTestCase):
+    """BM25词法索引测试"""
+
+    def setUp(self):
+        self.index = LexicalIndex()
+        self.index.add([1, 2, 3], ["型号XK-2000的安装说明", "手机电池的使用说明", "关于XK-3000的常见问题"])
+
+    def test_tokenize_splits_cjk_into_bigrams(self):
+        self.assertEqual(LexicalIndex.tokenize("型号ＸＫ-2000说明"), ["型号", "xk", "2000", "说明"])
+
+    def test_exact_terms_rank_first(self):
+        hits = self.index.search("XK-2000 说明", 3)
+
+        self.assertEqual([chunk_id for chunk_id, _ in hits][0], 1)
+        self.assertEqual(len(hits), 3)
+
+    def test_removed_and_filtered_chunks_are_excluded(self):
+        self.index.remove([1])
+
+        self.assertEqual(len(self.index), 2)
+        self.assertNotIn(1, [chunk_id for chunk_id, _ in self.index.search("XK-2000", 3)])
+        self.assertEqual(self.index.search("说明", 3, id_filter=TombstoneFilter(np.array([2]))), [])
+
+
+class ResultDiversifierTest(SimpleTestCase):
+    """检索结果去冗余测试"""
+
+    def test_adjacent_chunks_are_merged_without_overlap(self):
+        text = "第一段介绍安装步骤。第二段说明接线方法。第三段列出常见故障和处理办法。"
+        results = [
+            {"id": 1, "title": "手册", "content": text[10:], "score": 0.9, "chunk_id": 11, "chunk_index": 1},
+            {"id": 2, "title": "其他", "content": "无关内容", "score": 0.8, "chunk_id": 20, "chunk_index": 0},
+            {"id": 1, "title": "手册", "content": text[:20], "score": 0.7, "chunk_id": 10, "chunk_index": 0},
+        ]
+
+        merged = merge_adjacent_chunks(results)
+
+        self.assertEqual([result["chunk_ids"] for result in merged], [[10, 11], [20]])
+        self.assertEqual(merged[0]["content"], text)
+        self.assertEqual(merged[0]["score"], 0.9)
+
+    def test_merged_chunks_keep_ranking_scores(self):
+        results = [
+            {"id": 1, "content": "乙", "score": 0.5, "fused_score": 0.03, "chunk_id": 11, "chunk_index": 1},
+            {"id": 1, "content": "甲", "score": 0.8, "chunk_id": 10, "chunk_index": 0},
+        ]
+
+        merged = merge_adjacent_chunks(results)
+
+        self.assertEqual(merged[0]["score"], 0.8)
+        self.assertEqual(merged[0]["fused_score"], 0.03)
+        self.assertEqual(ranking_score(merged[0]), 0.03)
+        self.assertEqual(ranking_score({**merged[0], "rerank_score": 2.0}), 2.0)
+
+    def test_mmr_skips_near_duplicates(self):
+        vectors = np.array([[1, 0], [0.99, 0.141], [0, 1]], dtype=np.float32)
+
+        self.assertEqual(mmr_select(np.array([0.9, 0.85, 0.6]), vectors, 2, lambda_=0.5), [0, 2])
+        self.assertEqual(mmr_select(np.array([0.9, 0.85, 0.6]), vectors, 2, lambda_=1.0), [0, 1])
+        # 合并的结果按文档块数占用名额
+        self.assertEqual(mmr_select(np.array([0.9, 0.85, 0.6]), vectors, 2, lambda_=1.0, costs=[1, 2, 1]), [0, 2])
+
+
+class InstanceRegistryTest(SimpleTestCase):
+    """实例注册表按内存预算淘汰测试"""
+
+    def test_evicts_least_recently_used_idle_instances_over_budget(self):
+        closed = []
+        registry = InstanceRegistry(
+            max_bytes=250, idle_seconds=0, memory_of=lambda instance: instance["bytes"], on_evict=closed.append
+        )
+        registry.pin("default")
+        for key in ("default", "old", "recent"):
+            registry.put(key, {"key": key, "bytes": 100})
+        registry.get("default")
+
+        self.assertEqual(registry.maybe_evict(force=True), ["old"])
+        self.assertEqual([instance["key"] for instance in closed], ["old"])
+        self.assertEqual([item["key"] for item in registry.resident()], ["recent", "default"])
+        self.assertIsNone(registry.get("old"))
+
+    def test_busy_and_pinned_instances_are_kept(self):
+        registry = InstanceRegistry(max_bytes=1, idle_seconds=60, memory_of=lambda instance: 100)
+        registry.put("busy", object())
+        registry.put("default", object())
+        registry.pin("default")
+
+        self.assertEqual(registry.maybe_evict(force=True), [])
+        self.assertEqual(len(registry), 2)
+
+
+@override_settings(VECTOR_INSTANCE_MEMORY_BUDGET_MB=0)
+class VectorDBServiceInstanceTest(SimpleTestCase):
+    """按模型版本获取服务实例测试"""
+
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(VectorDBService, "_instances", None),
+            mock.patch("documents.services.vector_db_service.get_active_model_version", return_value="default"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_loading_one_version_does_not_block_others(self):
+        loading, release = threading.Event(), threading.Event()
+        init_calls = []
+
+        def fake_init(instance, version):
+            init_calls.append(version)
+            instance.embedding_model_version = version
+            if version == "slow":
+                loading.set()
+                release.wait(5)
+
+        with mock.patch.object(VectorDBService, "_init", fake_init):
+            slow = [threading.Thread(target=VectorDBService.get_instance, args=("slow",)) for _ in range(2)]
+            slow[0].start()
+            self.assertTrue(loading.wait(5))
+            slow[1].start()
+
+            # 其他版本的实例在slow加载期间即可获取
+            fast = threading.Thread(target=VectorDBService.get_instance, args=("fast",))
+            fast.start()
+            fast.join(2)
+            self.assertFalse(fast.is_alive())
+            release.set()
+            for thread in slow:
+                thread.join(5)
+
+        self.assertEqual(sorted(init_calls), ["fast", "slow"])
+
+    def test_close_stops_shard_searcher_and_counts_embedding_model(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        service = make_segment_service(tmp_dir.name)
+        service.query_cache = None
+        service.embedding_service = mock.Mock(nbytes=1000)
+        service.embedding_model_version = "default"
+        service._stop_subscriber = threading.Event()
+        service.shard_searcher = mock.Mock()
+
+        self.assertEqual(service.memory_usage()["embedding_model"], 1000)
+        service.close()
+
+        service.shard_searcher.shutdown.assert_called_once_with()
+        self.assertTrue(service._stop_subscriber.is_set())
+
+
+class ModelStorageTest(SimpleTestCase):
+    """按模型版本划分的索引目录和当前检索模型版本测试"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(VECTOR_STORE_PATH=self.tmp_dir.name, EMBEDDING_MODEL_VERSION="default")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_storage_names_are_distinct_and_path_safe(self):
+        names = {storage_name(version) for version in ("BAAI/bge-m3", "BAAI_bge-m3", "text-embedding-v4")}
+        self.assertEqual(len(names), 3)
+        self.assertIn("text-embedding-v4", names)
+        self.assertTrue(all("/" not in name for name in names))
+
+    def test_switch_active_model(self):
+        self.assertEqual(get_active_model()["embedding_model_version"], "default")
+
+        set_active_model_version("BAAI/bge-m3", "default")
+        active = get_active_model()
+        self.assertEqual(active["embedding_model_version"], "BAAI/bge-m3")
+        self.assertEqual(active["previous_version"], "default")
+
+    def test_adopt_root_storage_moves_legacy_index_once(self):
+        for name in ("manifest.json", "raw_vectors.f32"):
+            with open(os.path.join(self.tmp_dir.name, name), "w") as f:
+                f.write("{}")
+
+        self.assertTrue(adopt_root_storage("default"))
+        target = model_storage_path("default")
+        self.assertTrue(os.path.exists(os.path.join(target, "manifest.json")))
+        self.assertTrue(os.path.exists(os.path.join(target, "raw_vectors.f32")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, "manifest.json")))
+        self.assertFalse(adopt_root_storage("default"))
+
+
+class OwnerPartitionMigrationTest(TestCase):
+    """迁移切换后的用户分区测试"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(VECTOR_STORE_PATH=self.tmp_dir.name, EMBEDDING_MODEL_VERSION="default")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.service = make_segment_service(os.path.join(self.tmp_dir.name, "segments"))
+        self.service.embedding_model_version = "BAAI/bge-m3"
+        self.service.owner_exact_search_max_chunks = 100
+        self.service.owner_partitions = OwnerPartitionCache(max_entries=10, max_bytes=10**6)
+
+        # 切换前由旧版本写入的文档，文档记录的模型版本尚未更新
+        document = Document.objects.create(
+            title="迁移前文档", file_type="txt", owner_id=1, status="processed", embedding_model_version="default"
+        )
+        self.chunk_ids = [
+            DocumentChunk.objects.create(
+                document_id=document.id,
+                content=f"块{i}",
+                chunk_index=i,
+                embedding_model_version="default",
+                vector_id=str(i),
+            ).id
+            for i in range(3)
+        ]
+
+    def test_owner_partition_includes_previous_version_after_switch(self):
+        set_active_model_version("BAAI/bge-m3", "default")
+
+        partition = self.service._get_owner_partition(1, {"generation": 1}, TombstoneFilter())
+
+        self.assertEqual(partition.chunk_ids.tolist(), sorted(self.chunk_ids))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    DASHSCOPE_API_KEY="test-key",
+    EMBEDDING_MODEL_DIMENSIONS=4,
+    EMBEDDING_API_BATCH_SIZE=3,
+    EMBEDDING_API_BATCH_MAX_TOKENS=10,
+    EMBEDDING_CACHE_ENABLED=True,
+)
+class EmbeddingServiceBatchTest(SimpleTestCase):
+    """批量获取嵌入向量测试"""
+
+    def setUp(self):
+        self.service = EmbeddingService(embedding_model_version="batch-test")
+        self.requests = []
+
+        def fake_api(texts, priority=None):
+            self.requests.append(list(texts))
+            return np.array([[len(text), 0, 0, 0] for text in texts], dtype=np.float32)
+
+        self.service._get_embeddings_from_api = fake_api
+
+    def test_batches_respect_item_and_token_limits(self):
+        texts = ["a", "bb", "ccc", "dddd", "测试文本测试文本", "e"]
+        embeddings = self.service.get_embeddings(texts)
+
+        self.assertEqual(embeddings.dtype, np.float32)
+        self.assertEqual(embeddings[:, 0].tolist(), [len(text) for text in texts])
+        for batch in self.requests:
+            self.assertLessEqual(len(batch), 3)
+            self.assertLessEqual(sum(estimate_tokens(text) for text in batch), 10)
+        self.assertEqual(sum(len(batch) for batch in self.requests), len(texts))
+
+    @override_settings(EMBEDDING_API_CONCURRENCY=4, EMBEDDING_API_BATCH_SIZE=1)
+    def test_concurrent_requests_keep_input_order(self):
+        service = EmbeddingService(embedding_model_version="batch-test-concurrent")
+        threads = set()
+
+        def slow_api(texts, priority=None):
+            threads.add(threading.get_ident())
+            time.sleep(0.01 * (5 - len(texts[0])))
+            return np.array([[len(text), 0, 0, 0] for text in texts], dtype=np.float32)
+
+        service._get_embeddings_from_api = slow_api
+        embeddings = service.get_embeddings(["a", "bb", "ccc", "dddd"])
+
+        self.assertEqual(embeddings[:, 0].tolist(), [1, 2, 3, 4])
+        self.assertGreater(len(threads), 1)
+
+    def test_cache_hits_and_duplicates_are_not_requested(self):
+        self.service.get_embeddings(["a", "bb"])
+        self.requests.clear()
+
+        embeddings = self.service.get_embeddings(["bb", "new", "new", "a"])
+        self.assertEqual(self.requests, [["new"]])
+        self.assertEqual(embeddings[:, 0].tolist(), [2, 3, 3, 1])
+
+    def test_non_retryable_errors_are_raised_and_not_cached(self):
+        service = EmbeddingService(embedding_model_version="batch-test-error")
+        service.api_key = "test-key"
+        service.client = mock.Mock()
+        service.client.embeddings.create.side_effect = ValueError("invalid input")
+        service.rate_limiter = mock.MagicMock()
+
+        with self.assertRaises(EmbeddingError):
+            service.get_embeddings(["bad"])
+        with self.assertRaises(EmbeddingError):
+            service.get_embedding("bad")
+        self.assertEqual(service.client.embeddings.create.call_count, 2)
+        self.assertEqual(service._get_cached_embeddings(["bad"]), {})
+        self.assertIsNone(service._get_cached_embedding("bad"))
+
+
+class RateLimiterTest(SimpleTestCase):
+    """令牌桶和并发请求数限制测试"""
+
+    def test_token_bucket_reserves_in_order(self):
+        bucket = TokenBucket(rate_per_minute=600, capacity=2)
+
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.02)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, delta=0.02)
+        self.assertEqual(TokenBucket(rate_per_minute=0).reserve(1000), 0.0)
+
+    def test_in_flight_requests_are_limited(self):
+        limiter = RateLimiter(max_in_flight=2)
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def request():
+            with limiter.limit():
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+
+        workers = [threading.Thread(target=request) for _ in range(6)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(peak[0], 2)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_global_bucket_falls_back_when_redis_is_unavailable(self):
+        bucket = GlobalTokenBucket("rate-limiter-test", requests_per_minute=60)
+
+        self.assertTrue(bucket.acquire(priority=GlobalTokenBucket.PRIORITY_BULK, timeout=0))
+        self.assertGreater(bucket._redis_retry_at, 0)
+
+
+class LocalEmbeddingBatchTest(SimpleTestCase):
+    """本地嵌入模型按长度分批编码测试"""
+
+    def test_buckets_respect_size_and_padded_token_limits(self):
+        lengths = np.array([5, 100, 7, 6, 400, 90, 8])
+        batches = plan_length_buckets(lengths, max_batch_size=3, max_batch_tokens=300)
+
+        self.assertEqual(sorted(np.concatenate(batches).tolist()), list(range(len(lengths))))
+        for batch in batches:
+            self.assertLessEqual(len(batch), 3)
+            self.assertTrue(len(batch) == 1 or len(batch) * lengths[batch].max() <= 300)
+        self.assertEqual([lengths[batch].tolist() for batch in batches], [[5, 6, 7], [8, 90, 100], [400]])
+
+    def test_embeddings_keep_input_order(self):
+        class FakeModel:
+            max_seq_length = 512
+            calls = []
+
+            def encode(self, texts, batch_size, **kwargs):
+                self.calls.append(list(texts))
+                return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+        service = LocalEmbeddingService(embedding_model_version="fake-local-model")
+        service.model = FakeModel()
+        service.vector_dim = 2
+        service.batch_size = 2
+
+        texts = ["ccc", "a", "dddd", "bb", "eeeee"]
+        embeddings = service.get_embeddings(texts)
+
+        self.assertEqual(embeddings[:, 0].tolist(), [3, 1, 4, 2, 5])
+        self.assertEqual(service.model.calls, [["a", "bb"], ["ccc", "dddd"], ["eeeee"]])
+
+    @override_settings(LOCAL_EMBEDDING_MICRO_BATCH_TIMEOUT=0.05)
+    def test_stuck_micro_batcher_falls_back_to_direct_encoding(self):
+        class FakeModel:
+            max_seq_length = 512
+
+            def encode(self, texts, batch_size, **kwargs):
+                return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+        service = LocalEmbeddingService(embedding_model_version="fake-local-model")
+        service.model = FakeModel()
+        service.vector_dim = 2
+        # 后台线程不处理请求
+        service.micro_batcher._ensure_worker = lambda: None
+
+        self.assertEqual(service.get_embedding("abc").tolist(), [3, 1])
+        embeddings = service.get_embeddings(["a", "bb"], priority=GlobalTokenBucket.PRIORITY_INTERACTIVE)
+        self.assertEqual(embeddings[:, 0].tolist(), [1, 2])
+
+    def test_errors_raise_instead_of_random_vectors(self):
+        class FailingModel:
+            max_seq_length = 512
+
+            def encode(self, texts, batch_size=None, **kwargs):
+                raise RuntimeError("out of memory")
+
+        service = LocalEmbeddingService(embedding_model_version="fake-local-model")
+        service.micro_batcher = None
+        service.model = None
+        with self.assertRaises(EmbeddingError):
+            service.get_embeddings(["a"])
+
+        service.model = FailingModel()
+        with self.assertRaises(EmbeddingError):
+            service.get_embedding("a")
+        with self.assertRaises(EmbeddingError):
+            service.get_embeddings(["a", "bb"])
+
+
+class MicroBatcherTest(SimpleTestCase):
+    """并发请求微批处理测试"""
+
+    def test_concurrent_requests_share_batches(self):
+        sizes = []
+
+        def process(items):
+            sizes.append(len(items))
+            time.sleep(0.01)
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(process, max_batch_size=8, max_wait_ms=20)
+        self.addCleanup(batcher.close)
+        results = {}
+
+        def request(value):
+            results[value] = batcher.submit(value).result(timeout=5)
+
+        workers = [threading.Thread(target=request, args=(value,)) for value in range(16)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(results, {value: value * 2 for value in range(16)})
+        self.assertEqual(sum(sizes), 16)
+        self.assertLess(len(sizes), 16)
+        self.assertLessEqual(max(sizes), 8)
+
+    def test_errors_are_delivered_to_every_request(self):
+        def process(items):
+            raise RuntimeError("encode failed")
+
+        batcher = MicroBatcher(process, max_batch_size=4, max_wait_ms=1)
+        self.addCleanup(batcher.close)
+
+        with self.assertRaises(RuntimeError):
+            batcher.submit("query").result(timeout=5)
+
+    def test_worker_restarts_after_exit_and_fork(self):
+        batcher = MicroBatcher(lambda items: [item * 2 for item in items], max_batch_size=4, max_wait_ms=1)
+        self.addCleanup(batcher.close)
+        self.assertEqual(batcher.submit(1).result(timeout=5), 2)
+
+        # 后台线程意外退出
+        first = batcher._worker
+        batcher._queue.put(None)
+        first.join(5)
+        self.assertEqual(batcher.submit(2).result(timeout=5), 4)
+        self.assertIsNot(batcher._worker, first)
+
+        # fork出的子进程中父进程的线程和队列不可用
+        second, old_queue = batcher._worker, batcher._queue
+        with mock.patch("documents.services.micro_batcher.os.getpid", return_value=os.getpid() + 1):
+            self.assertEqual(batcher.submit(3).result(timeout=5), 6)
+        self.assertIsNot(batcher._worker, second)
+        self.assertIsNot(batcher._queue, old_queue)
@@ -2,17 +2,40 @@ import time
 from typing import List, Dict, Any
 
 from qa.controllers import router
-from qa.schemas.retrieval import RetrievalIn, RetrievalResultOut, DocumentSearchResultOut
+from qa.schemas.retrieval import (
+    RetrievalIn,
+    RetrievalResultOut,
+    DocumentSearchResultOut,
+    BatchRetrievalIn,
+    BatchRetrievalResultOut,
+)
 from qa.services.rag_service import RAGService
 from documents.services.vector_db_service import VectorDBService
 
 
+def _format_results(search_results: List[Dict[str, Any]]) -> List[DocumentSearchResultOut]:
+    """将检索结果转换为输出Schema"""
+    return [
+        DocumentSearchResultOut(
+            id=result["id"],
+            title=result["title"],
+            content=result["content"],
+            score=result["score"],
+            chunk_index=result["chunk_index"],
+            embedding_model_version=result.get("embedding_model_version", None),
+        )
+        for result in search_results
+    ]
+
+
 @router.post("/retrieve", response=RetrievalResultOut, summary="检索相关文档")
 def retrieve_documents(request, data: RetrievalIn):
     """
     基于查询文本检索相关文档
 
-    使用向量数据库搜索与查询语义相关的文档。可以指定返回的结果数量和使用的嵌入模型版本。
+    使用向量数据库搜索与查询语义相关的文档。可以指定返回的结果数量和使用的嵌入模型版本，
+    使用近似索引时还可以通过nprobe(IVF)和ef_search(HNSW)调整本次搜索的速度与召回率。
+    只检索当前用户自己的文档。
     """
     # 记录开始时间
     start_time = time.time()
@@ -21,23 +44,19 @@ def retrieve_documents(request, data: RetrievalIn):
     rag_service = RAGService(embedding_model_version=data.embedding_model_version)
 
     # 执行搜索
-    search_results = rag_service.retrieve_relevant_documents(query=data.query, top_k=data.top_k)
+    search_results = rag_service.retrieve_relevant_documents(
+        query=data.query,
+        top_k=data.top_k,
+        nprobe=data.nprobe,
+        ef_search=data.ef_search,
+        owner_id=request.auth.id,
+    )
 
     # 计算搜索时间
     search_time = time.time() - start_time
 
     # 格式化结果
-    formatted_results = [
-        DocumentSearchResultOut(
-            id=result["id"],
-            title=result["title"],
-            content=result["content"],
-            score=result["score"],
-            chunk_index=result["chunk_index"],
-            embedding_model_version=result.get("embedding_model_version", None),
-        )
-        for result in search_results
-    ]
+    formatted_results = _format_results(search_results)
 
     # 返回结果
     return {
@@ -46,3 +65,38 @@ def retrieve_documents(request, data: RetrievalIn):
         "query": data.query,
         "search_time": round(search_time, 3),
     }
+
+
+@router.post("/retrieve/batch", response=BatchRetrievalResultOut, summary="批量检索相关文档")
+def retrieve_documents_batch(request, data: BatchRetrievalIn):
+    """
+    批量检索多个查询的相关文档
+
+    适用于评估任务和离线处理等大批量查询场景：查询向量批量获取，
+    全部查询在一次向量搜索和一次数据库加载中完成。只检索当前用户自己的文档。
+    """
+    # 记录开始时间
+    start_time = time.time()
+
+    rag_service = RAGService(embedding_model_version=data.embedding_model_version)
+    batch_results = rag_service.retrieve_relevant_documents_batch(
+        queries=data.queries,
+        top_k=data.top_k,
+        nprobe=data.nprobe,
+        ef_search=data.ef_search,
+        owner_id=request.auth.id,
+    )
+
+    # 计算搜索时间
+    search_time = time.time() - start_time
+
+    items = []
+    for query, search_results in zip(data.queries, batch_results):
+        formatted_results = _format_results(search_results)
+        items.append({"query": query, "results": formatted_results, "total": len(formatted_results)})
+
+    return {
+        "items": items,
+        "total": len(items),
+        "search_time": round(search_time, 3),
+    }
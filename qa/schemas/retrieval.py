@@ -1,6 +1,12 @@
+from django.conf import settings
 from ninja import Schema
+from pydantic import Field
 from typing import List, Optional, Dict, Any
 
+# 按请求覆盖的搜索参数上限
+MAX_NPROBE = getattr(settings, "VECTOR_SEARCH_MAX_NPROBE", 1024)
+MAX_EF_SEARCH = getattr(settings, "VECTOR_SEARCH_MAX_EF_SEARCH", 1024)
+
 
 class RetrievalIn(Schema):
     """检索请求的输入Schema"""
@@ -8,6 +14,18 @@ class RetrievalIn(Schema):
     query: str  # 查询文本
     top_k: int = 5  # 返回结果数量，默认5条
     embedding_model_version: Optional[str] = None  # 嵌入模型版本，可选
+    nprobe: Optional[int] = Field(None, ge=1, le=MAX_NPROBE)  # IVF索引搜索的聚类数量，可选
+    ef_search: Optional[int] = Field(None, ge=1, le=MAX_EF_SEARCH)  # HNSW索引搜索的候选队列长度，可选
+
+
+class BatchRetrievalIn(Schema):
+    """批量检索请求的输入Schema"""
+
+    queries: List[str] = Field(..., min_length=1, max_length=1000)  # 查询文本列表，单次最多1000条
+    top_k: int = 5  # 每个查询返回结果数量，默认5条
+    embedding_model_version: Optional[str] = None  # 嵌入模型版本，可选
+    nprobe: Optional[int] = Field(None, ge=1, le=MAX_NPROBE)  # IVF索引搜索的聚类数量，可选
+    ef_search: Optional[int] = Field(None, ge=1, le=MAX_EF_SEARCH)  # HNSW索引搜索的候选队列长度，可选
 
 
 class DocumentChunkOut(Schema):
@@ -37,3 +55,19 @@ class RetrievalResultOut(Schema):
     total: int
     query: str
     search_time: float  # 搜索耗时（秒）
+
+
+class QueryResultOut(Schema):
+    """批量检索中单个查询的结果Schema"""
+
+    query: str
+    results: List[DocumentSearchResultOut]
+    total: int
+
+
+class BatchRetrievalResultOut(Schema):
+    """批量检索结果输出Schema"""
+
+    items: List[QueryResultOut]  # 与请求中queries顺序一致
+    total: int  # 查询数量
+    search_time: float  # 搜索总耗时（秒）
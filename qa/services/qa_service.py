@@ -13,6 +13,9 @@ from langchain.memory import (
 from langchain.schema import AIMessage, HumanMessage
 from loguru import logger
 
+from common.utils.cache_utils import RedisCache
+from documents.services.vector_db_service import VectorDBService
+
 from ..models import Conversation, Message, MessageDocumentReference
 from ..schemas.conversation import MemoryInfoOut, QueryResponseOut
 from .llm_service import LLMService
@@ -43,32 +46,39 @@ class QAService:
 
         logger.info(f"初始化QAService, 检索缓存: {'启用' if self.enable_retrieval_cache else '禁用'}")
 
-    def _get_retrieval_cache_key(self, query: str) -> str:
-        """生成检索缓存键"""
-        content = f"retrieval:{query}:{self.embedding_model_version}"
+    def _get_retrieval_cache_key(self, query: str, owner_id: int) -> str:
+        """生成检索缓存键，检索只在用户自己的文档中进行，缓存也按用户区分"""
+        # 包含向量搜索缓存的命名空间版本，索引更新后检索缓存与搜索缓存一起失效
+        version = RedisCache.get_namespace_version(VectorDBService.SEARCH_CACHE_NAMESPACE)
+        content = f"retrieval:{query}:{self.embedding_model_version}:{owner_id}:{version}"
         return f"qa:retrieval:{hashlib.md5(content.encode('utf-8')).hexdigest()[:16]}"
 
-    def _get_cached_retrieval(self, query: str) -> Optional[list[dict[str, Any]]]:
+    def _get_cached_retrieval(self, query: str, owner_id: int) -> Optional[list[dict[str, Any]]]:
         """从缓存获取检索结果"""
         if not self.enable_retrieval_cache:
             return None
 
-        cache_key = self._get_retrieval_cache_key(query)
+        cache_key = self._get_retrieval_cache_key(query, owner_id)
         try:
             cached_data = cache.get(cache_key)
             if cached_data:
+                # 缓存结果包含已删除的文档块时视为未命中，重新检索
+                vector_db = VectorDBService.get_instance(embedding_model_version=self.embedding_model_version)
+                if len(vector_db.filter_deleted(cached_data)) < len(cached_data):
+                    logger.debug(f"检索缓存包含已删除的文档: {query[:50]}...")
+                    return None
                 logger.debug(f"检索缓存命中: {query[:50]}...")
                 return cached_data
         except Exception as e:
             logger.warning(f"检索缓存读取失败: {e}")
         return None
 
-    def _set_cached_retrieval(self, query: str, results: list[dict[str, Any]]):
+    def _set_cached_retrieval(self, query: str, owner_id: int, results: list[dict[str, Any]]):
         """设置检索结果到缓存"""
         if not self.enable_retrieval_cache:
             return
 
-        cache_key = self._get_retrieval_cache_key(query)
+        cache_key = self._get_retrieval_cache_key(query, owner_id)
         try:
             cache.set(cache_key, results, timeout=self.retrieval_cache_timeout)
             logger.debug(f"检索缓存设置: {query[:50]}...")
@@ -98,12 +108,12 @@ class QAService:
             history = self._get_conversation_history(conversation.id, memory_type)
 
             # 3. 调用RAG系统检索相关文档（使用缓存优化）
-            relevant_docs = self._get_cached_retrieval(query)
+            relevant_docs = self._get_cached_retrieval(query, user_id)
             if relevant_docs is None:
-                # 缓存未命中，从RAG服务获取
-                relevant_docs = self.rag_service.retrieve_relevant_documents(query)
+                # 缓存未命中，从RAG服务获取，只检索当前用户的文档
+                relevant_docs = self.rag_service.retrieve_relevant_documents(query, owner_id=user_id)
                 # 缓存结果
-                self._set_cached_retrieval(query, relevant_docs)
+                self._set_cached_retrieval(query, user_id, relevant_docs)
             else:
                 logger.info(f"使用缓存的检索结果，查询: {query[:50]}...")
 
@@ -203,8 +213,8 @@ class QAService:
                 "status": "processing",
             }
 
-            # 6. 调用RAG系统检索相关文档（可能耗时）
-            relevant_docs = self.rag_service.retrieve_relevant_documents(query)
+            # 6. 调用RAG系统检索当前用户的相关文档（可能耗时）
+            relevant_docs = self.rag_service.retrieve_relevant_documents(query, owner_id=user_id)
 
             # 7. 格式化上下文
             context = self.rag_service.format_context_for_llm(relevant_docs, query)
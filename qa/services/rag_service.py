@@ -1,7 +1,9 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from django.conf import settings
 from loguru import logger
 
 from documents.services.vector_db_service import VectorDBService
+from .rerank_service import RerankService
 
 # loguru不需要getLogger
 
@@ -17,24 +19,160 @@ class RAGService:
             embedding_model_version: 嵌入模型版本，如果未指定则使用settings中的配置
         """
         self.embedding_model_version = embedding_model_version
+        # 混合检索：向量检索和BM25词法检索各取若干候选，按倒数排名融合
+        self.hybrid_search = getattr(settings, "HYBRID_SEARCH_ENABLED", True)
+        self.hybrid_candidates = getattr(settings, "HYBRID_SEARCH_CANDIDATES", 20)
+        self.rrf_k = getattr(settings, "HYBRID_RRF_K", 60)
+        # 重排：启用时取前RERANK_CANDIDATES个候选由交叉编码器重新排序，再返回top_k个
+        self.rerank_candidates = getattr(settings, "RERANK_CANDIDATES", 20)
+        # 去冗余：合并同一文档的相邻文档块，并按MMR在前RETRIEVAL_DIVERSIFY_CANDIDATES个候选中选择top_k个
+        self.merge_adjacent = getattr(settings, "RETRIEVAL_MERGE_ADJACENT_CHUNKS", True)
+        self.mmr_lambda = getattr(settings, "RETRIEVAL_MMR_LAMBDA", 0.7)
+        self.diversify_candidates = getattr(settings, "RETRIEVAL_DIVERSIFY_CANDIDATES", 20)
+        self.diversify = self.merge_adjacent or self.mmr_lambda < 1
+
+    def _candidate_counts(self, top_k: int, reranker: Optional[RerankService]):
+        """
+        计算各阶段的候选数量
 
-    def retrieve_relevant_documents(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        Returns:
+            (每一路检索的候选数量, 送入重排和去冗余的候选数量)
+        """
+        pool = max(top_k, self.rerank_candidates) if reranker is not None else top_k
+        if self.diversify:
+            pool = max(pool, self.diversify_candidates)
+        fetch = max(pool, self.hybrid_candidates) if self.hybrid_search else pool
+        return fetch, pool
+
+    def retrieve_relevant_documents(
+        self,
+        query: str,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        owner_id: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
         """
         检索与查询相关的文档
 
+        启用混合检索时，向量检索和BM25词法检索的结果按倒数排名融合，产品型号、专有名词等精确词语的查询
+        不必依靠增大top_k召回；启用重排时再由交叉编码器在时间预算内重新排序，超时使用融合后的排序；
+        最后合并同一文档的相邻文档块并按MMR去掉内容重复的结果
+
         Args:
             query: 用户查询
             top_k: 返回的最相关文档数量
+            nprobe: IVF索引本次搜索的聚类数量，可选
+            ef_search: HNSW索引本次搜索的候选队列长度，可选
+            owner_id: 只检索该用户的文档，可选
 
         Returns:
-            相关文档列表
+            相关文档列表，score为向量相似度；混合检索时融合分数在fused_score中，重排后交叉编码器分数在rerank_score中，
+            合并的结果带有chunk_ids字段
         """
+        reranker = RerankService.get_instance()
+        candidates, pool = self._candidate_counts(top_k, reranker)
+
         # 调用向量数据库服务进行检索，传递嵌入模型版本
-        return VectorDBService.search_static(query, top_k, embedding_model_version=self.embedding_model_version)
+        results = VectorDBService.search_static(
+            query,
+            candidates,
+            embedding_model_version=self.embedding_model_version,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            owner_id=owner_id,
+        )
+        if self.hybrid_search:
+            vector_db = VectorDBService.get_instance(embedding_model_version=self.embedding_model_version)
+            lexical_results = vector_db.lexical_search_many([query], candidates, owner_id=owner_id)[0]
+            results = self.reciprocal_rank_fusion([results, lexical_results], pool, self.rrf_k)
+
+        if reranker is not None:
+            # 去冗余时重排全部候选，由去冗余选择top_k个
+            results = reranker.rerank(query, results[:pool], pool if self.diversify else top_k)
+        if not self.diversify:
+            return results[:top_k]
+        vector_db = VectorDBService.get_instance(embedding_model_version=self.embedding_model_version)
+        return vector_db.diversify(results[:pool], top_k, self.mmr_lambda, self.merge_adjacent)
+
+    def retrieve_relevant_documents_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        owner_id: Optional[int] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量检索多个查询的相关文档，用于评估和离线处理等大批量查询场景
+
+        查询向量批量获取，一次FAISS搜索和一次数据库加载处理全部查询，结果不经过单条查询的缓存
+
+        Args:
+            queries: 用户查询列表
+            top_k: 每个查询返回的最相关文档数量
+            nprobe: IVF索引本次搜索的聚类数量，可选
+            ef_search: HNSW索引本次搜索的候选队列长度，可选
+            owner_id: 只检索该用户的文档，可选
+
+        Returns:
+            与queries顺序一致的相关文档列表
+        """
+        vector_db = VectorDBService.get_instance(embedding_model_version=self.embedding_model_version)
+        reranker = RerankService.get_instance()
+        candidates, pool = self._candidate_counts(top_k, reranker)
+
+        # 与单条检索相同：两路各取候选后融合，再在一次批量计算中重排全部查询
+        results = vector_db.search_many(queries, candidates, nprobe=nprobe, ef_search=ef_search, owner_id=owner_id)
+        if self.hybrid_search:
+            lexical_results = vector_db.lexical_search_many(queries, candidates, owner_id=owner_id)
+            results = [
+                self.reciprocal_rank_fusion([query_vector_results, query_lexical_results], pool, self.rrf_k)
+                for query_vector_results, query_lexical_results in zip(results, lexical_results)
+            ]
+
+        if reranker is not None:
+            results = reranker.rerank_many(
+                queries, [query_results[:pool] for query_results in results], pool if self.diversify else top_k
+            )
+        if not self.diversify:
+            return [query_results[:top_k] for query_results in results]
+        return [
+            vector_db.diversify(query_results[:pool], top_k, self.mmr_lambda, self.merge_adjacent)
+            for query_results in results
+        ]
+
+    @staticmethod
+    def reciprocal_rank_fusion(
+        result_lists: List[List[Dict[str, Any]]], top_k: int, k: int = 60
+    ) -> List[Dict[str, Any]]:
+        """
+        倒数排名融合(RRF)：文档块的融合分数为它在各路结果中1/(k + 排名)之和
+
+        只使用排名，向量相似度与BM25分数的量纲不同也可以直接融合
+
+        Args:
+            result_lists: 各路检索结果，每一路按相关性降序
+            top_k: 返回结果数量
+            k: 平滑常数，越大排名靠后的结果权重越接近靠前的结果
+
+        Returns:
+            按融合分数降序的结果，融合分数在fused_score字段中，score保持为向量相似度；
+            同一文档块保留最先出现的一路中的字段
+        """
+        fused = {}
+        for results in result_lists:
+            for rank, result in enumerate(results, 1):
+                entry = fused.get(result["chunk_id"])
+                if entry is None:
+                    entry = fused[result["chunk_id"]] = {**result, "fused_score": 0.0}
+                entry["fused_score"] += 1.0 / (k + rank)
+
+        return sorted(fused.values(), key=lambda result: result["fused_score"], reverse=True)[:top_k]
 
     @staticmethod
     def retrieve_relevant_documents_static(
-        query: str, top_k: int = 5, embedding_model_version=None
+        query: str, top_k: int = 5, embedding_model_version=None, owner_id: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
         静态方法版本，检索与查询相关的文档
@@ -43,12 +181,15 @@ class RAGService:
             query: 用户查询
             top_k: 返回的最相关文档数量
             embedding_model_version: 嵌入模型版本
+            owner_id: 只检索该用户的文档，可选
 
         Returns:
             相关文档列表
         """
         # 调用向量数据库服务进行检索
-        return VectorDBService.search_static(query, top_k, embedding_model_version=embedding_model_version)
+        return VectorDBService.search_static(
+            query, top_k, embedding_model_version=embedding_model_version, owner_id=owner_id
+        )
 
     def format_context_for_llm(self, retrieved_docs: List[Dict[str, Any]], query: str) -> str:
         """
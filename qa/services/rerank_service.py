@@ -0,0 +1,172 @@
+import concurrent.futures
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from loguru import logger
+
+
+class RerankService:
+    """检索结果重排服务，使用本地交叉编码器(CrossEncoder)对查询和候选文档块逐对打分"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> Optional["RerankService"]:
+        """
+        获取重排服务单例，首次创建时在后台线程中加载模型并预热
+
+        Returns:
+            RerankService，未启用重排时返回None
+        """
+        if not getattr(settings, "RERANK_ENABLED", False):
+            return None
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                cls._instance.warm_up()
+        return cls._instance
+
+    def __init__(
+        self, model_name: Optional[str] = None, time_budget: Optional[float] = None, max_workers: Optional[int] = None
+    ):
+        """
+        初始化重排服务，模型在预热或第一次重排时在后台线程中加载
+
+        Args:
+            model_name: 交叉编码器模型名称，如果未指定则使用settings中的配置
+            time_budget: 每次重排的时间预算(秒)，超时后使用原排序
+            max_workers: 同时进行重排的请求数量，已满时新的请求直接使用原排序
+        """
+        self.model_name = model_name or getattr(settings, "RERANK_MODEL", "BAAI/bge-reranker-base")
+        if time_budget is None:
+            time_budget = getattr(settings, "RERANK_TIME_BUDGET_MS", 300) / 1000
+        self.time_budget = time_budget
+        self.max_workers = max_workers or getattr(settings, "RERANK_WORKERS", 1)
+        self.max_length = getattr(settings, "RERANK_MAX_LENGTH", 512)
+
+        self.model = None
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rerank")
+        self._running = 0
+        self._running_lock = threading.Lock()
+
+        logger.info(f"初始化RerankService，使用模型: {self.model_name}，时间预算: {self.time_budget * 1000:.0f}ms")
+
+    def _load_model(self):
+        """加载交叉编码器模型"""
+        with self._model_lock:
+            if self.model is None:
+                # 延迟导入sentence_transformers，避免依赖未安装时的导入错误
+                from sentence_transformers import CrossEncoder
+
+                start_time = time.time()
+                self.model = CrossEncoder(self.model_name, max_length=self.max_length)
+                logger.info(f"重排模型{self.model_name}加载完成，耗时: {time.time() - start_time:.2f}秒")
+        return self.model
+
+    def warm_up(self) -> concurrent.futures.Future:
+        """
+        在重排线程中加载模型并完成一次前向计算，第一个请求不再因加载模型超出时间预算
+
+        Returns:
+            预热任务的Future
+        """
+
+        def run():
+            try:
+                start_time = time.time()
+                self._predict([["预热", "预热"]])
+                logger.info(f"重排模型预热完成，耗时: {time.time() - start_time:.2f}秒")
+            except Exception as e:
+                logger.error(f"重排模型预热失败: {str(e)}")
+
+        return self._executor.submit(run)
+
+    def _predict(self, pairs: List[List[str]]) -> np.ndarray:
+        """在一次批量前向计算中为全部(查询, 文档块)对打分"""
+        model = self._load_model()
+        scores = model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        return np.asarray(scores, dtype=np.float32).reshape(-1)
+
+    def _release(self, _future) -> None:
+        with self._running_lock:
+            self._running -= 1
+
+    def rerank(
+        self, query: str, results: List[Dict[str, Any]], top_k: int, time_budget: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        重排单个查询的检索结果
+
+        Args:
+            query: 用户查询
+            results: 按原排序的候选结果
+            top_k: 返回结果数量
+            time_budget: 本次重排的时间预算(秒)，未指定时使用默认预算
+
+        Returns:
+            重排后的前top_k个结果，超时或失败时为原排序的前top_k个结果
+        """
+        return self.rerank_many([query], [results], top_k, time_budget)[0]
+
+    def rerank_many(
+        self,
+        queries: List[str],
+        results_lists: List[List[Dict[str, Any]]],
+        top_k: int,
+        time_budget: Optional[float] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        重排多个查询的检索结果，全部候选在一次批量前向计算中打分
+
+        Args:
+            queries: 用户查询列表
+            results_lists: 与queries顺序一致的候选结果
+            top_k: 每个查询返回的结果数量
+            time_budget: 本次重排的时间预算(秒)，未指定时使用默认预算
+
+        Returns:
+            与queries顺序一致的重排结果，交叉编码器分数在rerank_score中，score不变；超时或失败时为原排序的前top_k个结果
+        """
+        fallback = [results[:top_k] for results in results_lists]
+        pairs = [[query, result["content"]] for query, results in zip(queries, results_lists) for result in results]
+        if not pairs:
+            return fallback
+
+        with self._running_lock:
+            if self._running >= self.max_workers:
+                logger.warning("重排模型正忙，本次使用原排序")
+                return fallback
+            self._running += 1
+
+        budget = self.time_budget if time_budget is None else time_budget
+        start_time = time.time()
+        future = self._executor.submit(self._predict, pairs)
+        future.add_done_callback(self._release)
+        try:
+            scores = future.result(timeout=budget)
+        except concurrent.futures.TimeoutError:
+            # Python 3.10中concurrent.futures.TimeoutError不是内置TimeoutError的别名
+            # 计算在后台线程中继续完成，占用的名额随之释放
+            logger.warning(f"重排{len(pairs)}个候选超过时间预算{budget * 1000:.0f}ms，使用原排序")
+            return fallback
+        except Exception as e:
+            logger.error(f"重排失败，使用原排序: {str(e)}")
+            return fallback
+
+        reranked = []
+        offset = 0
+        for results in results_lists:
+            query_scores = scores[offset : offset + len(results)]
+            offset += len(results)
+            order = np.argsort(-query_scores, kind="stable")[:top_k]
+            reranked.append([{**results[i], "rerank_score": float(query_scores[i])} for i in order])
+
+        logger.debug(f"重排{len(pairs)}个候选完成，耗时: {(time.time() - start_time) * 1000:.1f}ms")
+        return reranked
@@ -1,3 +1,93 @@
-from django.test import TestCase
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+from pydantic import ValidationError
+
+from qa.schemas.retrieval import MAX_EF_SEARCH, MAX_NPROBE, BatchRetrievalIn, RetrievalIn
+from qa.services.rag_service import RAGService
+from qa.services.rerank_service import RerankService
+
+
+class ReciprocalRankFusionTest(SimpleTestCase):
+    """检索结果倒数排名融合测试"""
+
+    def test_chunks_found_by_both_retrievers_rank_first(self):
+        vector_results = [{"chunk_id": 1, "score": 0.9}, {"chunk_id": 2, "score": 0.8}]
+        lexical_results = [{"chunk_id": 3, "score": 12.0}, {"chunk_id": 2, "score": 7.5}]
+
+        fused = RAGService.reciprocal_rank_fusion([vector_results, lexical_results], top_k=2, k=60)
+
+        self.assertEqual([result["chunk_id"] for result in fused], [2, 1])
+        self.assertAlmostEqual(fused[0]["fused_score"], 2 / 62)
+        # score保持为向量相似度
+        self.assertEqual(fused[0]["score"], 0.8)
+
+
+class FakeCrossEncoder:
+    """按文档块内容中查询词出现的次数打分"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [content.count(query) for query, content in pairs]
+
+
+class RerankServiceTest(SimpleTestCase):
+    """交叉编码器重排测试"""
+
+    def setUp(self):
+        self.results = [
+            {"chunk_id": 1, "content": "无关内容", "score": 0.9},
+            {"chunk_id": 2, "content": "退款 退款流程", "score": 0.8},
+            {"chunk_id": 3, "content": "退款说明", "score": 0.7},
+        ]
+
+    def test_candidates_are_scored_in_one_batch(self):
+        service = RerankService(model_name="fake", time_budget=1.0)
+        service.model = FakeCrossEncoder()
+
+        reranked = service.rerank_many(["退款", "退款"], [self.results, self.results[:2]], top_k=2)
+
+        self.assertEqual(service.model.calls, 1)
+        self.assertEqual([result["chunk_id"] for result in reranked[0]], [2, 3])
+        self.assertEqual(reranked[0][0]["rerank_score"], 2.0)
+        self.assertEqual(reranked[0][0]["score"], 0.8)
+
+    def test_falls_back_to_original_order_when_over_budget(self):
+        service = RerankService(model_name="fake", time_budget=0.01)
+        service.model = FakeCrossEncoder(delay=0.2)
+
+        reranked = service.rerank("退款", self.results, top_k=2)
+
+        self.assertEqual([result["chunk_id"] for result in reranked], [1, 2])
+
+    @override_settings(RERANK_ENABLED=True)
+    def test_first_get_instance_warms_up_model(self):
+        model = FakeCrossEncoder()
+        with mock.patch.object(RerankService, "_instance", None), mock.patch.object(
+            RerankService, "_load_model", return_value=model
+        ):
+            service = RerankService.get_instance()
+            # 预热任务完成后再检查
+            service._executor.submit(lambda: None).result(timeout=5)
+
+            self.assertIs(RerankService.get_instance(), service)
+        self.assertEqual(model.calls, 1)
+
+
+class RetrievalSchemaTest(SimpleTestCase):
+    """检索请求参数校验测试"""
+
+    def test_search_params_are_bounded(self):
+        for schema, base in ((RetrievalIn, {"query": "q"}), (BatchRetrievalIn, {"queries": ["q"]})):
+            self.assertIsNone(schema(**base).nprobe)
+            self.assertEqual(schema(**base, nprobe=MAX_NPROBE, ef_search=MAX_EF_SEARCH).ef_search, MAX_EF_SEARCH)
+            invalid = ({"nprobe": 0}, {"nprobe": MAX_NPROBE + 1}, {"ef_search": -1}, {"ef_search": MAX_EF_SEARCH + 1})
+            for params in invalid:
+                with self.assertRaises(ValidationError, msg=f"{schema.__name__} {params}"):
+                    schema(**base, **params)
@@ -170,6 +170,26 @@ EMBEDDING_SERVICE_TYPE = os.environ.get("EMBEDDING_SERVICE_TYPE", "api")
 # API嵌入模型配置（当 EMBEDDING_SERVICE_TYPE='api' 时使用）
 EMBEDDING_MODEL_VERSION = os.environ.get("EMBEDDING_MODEL_VERSION", "text-embedding-v4")
 EMBEDDING_MODEL_DIMENSIONS = 1024
+# OpenAI兼容的嵌入API地址，压测时可以指向本地的模拟服务
+EMBEDDING_API_BASE_URL = os.environ.get("EMBEDDING_API_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+# 批量获取嵌入时单次API请求最多包含的文本数量
+EMBEDDING_API_BATCH_SIZE = int(os.environ.get("EMBEDDING_API_BATCH_SIZE", "10"))
+# 单次API请求中全部文本合计的token上限（按字符估算）
+EMBEDDING_API_BATCH_MAX_TOKENS = int(os.environ.get("EMBEDDING_API_BATCH_MAX_TOKENS", "32000"))
+# 索引文档时每批向量化的文档块数量，每批再按上面两个上限拆分为多次API请求
+EMBEDDING_INDEX_BATCH_SIZE = int(os.environ.get("EMBEDDING_INDEX_BATCH_SIZE", "256"))
+# 同时进行中的嵌入API请求数，以及每个进程每分钟的请求数和token数上限（0表示不限制）
+EMBEDDING_API_CONCURRENCY = int(os.environ.get("EMBEDDING_API_CONCURRENCY", "4"))
+EMBEDDING_API_REQUESTS_PER_MINUTE = int(os.environ.get("EMBEDDING_API_REQUESTS_PER_MINUTE", "0"))
+EMBEDDING_API_TOKENS_PER_MINUTE = int(os.environ.get("EMBEDDING_API_TOKENS_PER_MINUTE", "0"))
+# 所有Web进程和Celery worker共用的嵌入API配额（Redis全局令牌桶），按账户的限额配置
+EMBEDDING_GLOBAL_RATE_LIMIT_ENABLED = os.environ.get("EMBEDDING_GLOBAL_RATE_LIMIT_ENABLED", "True").lower() == "true"
+EMBEDDING_GLOBAL_REQUESTS_PER_MINUTE = int(os.environ.get("EMBEDDING_GLOBAL_REQUESTS_PER_MINUTE", "1800"))
+EMBEDDING_GLOBAL_TOKENS_PER_MINUTE = int(os.environ.get("EMBEDDING_GLOBAL_TOKENS_PER_MINUTE", "1200000"))
+# 全局配额的突发容量中保留给检索查询的比例，文档索引等批量任务用满配额时查询仍然可以立即取得配额
+EMBEDDING_BULK_RESERVE_RATIO = float(os.environ.get("EMBEDDING_BULK_RESERVE_RATIO", "0.2"))
+# 查询等待全局配额的最长秒数，超时后直接发送请求
+EMBEDDING_INTERACTIVE_MAX_WAIT = float(os.environ.get("EMBEDDING_INTERACTIVE_MAX_WAIT", "2.0"))
 
 # 本地嵌入模型配置（当 EMBEDDING_SERVICE_TYPE='local' 时使用）
 # 支持的模型及其维度:
@@ -180,6 +200,16 @@ EMBEDDING_MODEL_DIMENSIONS = 1024
 # - BAAI/bge-large-zh-v1.5: 1024维，中文优先，最佳质量
 # - paraphrase-multilingual-MiniLM-L12-v2: 384维，多语言
 LOCAL_EMBEDDING_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "BAAI/bge-large-zh-v1.5")
+# 本地模型批量编码：文本按token长度分批，每批的文本数量上限和补齐后的token数上限，以及推理使用的CPU线程数（0为默认）
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.environ.get("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+LOCAL_EMBEDDING_MAX_BATCH_TOKENS = int(os.environ.get("LOCAL_EMBEDDING_MAX_BATCH_TOKENS", "16384"))
+LOCAL_EMBEDDING_NUM_THREADS = int(os.environ.get("LOCAL_EMBEDDING_NUM_THREADS", "0"))
+# 并发的查询向量化请求合并为一批编码：最多等待的毫秒数和每批最多的查询数
+LOCAL_EMBEDDING_MICRO_BATCH_ENABLED = os.environ.get("LOCAL_EMBEDDING_MICRO_BATCH_ENABLED", "True").lower() == "true"
+LOCAL_EMBEDDING_MICRO_BATCH_WAIT_MS = float(os.environ.get("LOCAL_EMBEDDING_MICRO_BATCH_WAIT_MS", "5"))
+LOCAL_EMBEDDING_MICRO_BATCH_SIZE = int(os.environ.get("LOCAL_EMBEDDING_MICRO_BATCH_SIZE", "32"))
+# 等待微批处理结果的最长秒数，超时后在请求线程中直接编码
+LOCAL_EMBEDDING_MICRO_BATCH_TIMEOUT = float(os.environ.get("LOCAL_EMBEDDING_MICRO_BATCH_TIMEOUT", "10"))
 
 # 注意：text-embedding-v4是OpenAI API模型，不是HuggingFace模型
 # 确保在使用本地嵌入服务时不使用API模型名称
@@ -194,6 +224,101 @@ QA_RETRIEVAL_CACHE_TIMEOUT = int(os.environ.get("QA_RETRIEVAL_CACHE_TIMEOUT", "3
 # 向量库配置
 VECTOR_STORE_PATH = os.environ.get("VECTOR_STORE_PATH", str(BASE_DIR / "vector_store"))
 
+# 向量索引类型配置
+# 新索引总是从精确检索的IndexFlatIP开始，向量数量达到提升阈值后重新训练为下面配置的索引类型:
+# - flat: 始终使用精确检索，适合小规模数据
+# - hnsw: IndexHNSWFlat图索引，无需训练，召回率高，内存占用略大
+# - ivf: IndexIVFFlat倒排索引，需要训练，通过nprobe平衡速度和召回率
+# - sq8: IndexScalarQuantizer 8bit标量量化，内存为flat的1/4
+# - pq: IndexPQ乘积量化，每个向量VECTOR_INDEX_PQ_M字节
+# - ivfpq: IndexIVFPQ倒排+乘积量化，适合千万级向量
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "flat")
+VECTOR_INDEX_PROMOTE_THRESHOLD = int(os.environ.get("VECTOR_INDEX_PROMOTE_THRESHOLD", "100000"))
+
+# HNSW索引参数
+VECTOR_INDEX_HNSW_M = int(os.environ.get("VECTOR_INDEX_HNSW_M", "32"))
+VECTOR_INDEX_HNSW_EF_CONSTRUCTION = int(os.environ.get("VECTOR_INDEX_HNSW_EF_CONSTRUCTION", "200"))
+VECTOR_INDEX_HNSW_EF_SEARCH = int(os.environ.get("VECTOR_INDEX_HNSW_EF_SEARCH", "64"))  # 默认值，可按请求覆盖
+
+# IVF索引参数
+VECTOR_INDEX_IVF_NLIST = int(os.environ.get("VECTOR_INDEX_IVF_NLIST", "0"))  # 0表示按4*sqrt(N)自动计算
+VECTOR_INDEX_IVF_NPROBE = int(os.environ.get("VECTOR_INDEX_IVF_NPROBE", "16"))  # 默认值，可按请求覆盖
+
+# 检索接口中按请求覆盖的nprobe和ef_search上限，超出时请求校验失败，避免单个请求扫描全部聚类或过长的候选队列
+VECTOR_SEARCH_MAX_NPROBE = int(os.environ.get("VECTOR_SEARCH_MAX_NPROBE", "1024"))
+VECTOR_SEARCH_MAX_EF_SEARCH = int(os.environ.get("VECTOR_SEARCH_MAX_EF_SEARCH", "1024"))
+
+# 乘积量化参数（pq/ivfpq），子空间数量需要能整除向量维度，不能整除时自动向下调整
+VECTOR_INDEX_PQ_M = int(os.environ.get("VECTOR_INDEX_PQ_M", "64"))
+
+# 原始向量以内存映射方式保存在磁盘上，压缩索引(sq8/pq/ivfpq)先取top_k*重排倍数个候选，再用原始向量精确重排
+VECTOR_INDEX_KEEP_RAW_VECTORS = os.environ.get("VECTOR_INDEX_KEEP_RAW_VECTORS", "True").lower() == "true"
+VECTOR_INDEX_RERANK_FACTOR = int(os.environ.get("VECTOR_INDEX_RERANK_FACTOR", "4"))  # 小于等于1表示不重排
+
+# 以内存映射(IO_FLAG_MMAP_IFC)方式只读加载索引段文件，同一主机上的多个进程共享页缓存，重新加载只需映射新段
+# 段文件写入后不再修改，合并时会先复制到进程内存
+VECTOR_INDEX_MMAP = os.environ.get("VECTOR_INDEX_MMAP", "False").lower() == "true"
+
+# 索引分段：每次索引文档只写入一个小的增量段，由后台任务合并
+# 增量段数量达到VECTOR_SEGMENT_MAX_DELTAS时合并为一个增量段；
+# 增量向量数达到基础段的VECTOR_SEGMENT_MERGE_RATIO时并入基础段（同时按VECTOR_INDEX_TYPE提升索引）
+VECTOR_SEGMENT_MAX_DELTAS = int(os.environ.get("VECTOR_SEGMENT_MAX_DELTAS", "8"))
+VECTOR_SEGMENT_MERGE_RATIO = float(os.environ.get("VECTOR_SEGMENT_MERGE_RATIO", "0.1"))
+
+# 基础段按chunk_id % VECTOR_INDEX_SHARDS分片，每个分片是单独的索引文件，修改后下次合并时重新分片
+# 搜索时基础段分片和增量段在线程池中并行查询，VECTOR_SEARCH_THREADS为0时按分片数和CPU核数自动设置
+VECTOR_INDEX_SHARDS = int(os.environ.get("VECTOR_INDEX_SHARDS", "1"))
+VECTOR_SEARCH_THREADS = int(os.environ.get("VECTOR_SEARCH_THREADS", "0"))
+
+# 其他进程写入索引后通过Redis通知本进程重新加载：最后一条通知后安静VECTOR_RELOAD_DEBOUNCE_SECONDS秒再加载，
+# 持续收到通知时最多等待VECTOR_RELOAD_MAX_DELAY_SECONDS秒，期间的多条通知合并为一次重新加载
+VECTOR_RELOAD_DEBOUNCE_SECONDS = float(os.environ.get("VECTOR_RELOAD_DEBOUNCE_SECONDS", "0.5"))
+VECTOR_RELOAD_MAX_DELAY_SECONDS = float(os.environ.get("VECTOR_RELOAD_MAX_DELAY_SECONDS", "5"))
+
+# 每个嵌入模型版本在进程内有一个加载了索引（使用本地嵌入服务时还有嵌入模型）的实例，
+# 全部实例合计（估算）超过VECTOR_INSTANCE_MEMORY_BUDGET_MB时，按最近使用顺序淘汰
+# 空闲超过VECTOR_INSTANCE_IDLE_SECONDS秒的非默认版本实例，下次使用时重新加载；0表示不限制
+VECTOR_INSTANCE_MEMORY_BUDGET_MB = int(os.environ.get("VECTOR_INSTANCE_MEMORY_BUDGET_MB", "2048"))
+VECTOR_INSTANCE_IDLE_SECONDS = int(os.environ.get("VECTOR_INSTANCE_IDLE_SECONDS", "300"))
+
+# 删除的向量在搜索时通过IDSelector过滤；过滤后结果不足top_k时最多扩大候选数量重新搜索的次数
+VECTOR_SEARCH_OVERSAMPLE_ROUNDS = int(os.environ.get("VECTOR_SEARCH_OVERSAMPLE_ROUNDS", "3"))
+
+# 按用户检索：文档块不超过VECTOR_OWNER_EXACT_SEARCH_MAX_CHUNKS的用户在内存中精确搜索，否则在索引中按ID过滤
+# 用户分区按最近使用淘汰，最多缓存VECTOR_OWNER_CACHE_MAX_ENTRIES个，合计不超过VECTOR_OWNER_CACHE_MAX_MB
+VECTOR_OWNER_EXACT_SEARCH_MAX_CHUNKS = int(os.environ.get("VECTOR_OWNER_EXACT_SEARCH_MAX_CHUNKS", "10000"))
+VECTOR_OWNER_CACHE_MAX_ENTRIES = int(os.environ.get("VECTOR_OWNER_CACHE_MAX_ENTRIES", "256"))
+VECTOR_OWNER_CACHE_MAX_MB = int(os.environ.get("VECTOR_OWNER_CACHE_MAX_MB", "512"))
+
+# 语义查询缓存：查询向量与最近查询（同一用户和搜索参数）的余弦相似度
+# 不低于VECTOR_SEMANTIC_CACHE_THRESHOLD时直接返回缓存结果，
+# 最多缓存VECTOR_SEMANTIC_CACHE_MAX_ENTRIES个查询，有效期VECTOR_SEMANTIC_CACHE_TTL秒，索引更新后全部失效
+VECTOR_SEMANTIC_CACHE_ENABLED = os.environ.get("VECTOR_SEMANTIC_CACHE_ENABLED", "True").lower() == "true"
+VECTOR_SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("VECTOR_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+VECTOR_SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("VECTOR_SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+VECTOR_SEMANTIC_CACHE_TTL = int(os.environ.get("VECTOR_SEMANTIC_CACHE_TTL", "3600"))
+
+# 混合检索：在进程内维护文档块文本的BM25词法索引（中日韩文字按相邻两字切分），与向量检索结果按倒数排名融合(RRF)，
+# 每一路取HYBRID_SEARCH_CANDIDATES个候选（不少于top_k），融合分数为各路1/(HYBRID_RRF_K + 排名)之和
+HYBRID_SEARCH_ENABLED = os.environ.get("HYBRID_SEARCH_ENABLED", "True").lower() == "true"
+HYBRID_SEARCH_CANDIDATES = int(os.environ.get("HYBRID_SEARCH_CANDIDATES", "20"))
+HYBRID_RRF_K = int(os.environ.get("HYBRID_RRF_K", "60"))
+
+# 重排：检索结果的前RERANK_CANDIDATES个候选由本地交叉编码器在一次批量计算中打分并重新排序，
+# 每次重排最多等待RERANK_TIME_BUDGET_MS毫秒，超时或同时重排的请求超过RERANK_WORKERS个时使用原排序
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "False").lower() == "true"
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "BAAI/bge-reranker-base")
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "20"))
+RERANK_TIME_BUDGET_MS = int(os.environ.get("RERANK_TIME_BUDGET_MS", "300"))
+RERANK_WORKERS = int(os.environ.get("RERANK_WORKERS", "1"))
+RERANK_MAX_LENGTH = int(os.environ.get("RERANK_MAX_LENGTH", "512"))
+
+# 检索结果去冗余：合并同一文档中相邻的文档块（去掉分块重叠），再在前RETRIEVAL_DIVERSIFY_CANDIDATES个候选中
+# 按最大边际相关性(MMR)选择top_k个文档块，RETRIEVAL_MMR_LAMBDA为相关性权重，1表示只按相关性选择
+RETRIEVAL_MERGE_ADJACENT_CHUNKS = os.environ.get("RETRIEVAL_MERGE_ADJACENT_CHUNKS", "True").lower() == "true"
+RETRIEVAL_MMR_LAMBDA = float(os.environ.get("RETRIEVAL_MMR_LAMBDA", "0.7"))
+RETRIEVAL_DIVERSIFY_CANDIDATES = int(os.environ.get("RETRIEVAL_DIVERSIFY_CANDIDATES", "20"))
+
 # 确保向量库目录存在
 
 os.makedirs(VECTOR_STORE_PATH, exist_ok=True)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+嵌入API并发请求基准测试
+在本地启动一个模拟OpenAI兼容嵌入接口的HTTP服务（每个请求固定延迟），用EmbeddingService批量向量化同一批文本，
+比较不同并发请求数下的吞吐量；同时验证结果顺序与输入一致，以及每分钟请求数上限生效
+
+用法: python tests/benchmark_embedding_concurrency.py --num-texts 2000 --latency-ms 200 --concurrency 1 2 4 8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 将项目根目录添加到系统路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# 设置Django环境
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "smartdocs_project.settings")
+django.setup()
+
+import numpy as np
+from django.conf import settings
+
+from documents.services.embedding_service import EmbeddingService
+
+DIM = 64
+
+
+def fake_embedding(text):
+    """与文本一一对应的确定性向量，用于校验结果顺序"""
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).standard_normal(DIM).astype("float32")
+
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+    """模拟/embeddings接口，每个请求等待固定延迟后返回"""
+
+    latency = 0.2
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        with StubEmbeddingHandler.lock:
+            StubEmbeddingHandler.requests += 1
+        time.sleep(self.latency)
+
+        payload = json.dumps(
+            {
+                "object": "list",
+                "model": body["model"],
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(text).tolist()}
+                    for i, text in enumerate(texts)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    # 默认的监听队列只有5个连接，高并发时新连接会等待SYN重传
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def start_stub_server(latency):
+    StubEmbeddingHandler.latency = latency
+    server = StubServer(("127.0.0.1", 0), StubEmbeddingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_benchmark(num_texts, latency_ms, batch_size, concurrency_levels, requests_per_minute):
+    server = start_stub_server(latency_ms / 1000)
+    settings.EMBEDDING_API_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    settings.DASHSCOPE_API_KEY = settings.DASHSCOPE_API_KEY or "stub"
+    settings.EMBEDDING_MODEL_DIMENSIONS = DIM
+    settings.EMBEDDING_API_BATCH_SIZE = batch_size
+    settings.EMBEDDING_CACHE_ENABLED = False
+    settings.EMBEDDING_API_REQUESTS_PER_MINUTE = requests_per_minute
+    settings.EMBEDDING_API_TOKENS_PER_MINUTE = 0
+
+    texts = [f"第{i}个文档块的文本内容 chunk {i}" for i in range(num_texts)]
+    expected = np.stack([fake_embedding(text) for text in texts])
+    num_requests = -(-num_texts // batch_size)
+    print(
+        f"{num_texts}个文本，每次请求{batch_size}个（共{num_requests}次请求），模拟接口延迟{latency_ms}ms，"
+        f"每分钟请求数上限: {requests_per_minute or '不限制'}"
+    )
+
+    header = f"{'并发数':<8}{'耗时(s)':>10}{'文本/秒':>12}{'请求/秒':>12}{'加速比':>10}{'顺序一致':>10}"
+    print(header)
+    print("-" * len(header))
+
+    baseline = None
+    for concurrency in concurrency_levels:
+        settings.EMBEDDING_API_CONCURRENCY = concurrency
+        service = EmbeddingService(embedding_model_version="stub-embedding")
+        StubEmbeddingHandler.requests = 0
+
+        start = time.perf_counter()
+        embeddings = service.get_embeddings(texts)
+        elapsed = time.perf_counter() - start
+
+        throughput = num_texts / elapsed
+        baseline = baseline or throughput
+        print(
+            f"{concurrency:<8}{elapsed:>10.2f}{throughput:>12.1f}{StubEmbeddingHandler.requests / elapsed:>12.1f}"
+            f"{throughput / baseline:>10.2f}{str(bool(np.allclose(embeddings, expected))):>10}"
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="嵌入API并发请求吞吐量基准测试")
+    parser.add_argument("--num-texts", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="每分钟请求数上限，0表示不限制")
+    args = parser.parse_args()
+
+    run_benchmark(args.num_texts, args.latency_ms, args.batch_size, args.concurrency, args.requests_per_minute)
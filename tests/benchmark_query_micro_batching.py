@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+查询向量化微批处理基准测试
+多个线程同时调用本地嵌入服务的get_embedding（模拟并发的检索请求），比较关闭和开启微批处理时的
+查询吞吐量和延迟分位数。开启后并发的查询由后台线程合并为一次encode调用
+
+--simulate使用模拟模型（每次encode固定开销 + 每个文本的开销，同一时刻只有一次encode在执行，
+与CPU推理时多个线程争用同一个模型的情况相近），不需要安装sentence-transformers
+用法: python tests/benchmark_query_micro_batching.py --model BAAI/bge-small-zh-v1.5 --threads 1 8 32
+      python tests/benchmark_query_micro_batching.py --simulate --threads 1 8 32
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+# 将项目根目录添加到系统路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# 设置Django环境
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "smartdocs_project.settings")
+django.setup()
+
+import numpy as np
+from django.conf import settings
+
+from documents.services.local_embedding_service import LocalEmbeddingService
+
+QUERIES = [
+    "如何上传PDF文档？",
+    "检索结果为什么会包含重复的内容？",
+    "向量索引多久合并一次？",
+    "怎样切换嵌入模型？",
+    "What file formats are supported?",
+    "混合检索是如何融合结果的？",
+]
+
+
+class SimulatedModel:
+    """模拟的嵌入模型：每次encode的耗时为固定开销加上每个文本的开销，encode互斥执行"""
+
+    max_seq_length = 512
+
+    def __init__(self, dim=384, overhead_ms=8.0, per_item_ms=0.5):
+        self.dim = dim
+        self.overhead = overhead_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self._lock = threading.Lock()
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        with self._lock:
+            time.sleep(self.overhead + self.per_item * len(texts))
+        vectors = np.random.default_rng(len(texts)).standard_normal((len(texts), self.dim)).astype("float32")
+        return vectors[0] if single else vectors
+
+
+def run_load(service, num_threads, queries_per_thread):
+    """每个线程依次发送查询，返回全部查询的延迟和总耗时"""
+    latencies = [[] for _ in range(num_threads)]
+
+    def worker(slot):
+        for i in range(queries_per_thread):
+            start = time.perf_counter()
+            service.get_embedding(QUERIES[(slot + i) % len(QUERIES)])
+            latencies[slot].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in range(num_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.concatenate([np.array(item) for item in latencies]), time.perf_counter() - start
+
+
+def run_benchmark(model, simulate, thread_counts, queries_per_thread, wait_ms, batch_size):
+    settings.LOCAL_EMBEDDING_MICRO_BATCH_WAIT_MS = wait_ms
+    settings.LOCAL_EMBEDDING_MICRO_BATCH_SIZE = batch_size
+
+    services = {}
+    for enabled in (False, True):
+        settings.LOCAL_EMBEDDING_MICRO_BATCH_ENABLED = enabled
+        service = LocalEmbeddingService(embedding_model_version=model)
+        if simulate:
+            service.model = SimulatedModel()
+            service.vector_dim = service.model.dim
+        elif service.model is None:
+            print("模型未加载，请先安装sentence-transformers，或使用--simulate")
+            return
+        services[enabled] = service
+
+    print(
+        f"模型: {'模拟模型' if simulate else model}，每个线程{queries_per_thread}个查询，"
+        f"微批处理最多等待{wait_ms}ms / 每批最多{batch_size}个查询"
+    )
+    header = (
+        f"{'线程数':<8}{'微批处理':<10}{'查询/秒':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'加速比':>10}{'平均批大小':>12}"
+    )
+    print(header)
+    print("-" * len(header))
+
+    for num_threads in thread_counts:
+        baseline = None
+        for enabled in (False, True):
+            service = services[enabled]
+            run_load(service, min(num_threads, 4), 2)  # 预热
+            batcher = service.micro_batcher
+            batches_before, items_before = (batcher.batches, batcher.items) if batcher else (0, 0)
+
+            latencies, elapsed = run_load(service, num_threads, queries_per_thread)
+            qps = len(latencies) / elapsed
+            baseline = baseline or qps
+            mean_batch = (batcher.items - items_before) / max(batcher.batches - batches_before, 1) if batcher else 1.0
+            print(
+                f"{num_threads:<8}{'开' if enabled else '关':<10}{qps:>10.1f}"
+                f"{np.percentile(latencies, 50) * 1000:>10.2f}{np.percentile(latencies, 99) * 1000:>10.2f}"
+                f"{qps / baseline:>10.2f}{mean_batch:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查询向量化微批处理基准测试")
+    parser.add_argument("--model", type=str, default="BAAI/bge-small-zh-v1.5")
+    parser.add_argument("--simulate", action="store_true", help="使用模拟模型")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--queries-per-thread", type=int, default=50)
+    parser.add_argument("--wait-ms", type=float, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    run_benchmark(args.model, args.simulate, args.threads, args.queries_per_thread, args.wait_ms, args.batch_size)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+分片搜索基准测试
+把同一份数据按chunk_id % 分片数拆成多个精确索引分片，比较不同分片数下单个查询的延迟和吞吐量。
+各分片在线程池中并行搜索，分片数不超过CPU核数时吞吐量应接近线性增长
+
+用法: python tests/benchmark_sharded_search.py --num-vectors 1000000 --dim 256 --shards 1 2 4 8
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# 将项目根目录添加到系统路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# 设置Django环境
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "smartdocs_project.settings")
+django.setup()
+
+import faiss
+import numpy as np
+
+from documents.services.faiss_index_factory import FaissIndexFactory
+from documents.services.shard_searcher import ShardSearcher
+
+
+def build_shards(data, ids, num_shards):
+    """按chunk_id % 分片数把向量写入各分片"""
+    shards = []
+    for shard in range(num_shards):
+        selected = ids % num_shards == shard
+        index = FaissIndexFactory.with_ids(FaissIndexFactory.create_index(FaissIndexFactory.FLAT, data.shape[1]))
+        index.add_with_ids(data[selected], ids[selected])
+        shards.append(index)
+    return shards
+
+
+def run_queries(searcher, shards, queries, top_k):
+    """逐个查询，返回每个查询的结果ID和总耗时"""
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        _, indices = ShardSearcher.merge_top_k(
+            searcher.map(lambda index, query=query: index.search(query[None, :], top_k), shards), top_k
+        )
+        results.append(indices[0])
+    return np.array(results), time.perf_counter() - start
+
+
+def run_benchmark(num_vectors, num_queries, dim, top_k, shard_counts):
+    rng = np.random.default_rng(42)
+    data = rng.standard_normal((num_vectors, dim)).astype("float32")
+    faiss.normalize_L2(data)
+    queries = rng.standard_normal((num_queries, dim)).astype("float32")
+    faiss.normalize_L2(queries)
+    # 文档块ID递增但不连续
+    ids = np.cumsum(rng.integers(1, 4, num_vectors)).astype(np.int64)
+
+    # 单个查询只在一个线程中搜索，并行度只来自分片
+    faiss.omp_set_num_threads(1)
+    print(f"数据集: {num_vectors}个{dim}维向量，{num_queries}个查询，top_k={top_k}，CPU核数: {os.cpu_count()}")
+
+    header = f"{'分片数':<8}{'延迟(ms/q)':>12}{'吞吐(q/s)':>12}{'加速比':>10}{'结果一致':>10}"
+    print(header)
+    print("-" * len(header))
+
+    baseline_qps = None
+    baseline_results = None
+    for num_shards in shard_counts:
+        shards = build_shards(data, ids, num_shards)
+        searcher = ShardSearcher(num_shards)
+        run_queries(searcher, shards, queries[: min(10, num_queries)], top_k)  # 预热线程池
+        results, elapsed = run_queries(searcher, shards, queries, top_k)
+        searcher.shutdown()
+
+        qps = num_queries / elapsed
+        baseline_qps = baseline_qps or qps
+        if baseline_results is None:
+            baseline_results = results
+        print(
+            f"{num_shards:<8}{elapsed * 1000 / num_queries:>12.2f}{qps:>12.1f}{qps / baseline_qps:>10.2f}"
+            f"{str(bool((results == baseline_results).all())):>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分片并行搜索吞吐量基准测试")
+    parser.add_argument("--num-vectors", type=int, default=1000000)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    run_benchmark(args.num_vectors, args.num_queries, args.dim, args.top_k, args.shards)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+并发写入与搜索压力测试
+多个写入线程同时构建增量段并通过commit_delta提交（单写者依次提交），多个搜索线程同时搜索当前快照。
+报告空闲时和写入期间的搜索QPS与延迟、写入吞吐量，并检查所有写入线程提交的向量都没有丢失
+
+用法: python tests/stress_concurrent_ingest.py --seconds 10 --readers 4 --writers 2
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# 将项目根目录添加到系统路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# 设置Django环境
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "smartdocs_project.settings")
+django.setup()
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+from documents.services.vector_db_service import VectorDBService
+
+
+class Writer(threading.Thread):
+    """写入线程：模拟index_document，在锁外构建增量段，再提交"""
+
+    def __init__(self, service, writer_id, num_writers, batch_size, first_id, stop_event):
+        super().__init__(daemon=True)
+        self.service = service
+        self.stop_event = stop_event
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(1000 + writer_id)
+        # 各写入线程使用互不重叠的ID
+        self.next_id = first_id + writer_id
+        self.step = num_writers
+        self.vectors_written = 0
+        self.commit_seconds = 0.0
+        self.errors = []
+
+    def run(self):
+        while not self.stop_event.is_set():
+            ids = self.next_id + np.arange(self.batch_size, dtype=np.int64) * self.step
+            self.next_id += self.batch_size * self.step
+            vectors = self.rng.standard_normal((self.batch_size, self.service.vector_dim)).astype("float32")
+            faiss.normalize_L2(vectors)
+
+            delta = self.service._new_segment_index()
+            delta.add_with_ids(vectors, ids)
+
+            start = time.perf_counter()
+            try:
+                self.service.commit_delta(delta)
+            except Exception as e:
+                self.errors.append(str(e))
+                continue
+            self.commit_seconds += time.perf_counter() - start
+            self.vectors_written += self.batch_size
+
+
+class Reader(threading.Thread):
+    """搜索线程：每次搜索读取一次快照"""
+
+    def __init__(self, service, stop_event, seed, top_k):
+        super().__init__(daemon=True)
+        self.service = service
+        self.stop_event = stop_event
+        self.rng = np.random.default_rng(seed)
+        self.top_k = top_k
+        self.latencies = []
+
+    def run(self):
+        while not self.stop_event.is_set():
+            query = self.rng.standard_normal((1, self.service.vector_dim)).astype("float32")
+            faiss.normalize_L2(query)
+
+            start = time.perf_counter()
+            snapshot = self.service.snapshot
+            if snapshot.ntotal == 0:
+                continue
+            self.service._search_vectors(
+                snapshot.segments, snapshot.tombstones, query, min(self.top_k, snapshot.ntotal)
+            )
+            self.latencies.append(time.perf_counter() - start)
+
+
+def run_phase(service, seconds, num_readers, num_writers, batch_size, first_id, top_k):
+    """同时运行搜索线程和写入线程，返回(搜索线程列表, 写入线程列表)"""
+    stop_event = threading.Event()
+    readers = [Reader(service, stop_event, seed, top_k) for seed in range(num_readers)]
+    writers = [Writer(service, i, num_writers, batch_size, first_id, stop_event) for i in range(num_writers)]
+    for thread in readers + writers:
+        thread.start()
+    time.sleep(seconds)
+    stop_event.set()
+    for thread in readers + writers:
+        thread.join()
+    return readers, writers
+
+
+def run_stress(seconds, num_readers, num_writers, batch_size, initial_vectors, top_k):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        settings.VECTOR_STORE_PATH = tmp_dir
+        # 只测写入与搜索的并发，不触发后台合并
+        settings.VECTOR_SEGMENT_MAX_DELTAS = 1000000
+        # 随机向量没有对应的文档块文本，不维护词法索引
+        settings.HYBRID_SEARCH_ENABLED = False
+        service = VectorDBService.get_instance()
+        service._schedule_merge = lambda: None
+        service._mark_index_updated_in_redis = lambda: True
+
+        # 先写入一批初始数据，写入线程的ID从initial_vectors开始
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((initial_vectors, service.vector_dim)).astype("float32")
+        faiss.normalize_L2(vectors)
+        delta = service._new_segment_index()
+        delta.add_with_ids(vectors, np.arange(initial_vectors, dtype=np.int64))
+        service.commit_delta(delta)
+
+        print(
+            f"向量维度: {service.vector_dim}，初始向量: {initial_vectors}，搜索线程: {num_readers}，"
+            f"写入线程: {num_writers}（每批{batch_size}个向量），每阶段{seconds}秒，CPU核数: {os.cpu_count()}"
+        )
+        header = f"{'阶段':<10}{'搜索QPS':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'写入(向量/s)':>14}{'提交(ms)':>10}"
+        print(header)
+        print("-" * len(header))
+
+        expected = service.ntotal
+        errors = []
+        for label, writers_in_phase in (("空闲", 0), ("写入中", num_writers)):
+            readers, writers = run_phase(
+                service, seconds, num_readers, writers_in_phase, batch_size, initial_vectors, top_k
+            )
+            latencies = np.array([latency for reader in readers for latency in reader.latencies]) * 1000
+            written = sum(writer.vectors_written for writer in writers)
+            commits = sum(writer.vectors_written // batch_size for writer in writers)
+            commit_ms = sum(writer.commit_seconds for writer in writers) * 1000 / max(commits, 1)
+            expected += written
+            errors.extend(error for writer in writers for error in writer.errors)
+            print(
+                f"{label:<10}{len(latencies) / seconds:>10.0f}{np.percentile(latencies, 50):>10.2f}"
+                f"{np.percentile(latencies, 99):>10.2f}{written / seconds:>14.0f}{commit_ms:>10.2f}"
+            )
+
+        # 所有提交都应保留在最终快照和manifest中
+        snapshot = service.snapshot
+        if snapshot.ntotal != expected:
+            errors.append(f"最终快照包含{snapshot.ntotal}个向量，应为{expected}个")
+        if len(snapshot.segments) != len(service.segment_store.read_manifest()["deltas"]):
+            errors.append("最终快照的段与manifest不一致")
+
+        print(f"最终代数: {snapshot.generation}，向量数: {snapshot.ntotal}，段数: {len(snapshot.segments)}")
+        for error in errors[:10]:
+            print(f"  {error}")
+        if errors:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并发写入期间的搜索吞吐量压力测试")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--initial-vectors", type=int, default=50000)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    run_stress(args.seconds, args.readers, args.writers, args.batch_size, args.initial_vectors, args.top_k)
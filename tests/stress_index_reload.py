@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+索引重新加载压力测试
+写入线程模拟其他进程不断写入增量段、追加墓碑并合并，同时由订阅线程的reload_index重新加载；
+多个搜索线程持续搜索，检查每次读取到的快照是否完整一致（段、墓碑与manifest属于同一代），
+并比较重新加载期间与空闲时的搜索延迟
+
+用法: python tests/stress_index_reload.py --seconds 10 --readers 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# 将项目根目录添加到系统路径
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# 设置Django环境
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "smartdocs_project.settings")
+django.setup()
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+from documents.services.faiss_index_factory import FaissIndexFactory
+from documents.services.vector_db_service import VectorDBService
+
+
+def check_snapshot(snapshot):
+    """检查快照内部是否一致，返回不一致的原因，一致时返回None"""
+    manifest = snapshot.manifest
+    expected = sum(segment["ntotal"] for segment in [*manifest["base"], *manifest["deltas"]])
+    if snapshot.ntotal != expected:
+        return f"段向量数{snapshot.ntotal}与manifest记录{expected}不一致"
+    # 写入线程不会重复删除同一个ID，墓碑数量应与manifest记录一致
+    tombstone_count = manifest["tombstones"]["count"] if manifest.get("tombstones") else 0
+    if len(snapshot.tombstones) != tombstone_count:
+        return f"墓碑数量{len(snapshot.tombstones)}与manifest记录{tombstone_count}不一致"
+    return None
+
+
+class Writer(threading.Thread):
+    """模拟写入进程：写入增量段、追加墓碑、合并，再通知本进程重新加载"""
+
+    def __init__(self, service, dim, rng):
+        super().__init__(daemon=True)
+        self.service = service
+        self.dim = dim
+        self.stop_event = threading.Event()
+        self.rng = rng
+        self.next_id = 0
+        self.live_ids = []
+        self.reloads = 0
+        self.reload_seconds = 0.0
+
+    def add_delta(self, count):
+        """写入一个包含count个随机向量的增量段"""
+        ids = np.arange(self.next_id, self.next_id + count, dtype=np.int64)
+        self.next_id += count
+        vectors = self.rng.standard_normal((count, self.dim)).astype("float32")
+        faiss.normalize_L2(vectors)
+        delta = FaissIndexFactory.with_ids(FaissIndexFactory.create_index(FaissIndexFactory.FLAT, self.dim))
+        delta.add_with_ids(vectors, ids)
+        self.service.segment_store.add_delta(delta)
+        self.live_ids.extend(ids.tolist())
+
+    def run(self):
+        store = self.service.segment_store
+        iteration = 0
+        while not self.stop_event.is_set():
+            iteration += 1
+            self.add_delta(200)
+
+            if iteration % 3 == 0:
+                deleted = self.rng.choice(self.live_ids, 50, replace=False)
+                store.add_tombstones(deleted)
+                deleted_set = set(deleted.tolist())
+                self.live_ids = [chunk_id for chunk_id in self.live_ids if chunk_id not in deleted_set]
+
+            # 与订阅线程收到通知后的处理相同
+            start = time.perf_counter()
+            self.service.reload_index()
+            self.reload_seconds += time.perf_counter() - start
+            self.reloads += 1
+
+            if iteration % 10 == 0:
+                self.service.merge_segments()
+
+
+class Reader(threading.Thread):
+    """搜索线程：每次搜索读取一次快照，检查快照一致性和搜索结果"""
+
+    def __init__(self, service, dim, stop_event, seed):
+        super().__init__(daemon=True)
+        self.service = service
+        self.stop_event = stop_event
+        self.rng = np.random.default_rng(seed)
+        self.dim = dim
+        self.latencies = []
+        self.errors = []
+
+    def run(self):
+        while not self.stop_event.is_set():
+            query = self.rng.standard_normal((1, self.dim)).astype("float32")
+            faiss.normalize_L2(query)
+
+            start = time.perf_counter()
+            snapshot = self.service.snapshot
+            if snapshot.ntotal == 0:
+                continue
+            _, indices = self.service._search_vectors(
+                snapshot.segments, snapshot.tombstones, query, min(10, snapshot.ntotal)
+            )
+            self.latencies.append(time.perf_counter() - start)
+
+            problem = check_snapshot(snapshot)
+            if problem is None and snapshot.tombstones.contains(indices[indices >= 0]).any():
+                problem = "搜索结果包含快照中已删除的向量"
+            if problem:
+                self.errors.append(f"代数{snapshot.generation}: {problem}")
+
+
+def run_readers(service, dim, seconds, num_readers):
+    """运行搜索线程，返回搜索线程列表"""
+    stop_event = threading.Event()
+    readers = [Reader(service, dim, stop_event, seed) for seed in range(num_readers)]
+    for reader in readers:
+        reader.start()
+    time.sleep(seconds)
+    stop_event.set()
+    for reader in readers:
+        reader.join()
+    return readers
+
+
+def summarize(label, readers, seconds):
+    latencies = np.array([latency for reader in readers for latency in reader.latencies]) * 1000
+    errors = [error for reader in readers for error in reader.errors]
+    print(
+        f"{label:<10}{len(latencies) / seconds:>10.0f}{np.percentile(latencies, 50):>10.2f}"
+        f"{np.percentile(latencies, 99):>10.2f}{latencies.max():>10.2f}{len(errors):>8}"
+    )
+    return errors
+
+
+def run_stress(seconds, num_readers):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        settings.VECTOR_STORE_PATH = tmp_dir
+        settings.VECTOR_SEGMENT_MAX_DELTAS = 4
+        # 随机向量没有对应的文档块文本，不维护词法索引
+        settings.HYBRID_SEARCH_ENABLED = False
+        service = VectorDBService.get_instance()
+        dim = service.vector_dim
+        rng = np.random.default_rng(0)
+
+        # 先写入一批初始数据
+        writer = Writer(service, dim, rng)
+        for _ in range(3):
+            writer.add_delta(2000)
+        service.reload_index()
+
+        print(f"向量维度: {dim}，搜索线程: {num_readers}，每阶段{seconds}秒")
+        header = f"{'阶段':<10}{'QPS':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'不一致':>8}"
+        print(header)
+        print("-" * len(header))
+
+        idle_errors = summarize("空闲", run_readers(service, dim, seconds, num_readers), seconds)
+
+        writer.start()
+        busy_errors = summarize("重新加载中", run_readers(service, dim, seconds, num_readers), seconds)
+        writer.stop_event.set()
+        writer.join()
+
+        print(
+            f"重新加载{writer.reloads}次，平均{writer.reload_seconds * 1000 / max(writer.reloads, 1):.1f}ms，"
+            f"最终代数: {service.snapshot.generation}，向量数: {service.ntotal}"
+        )
+        for error in (idle_errors + busy_errors)[:10]:
+            print(f"  {error}")
+        if idle_errors or busy_errors:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="索引重新加载期间的快照一致性与搜索延迟压力测试")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    run_stress(args.seconds, args.readers)
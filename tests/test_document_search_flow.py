@@ -33,6 +33,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "smartdocs_project.settings")
 django.setup()
 
 # 导入需要的模块
+import faiss
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 
@@ -45,6 +46,8 @@ try:
     print("成功导入DocumentProcessor")
     
     from documents.services.vector_db_service import VectorDBService
+    from documents.services.faiss_index_factory import FaissIndexFactory
+    from documents.services.vector_segment_store import VectorSegmentStore
     print("成功导入VectorDBService")
     
     from documents.services.embedding_service import EmbeddingService
@@ -188,10 +191,11 @@ def index_document(doc_id):
 
     if success:
         logger.info(f"文档索引成功，耗时: {index_time:.2f}秒")
-        logger.info(f"当前索引包含{vector_db.index.ntotal}个向量")
+        logger.info(f"当前索引包含{vector_db.ntotal}个向量，分为{len(vector_db.segments)}个段")
 
-        # 检查映射大小
-        logger.info(f"chunk_mapping包含{len(vector_db.chunk_mapping)}个映射条目")
+        # 检查索引中的文档块ID
+        indexed_ids = sum(len(FaissIndexFactory.get_ids(index)) for _, index in vector_db.segments)
+        logger.info(f"索引中包含{indexed_ids}个文档块ID")
 
         # 检查向量ID是否保存到数据库
         chunks_with_vector_id = DocumentChunk.objects.filter(
@@ -241,22 +245,25 @@ def verify_mapping_persistence():
     """验证映射持久化是否正常"""
     logger.info("步骤5: 验证映射持久化")
 
-    # 检查映射文件是否存在
-    from django.conf import settings
+    # 向量ID与文档块ID的映射保存在模型版本目录下的各个索引段文件中
+    from documents.services.model_storage import model_storage_path
 
-    mapping_file = os.path.join(settings.VECTOR_STORE_PATH, "chunk_mapping.pkl")
+    segment_store = VectorSegmentStore(model_storage_path(TEST_EMBEDDING_MODEL))
 
-    if os.path.exists(mapping_file):
-        file_size = os.path.getsize(mapping_file)
-        logger.info(f"映射文件存在: {mapping_file}, 大小: {file_size / 1024:.2f} KB")
+    if segment_store.exists():
+        manifest = segment_store.read_manifest()
+        logger.info(f"manifest存在: {segment_store.manifest_file}, 分段信息: {VectorSegmentStore.describe(manifest)}")
 
-        # 创建一个新的VectorDBService实例，验证是否能加载映射
-        new_vector_db = VectorDBService()
-        logger.info(f"重新加载的chunk_mapping包含{len(new_vector_db.chunk_mapping)}个映射条目")
+        # 直接读取段文件，验证文档块ID是否随索引一起保存
+        indexed_ids = 0
+        for name in VectorSegmentStore.segment_names(manifest):
+            index = faiss.read_index(segment_store.segment_path(name))
+            indexed_ids += len(FaissIndexFactory.get_ids(index))
+        logger.info(f"重新加载的索引段包含{indexed_ids}个文档块ID")
 
         return True
     else:
-        logger.error(f"映射文件不存在: {mapping_file}")
+        logger.error(f"manifest不存在: {segment_store.manifest_file}")
         return False
 
 